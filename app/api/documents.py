@@ -1,90 +1,325 @@
-from fastapi import APIRouter, Depends, Form, HTTPException, Response, UploadFile, File
-from sqlalchemy.orm import Session
-from app.core.database import get_db
-from app.core.config import settings
-from app.models import Document, DocumentVersion
-from app.schemas import DocumentCreate, DocumentUpdate, DocumentResponse, DocumentVersionResponse
-from app.services.converter import converter_service
-from app.services.pdf_generator import pdf_service
+from fastapi import APIRouter, Depends, Form, HTTPException, Query, Request, Response, UploadFile, File
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, load_only
+from app.api.downloads import download_response
+from app.core import metrics
+from app.core.database import async_session_scope, get_async_db, get_db, session_scope
+from app.models import ConversionJob, Document, DocumentVersion
+from app.schemas import (
+    DocumentCreate, DocumentListResponse, DocumentResponse, DocumentSort, DocumentSummary, DocumentUpdate,
+    DocumentVersionResponse, JobResponse, MathBackend, PageTemplateName, RenderMode
+)
+from app.services.blob_store import blob_store
+from app.services.compression import is_compressed_object
+from app.services.jobs import job_runner, remove_job_results
+from app.services.render_executor import RenderQueueFull, render_document_job, render_executor
+from app.services.source_history import source_history
 from app.services.storage import storage_service
-from app.utils import slugify
+from datetime import datetime
+from typing import List, Optional, Union
+import base64
 import os
 import json
+import logging
+import mimetypes
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# Hàm dùng chung để tạo Document
+
+def set_render_headers(response: Optional[Response], render_info: dict):
+    """X-Cache: hit|miss; với chế độ 'sections' thêm X-Render-Sections: số phần dùng lại/render lại."""
+    if response is None:
+        return
+    response.headers["X-Cache"] = render_info["cache"]
+    sections = render_info.get("sections")
+    if sections:
+        response.headers["X-Render-Sections"] = f"total={sections['total']}; reused={sections['reused']}; rendered={sections['rendered']}"
+
+
+# Hàm dùng chung để lưu một Version mới (source + PDF đã render) cho Document
+def store_document_version(
+    db: Session,
+    doc: Document,
+    content: str,
+    fmt: str,
+    show_page_number: bool,
+    pdf_bytes: bytes,
+    source_original_bytes: bytes = None,
+    source_extension: str = ".md",
+    math_backend: Optional[str] = None,
+    render_mode: Optional[str] = None,
+    template: Optional[str] = None
+):
+    new_version = doc.current_version + 1
+
+    if source_original_bytes is None:
+        source_data = content.encode('utf-8')
+    else:
+        source_data = source_original_bytes
+
+    # Lưu theo hash nội dung: version có source/PDF giống hệt version trước chỉ thêm tham chiếu, không upload lại.
+    # SOURCE_STORAGE_MODE=delta: source có thể được lưu dưới dạng delta so với version trước (source_history)
+    source_filename = f"v{new_version}_source{source_extension}"
+    source_type = mimetypes.guess_type(source_filename)[0] or "application/octet-stream"
+    source_columns = source_history.store(db, doc, new_version, source_data, source_type)
+    pdf_object_name = blob_store.acquire(db, pdf_bytes, "application/pdf")
+
+    version_entry = DocumentVersion(
+        document_id=doc.id,
+        version_number=new_version,
+        minio_path=pdf_object_name,
+        source_extension=fmt,
+        source_filename=source_filename,
+        **source_columns
+    )
+    db.add(version_entry)
+
+    doc.current_content = content
+    doc.content_format = fmt
+    doc.show_page_number = show_page_number
+    doc.math_backend = math_backend
+    doc.render_mode = render_mode
+    doc.template = template
+    doc.current_version = new_version
+
+    with metrics.stage("db_commit"):
+        db.commit()
+    db.refresh(doc)
+    return doc
+
+
+def store_rendered_version(doc_id: int, content: str, fmt: str, show_page_number: bool, pdf_bytes: bytes, **options) -> Document:
+    """
+    Lưu version mới sau khi đã render xong, trong một session ngắn:
+    Document chỉ bị khóa (FOR UPDATE) và kết nối DB chỉ bị giữ trong lúc ghi version.
+    """
+    with session_scope() as db:
+        doc = db.query(Document).filter(Document.id == doc_id).with_for_update().first()
+        if not doc:
+            raise HTTPException(status_code=404, detail="Không tìm thấy tài liệu.")
+        try:
+            return store_document_version(db, doc, content, fmt, show_page_number, pdf_bytes, **options)
+        except Exception:
+            db.rollback()
+            raise
+
+
+def discard_document(doc_id: int):
+    with session_scope() as db:
+        db.query(Document).filter(Document.id == doc_id).delete()
+        db.commit()
+
+
+# Hàm dùng chung để tạo Document.
+# Không nhận session từ route: mỗi lượt đọc/ghi mở session riêng, không giữ kết nối DB trong lúc render.
 def process_create_document(
-    db: Session, 
     title: str, 
     content: str, 
     fmt: str, 
     show_page_number: bool,
     source_original_bytes: bytes = None, 
-    source_extension: str = ".txt"
+    source_extension: str = ".txt",
+    math_backend: Optional[str] = None,
+    render_mode: Optional[str] = None,
+    template: Optional[str] = None,
+    async_mode: bool = False,
+    response: Optional[Response] = None
 ):
-    # Tạo Slug cho Title
-    safe_title = slugify(title)
-
-    # Lưu vào DB
-    new_doc = Document(
-        title=title,
-        current_content=content,
-        content_format=fmt,
-        show_page_number=show_page_number,
-        current_version=1
-    )
-    db.add(new_doc)
-    db.commit()
-    db.refresh(new_doc)
+    # Lưu vào DB, version 1 được tạo khi render xong
+    with session_scope(expire_on_commit=False) as db:
+        new_doc = Document(
+            title=title,
+            current_content=content,
+            content_format=fmt,
+            show_page_number=show_page_number,
+            math_backend=math_backend,
+            render_mode=render_mode,
+            template=template,
+            current_version=0
+        )
+        db.add(new_doc)
+        db.commit()
 
-    folder_name = f"{safe_title}_{new_doc.id}"
+        if async_mode:
+            # Trả về job ngay, worker sẽ render và tạo DocumentVersion khi xong
+            return job_runner.submit(
+                db,
+                kind="document_create",
+                document_id=new_doc.id,
+                content=content,
+                content_format=fmt,
+                show_page_number=show_page_number,
+                math_backend=math_backend,
+                render_mode=render_mode,
+                template=template,
+                source_extension=source_extension
+            )
+
+    with metrics.track_request("documents.create", fmt):
+        metrics.DOCUMENT_SIZE_BYTES.observe(len(content.encode("utf-8")))
+        try:
+            # Tạo PDF (render trên process pool, không chiếm thread của API)
+            pdf_bytes, render_info = render_executor.run_sync(
+                render_document_job,
+                content,
+                fmt=fmt,
+                show_page_number=show_page_number,
+                math_backend=math_backend,
+                render_mode=render_mode,
+                template=template
+            )
+            set_render_headers(response, render_info)
+
+            return store_rendered_version(
+                new_doc.id, content, fmt, show_page_number, pdf_bytes,
+                source_original_bytes=source_original_bytes,
+                source_extension=source_extension,
+                math_backend=math_backend,
+                render_mode=render_mode,
+                template=template
+            )
+        
+        except RenderQueueFull:
+            discard_document(new_doc.id)
+            raise
+        except Exception as e:
+            discard_document(new_doc.id)
+            raise HTTPException(status_code=500, detail=f"Lỗi xử lý tài liệu: {str(e)}")
+
+
+# Hàm dùng chung để tạo Version mới cho Document.
+# doc là bản đã đọc xong (session đã đóng), chỉ dùng để lấy id và các tùy chọn hiện tại.
+def process_update_document(
+    doc: Document,
+    content: str,
+    fmt: str,
+    show_page_number: bool,
+    source_original_bytes: bytes = None,
+    source_extension: str = ".md",
+    math_backend: Optional[str] = None,
+    render_mode: Optional[str] = None,
+    template: Optional[str] = None,
+    async_mode: bool = False,
+    response: Optional[Response] = None
+):
+    # None = giữ backend/chế độ render/mẫu trang hiện tại của tài liệu
+    math_backend = math_backend or doc.math_backend
+    render_mode = render_mode or doc.render_mode
+    template = template or doc.template
+
+    if async_mode:
+        # Số version được xác định khi job hoàn thành, không phải lúc gửi
+        with session_scope() as db:
+            return job_runner.submit(
+                db,
+                kind="document_update",
+                document_id=doc.id,
+                content=content,
+                content_format=fmt,
+                show_page_number=show_page_number,
+                math_backend=math_backend,
+                render_mode=render_mode,
+                template=template,
+                source_extension=source_extension
+            )
+
+    with metrics.track_request("documents.update", fmt):
+        metrics.DOCUMENT_SIZE_BYTES.observe(len(content.encode("utf-8")))
+        pdf_bytes, render_info = render_executor.run_sync(
+            render_document_job,
+            content,
+            fmt=fmt,
+            show_page_number=show_page_number,
+            math_backend=math_backend,
+            render_mode=render_mode,
+            template=template
+        )
+        set_render_headers(response, render_info)
+        if "sections" in render_info:
+            logger.info(f"Document {doc.id} update: {render_info['sections']}")
+
+        return store_rendered_version(
+            doc.id, content, fmt, show_page_number, pdf_bytes,
+            source_original_bytes=source_original_bytes,
+            source_extension=source_extension,
+            math_backend=math_backend,
+            render_mode=render_mode,
+            template=template
+        )
+
+
+def run_document_job(db: Session, job: ConversionJob) -> str:
+    """
+    Handler cho job 'document_create'/'document_update': render rồi lưu version mới.
+    Document được khóa (FOR UPDATE) chỉ trong lúc ghi version, không khóa trong lúc render.
+    """
+    with metrics.request_labels(endpoint=f"jobs.{job.kind}", format=job.content_format):
+        metrics.DOCUMENT_SIZE_BYTES.observe(len(job.content.encode("utf-8")))
+        pdf_bytes, render_info = render_executor.run_sync(
+            render_document_job,
+            job.content,
+            fmt=job.content_format,
+            show_page_number=job.show_page_number,
+            math_backend=job.math_backend,
+            render_mode=job.render_mode,
+            template=job.template
+        )
+    if "sections" in render_info:
+        logger.info(f"Job {job.id} (document {job.document_id}): {render_info['sections']}")
+
+    doc = db.query(Document).filter(Document.id == job.document_id).with_for_update().first()
+    if not doc:
+        raise ValueError("Tài liệu không còn tồn tại.")
 
     try:
-        if source_original_bytes is None:
-            source_data = content.encode('utf-8')
-        else:
-            source_data = source_original_bytes
-
-        # Định nghĩa đường dẫn Source
-        source_object_name = f"sources/{folder_name}/v1_source{source_extension}"
-        storage_service.upload_pdf(source_data, source_object_name)
-        
-        # Tạo và lưu PDF
-        if fmt == "markdown":
-            html_content_for_pdf = converter_service.convert_to_html(new_doc.current_content)
-        else:
-            html_content_for_pdf = new_doc.current_content
-
-        pdf_bytes = pdf_service.generate_pdf(html_content_for_pdf, show_page_number=show_page_number)
-
-        # Upload lên MinIO
-        pdf_object_name = f"documents/{folder_name}/v1.pdf"
-        storage_service.upload_pdf(pdf_bytes, pdf_object_name)
-
-        # Lưu lịch sử Version
-        version_entry = DocumentVersion(
-            document_id=new_doc.id,
-            version_number=1,
-            minio_path=pdf_object_name,
-            source_path=source_object_name,
-            source_extension=fmt
+        store_document_version(
+            db, doc, job.content, job.content_format, job.show_page_number, pdf_bytes,
+            source_extension=job.source_extension,
+            math_backend=job.math_backend,
+            render_mode=job.render_mode,
+            template=job.template
         )
-        db.add(version_entry)
-        db.commit()
-        
-        return new_doc
-        
-    except Exception as e:
-        db.delete(new_doc)
-        db.commit()
-        raise HTTPException(status_code=500, detail=f"Lỗi xử lý tài liệu: {str(e)}")
+    except Exception:
+        db.rollback()
+        raise
+
+    version_record = db.query(DocumentVersion).filter(
+        DocumentVersion.document_id == doc.id,
+        DocumentVersion.version_number == doc.current_version
+    ).first()
+    job.version_number = doc.current_version
+    return version_record.minio_path
 
 
-@router.post("/", response_model=DocumentResponse)
-def create_document(doc_in: DocumentCreate, db: Session = Depends(get_db)):
+def run_document_create_job(db: Session, job: ConversionJob) -> str:
+    try:
+        return run_document_job(db, job)
+    except RenderQueueFull:
+        raise
+    except Exception:
+        # Giống chế độ đồng bộ: tạo thất bại thì không giữ lại Document rỗng
+        db.rollback()
+        doc = db.query(Document).filter(Document.id == job.document_id).first()
+        if doc and doc.current_version == 0:
+            job.document_id = None
+            db.delete(doc)
+            db.commit()
+        raise
+
+
+job_runner.register("document_create", run_document_create_job)
+job_runner.register("document_update", run_document_job)
+
+
+@router.post("/", response_model=Union[DocumentResponse, JobResponse])
+def create_document(doc_in: DocumentCreate, response: Response, async_mode: bool = False):
     """
-    Tạo Document từ nội dung thô (Markdown hoặc HTML)
+    Tạo Document từ nội dung thô (Markdown hoặc HTML).
+    async_mode=true: trả về job (202) ngay, theo dõi qua GET /api/v1/jobs/{id}.
     """
     ext = ".md" if doc_in.content_format == "markdown" else ".html"
     
@@ -95,22 +330,33 @@ def create_document(doc_in: DocumentCreate, db: Session = Depends(get_db)):
     except ValueError:
         pass
 
-    return process_create_document(
-        db=db, 
+    result = process_create_document(
         title=doc_in.title, 
         content=doc_in.content, 
         fmt=doc_in.content_format,
         show_page_number=doc_in.show_page_number,
         source_original_bytes=None,
-        source_extension=ext
+        source_extension=ext,
+        math_backend=doc_in.math_backend.value if doc_in.math_backend else None,
+        render_mode=doc_in.render_mode.value if doc_in.render_mode else None,
+        template=doc_in.template.value if doc_in.template else None,
+        async_mode=async_mode,
+        response=response
     )
+    if async_mode:
+        response.status_code = 202
+    return result
 
 
-@router.post("/upload", response_model=DocumentResponse)
+@router.post("/upload", response_model=Union[DocumentResponse, JobResponse])
 async def create_document_from_file(
+    response: Response,
     file: UploadFile = File(...), 
     show_page_number: bool = Form(True),
-    db: Session = Depends(get_db)
+    math_backend: Optional[MathBackend] = Form(None),
+    render_mode: Optional[RenderMode] = Form(None),
+    template: Optional[PageTemplateName] = Form(None),
+    async_mode: bool = Form(False)
 ):
     """
     Tạo Document từ file upload (.md, .html, .txt)
@@ -130,69 +376,69 @@ async def create_document_from_file(
     content_bytes = await file.read()
     content_str = content_bytes.decode("utf-8")
 
-    return process_create_document(
-        db=db, 
+    # process_create_document gọi DB/MinIO/render đồng bộ nên không chạy trực tiếp trên event loop
+    result = await run_in_threadpool(
+        process_create_document,
         title=base_name, 
         content=content_str, 
         fmt=fmt,
         show_page_number=show_page_number,
         source_original_bytes=content_bytes,
-        source_extension=ext
+        source_extension=ext,
+        math_backend=math_backend.value if math_backend else None,
+        render_mode=render_mode.value if render_mode else None,
+        template=template.value if template else None,
+        async_mode=async_mode,
+        response=response
     )
+    if async_mode:
+        response.status_code = 202
+    return result
 
 
-@router.put("/{doc_id}", response_model=DocumentResponse)
-def update_document(doc_id: int, doc_in: DocumentUpdate, db: Session = Depends(get_db)):
-    doc = db.query(Document).filter(Document.id == doc_id).first()
+@router.put("/{doc_id}", response_model=Union[DocumentResponse, JobResponse])
+def update_document(doc_id: int, doc_in: DocumentUpdate, response: Response, async_mode: bool = False):
+    """
+    Tạo version mới cho Document.
+    async_mode=true: trả về job (202) ngay, DocumentVersion được tạo khi job hoàn thành.
+    """
+    with session_scope() as db:
+        doc = db.query(Document).filter(Document.id == doc_id).first()
     if not doc:
         raise HTTPException(status_code=404, detail="Không tìm thấy tài liệu.")
 
-    new_version = doc.current_version + 1
-    safe_title = slugify(doc.title)
-    folder_name = f"{safe_title}_{doc.id}"
-
     source_ext = ".md" if doc_in.content_format == "markdown" else ".html"
-    source_object_name = f"sources/{folder_name}/v{new_version}_source{source_ext}"
-    source_data = doc_in.content.encode('utf-8')
-    storage_service.upload_pdf(source_data, source_object_name)
 
-    if doc_in.content_format == "markdown":
-        html_content = converter_service.convert_to_html(doc_in.content)
-    else:
-        html_content = doc_in.content
-
-    pdf_bytes = pdf_service.generate_pdf(html_content, show_page_number=doc_in.show_page_number)
-
-    pdf_object_name = f"documents/{folder_name}/v{new_version}.pdf"
-    storage_service.upload_pdf(pdf_bytes, pdf_object_name)
-
-    version_entry = DocumentVersion(
-        document_id=doc.id,
-        version_number=new_version,
-        minio_path=pdf_object_name,
-        source_path=source_object_name,
-        source_extension=doc_in.content_format
+    result = process_update_document(
+        doc=doc,
+        content=doc_in.md_content,
+        fmt=doc_in.content_format,
+        show_page_number=doc_in.show_page_number,
+        source_extension=source_ext,
+        math_backend=doc_in.math_backend.value if doc_in.math_backend else None,
+        render_mode=doc_in.render_mode.value if doc_in.render_mode else None,
+        template=doc_in.template.value if doc_in.template else None,
+        async_mode=async_mode,
+        response=response
     )
-    db.add(version_entry)
-
-    doc.current_content = doc_in.content
-    doc.content_format = doc_in.content_format
-    doc.show_page_number = doc_in.show_page_number
-    doc.current_version = new_version
-    
-    db.commit()
-    db.refresh(doc)
-    return doc
+    if async_mode:
+        response.status_code = 202
+    return result
 
 
-@router.put("/{doc_id}/upload", response_model=DocumentResponse)
+@router.put("/{doc_id}/upload", response_model=Union[DocumentResponse, JobResponse])
 async def update_document_from_file(
     doc_id: int,
+    response: Response,
     file: UploadFile = File(...),
     show_page_number: bool = Form(True),
-    db: Session = Depends(get_db)
+    math_backend: Optional[MathBackend] = Form(None),
+    render_mode: Optional[RenderMode] = Form(None),
+    template: Optional[PageTemplateName] = Form(None),
+    async_mode: bool = Form(False)
 ):
-    doc = db.query(Document).filter(Document.id == doc_id).first()
+    async with async_session_scope() as db:
+        doc = await db.get(Document, doc_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Không tìm thấy tài liệu.")
 
@@ -211,102 +457,207 @@ async def update_document_from_file(
     content_bytes = await file.read()
     content_str = content_bytes.decode("utf-8")
 
-    new_version = doc.current_version + 1
-    safe_title = slugify(doc.title)
-    folder_name = f"{safe_title}_{doc.id}"
+    result = await run_in_threadpool(
+        process_update_document,
+        doc=doc,
+        content=content_str,
+        fmt=fmt,
+        show_page_number=show_page_number,
+        source_original_bytes=content_bytes,
+        source_extension=source_ext,
+        math_backend=math_backend.value if math_backend else None,
+        render_mode=render_mode.value if render_mode else None,
+        template=template.value if template else None,
+        async_mode=async_mode,
+        response=response
+    )
+    if async_mode:
+        response.status_code = 202
+    return result
 
-    source_object_name = f"sources/{folder_name}/v{new_version}_source{source_ext}"
-    storage_service.upload_pdf(content_bytes, source_object_name)
 
-    if fmt == "markdown":
-        html_content = converter_service.convert_to_html(content_str)
-    else:
-        html_content = content_str
-        
-    pdf_bytes = pdf_service.generate_pdf(html_content, show_page_number=show_page_number)
+# Cột của danh sách tài liệu; cột nặng (có thể tới hàng MB) chỉ được tải khi client yêu cầu qua ?fields=
+SUMMARY_FIELDS = (
+    "id", "title", "content_format", "current_version", "show_page_number",
+    "math_backend", "render_mode", "template", "created_at", "updated_at"
+)
+HEAVY_FIELDS = ("current_content",)
 
-    pdf_object_name = f"documents/{folder_name}/v{new_version}.pdf"
-    storage_service.upload_pdf(pdf_bytes, pdf_object_name)
 
-    version_entry = DocumentVersion(
-        document_id=doc.id,
-        version_number=new_version,
-        minio_path=pdf_object_name,
-        source_path=source_object_name,
-        source_extension=fmt
-    )
-    db.add(version_entry)
+def encode_cursor(doc: Document) -> str:
+    raw = f"{doc.updated_at.isoformat()}|{doc.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
 
-    doc.current_content = content_str
-    doc.content_format = fmt
-    doc.show_page_number = show_page_number
-    doc.current_version = new_version
 
-    db.commit()
-    db.refresh(doc)
-    return doc
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        updated_at, doc_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(updated_at), int(doc_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor không hợp lệ.")
+
+
+@router.get("/", response_model=DocumentListResponse, response_model_exclude_unset=True)
+async def list_documents(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    title_prefix: Optional[str] = None,
+    sort: DocumentSort = DocumentSort.newest,
+    fields: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Danh sách tài liệu, phân trang keyset theo (updated_at, id) thay vì OFFSET:
+    mỗi trang là một lần quét index ix_documents_updated_at_id bắt đầu ngay sau dòng cuối của trang trước,
+    nên trang sâu cũng nhanh như trang đầu và không lặp/sót dòng khi có tài liệu mới được sửa.
+    - cursor: giá trị next_cursor của trang trước.
+    - title_prefix: chỉ lấy tài liệu có tiêu đề bắt đầu bằng chuỗi này.
+    - sort: -updated_at (mặc định, sửa gần nhất trước) hoặc updated_at.
+    - fields=current_content: trả kèm nội dung hiện tại (mặc định không tải cột này).
+    """
+    extra = [name.strip() for name in fields.split(",") if name.strip()] if fields else []
+    unknown = [name for name in extra if name not in HEAVY_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Trường không hỗ trợ: {', '.join(unknown)}")
+    columns = SUMMARY_FIELDS + tuple(name for name in HEAVY_FIELDS if name in extra)
+
+    descending = sort == DocumentSort.newest
+    query = select(Document).options(load_only(*(getattr(Document, name) for name in columns)))
+    if title_prefix:
+        query = query.where(Document.title.startswith(title_prefix, autoescape=True))
+    if cursor:
+        key = tuple_(Document.updated_at, Document.id)
+        position = tuple_(*decode_cursor(cursor))
+        query = query.where(key < position if descending else key > position)
+    if descending:
+        query = query.order_by(Document.updated_at.desc(), Document.id.desc())
+    else:
+        query = query.order_by(Document.updated_at, Document.id)
+
+    # Lấy thừa một dòng để biết còn trang sau hay không
+    docs = (await db.scalars(query.limit(limit + 1))).all()
+    items = [DocumentSummary(**{name: getattr(doc, name) for name in columns}) for doc in docs[:limit]]
+    return DocumentListResponse(
+        items=items,
+        next_cursor=encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    )
 
 
 @router.get("/{doc_id}", response_model=DocumentResponse)
-def get_document_detail(doc_id: int, db: Session = Depends(get_db)):
+async def get_document_detail(doc_id: int, db: AsyncSession = Depends(get_async_db)):
     """
     API này trả về toàn bộ thông tin hiện tại của Document.
     """
-    doc = db.query(Document).filter(Document.id == doc_id).first()
+    doc = await db.get(Document, doc_id)
     if not doc:
         raise HTTPException(status_code=404, detail="Không tìm thấy tài liệu.")
     return doc
 
 
-@router.get("/{doc_id}/source")
-def get_document_source(doc_id: int, version: int = None, db: Session = Depends(get_db)):
-    query = db.query(DocumentVersion).filter(DocumentVersion.document_id == doc_id)
+@router.get("/{doc_id}/versions", response_model=List[DocumentVersionResponse])
+async def list_document_versions(doc_id: int):
+    """
+    Danh sách version của Document (mới nhất trước), kèm presigned URL tải PDF của từng version.
+    """
+    async with async_session_scope() as db:
+        versions = (await db.scalars(
+            select(DocumentVersion)
+            .where(DocumentVersion.document_id == doc_id)
+            .order_by(DocumentVersion.version_number.desc())
+        )).all()
+        exists = bool(versions) or await db.scalar(select(Document.id).where(Document.id == doc_id)) is not None
+    if not exists:
+        raise HTTPException(status_code=404, detail="Không tìm thấy tài liệu.")
+
+    return [
+        DocumentVersionResponse(
+            version_number=v.version_number,
+            created_at=v.created_at,
+            download_url=storage_service.get_presigned_url(v.minio_path, filename=f"document_v{v.version_number}.pdf")
+            if v.minio_path else None
+        )
+        for v in versions
+    ]
+
+
+async def find_version(doc_id: int, version: int = None) -> Optional[DocumentVersion]:
+    """Version version_number=version của tài liệu (None = mới nhất). Session đóng trước khi tải file."""
+    query = select(DocumentVersion).where(DocumentVersion.document_id == doc_id)
     if version:
-        version_record = query.filter(DocumentVersion.version_number == version).first()
+        query = query.where(DocumentVersion.version_number == version)
     else:
-        version_record = query.order_by(DocumentVersion.version_number.desc()).first()
+        query = query.order_by(DocumentVersion.version_number.desc())
+    async with async_session_scope() as db:
+        return await db.scalar(query.limit(1))
+
+
+async def find_source_chain(version_record: DocumentVersion) -> List[DocumentVersion]:
+    """Các version từ keyframe tới version_record (tăng dần), đủ để dựng lại source của nó."""
+    async with async_session_scope() as db:
+        return (await db.scalars(
+            select(DocumentVersion)
+            .where(
+                DocumentVersion.document_id == version_record.document_id,
+                DocumentVersion.version_number >= version_record.source_keyframe,
+                DocumentVersion.version_number <= version_record.version_number
+            )
+            .order_by(DocumentVersion.version_number)
+        )).all()
+
+
+@router.get("/{doc_id}/source")
+async def get_document_source(doc_id: int, request: Request, version: int = None, redirect: Optional[bool] = None):
+    """
+    Tải file gốc của một version (mặc định version mới nhất).
+    redirect=true: trả 302 tới presigned URL của MinIO; không truyền thì theo DOWNLOAD_MODE.
+    Version lưu dạng delta hoặc lưu nén luôn được dựng lại/giải nén và trả trực tiếp.
+    """
+    version_record = await find_version(doc_id, version)
 
     if not version_record or not version_record.source_path:
         raise HTTPException(status_code=404, detail="Không tìm thấy phiên bản tài liệu.")
 
-    file_content = storage_service.get_file_content(version_record.source_path)
-    
-    if not file_content:
-        raise HTTPException(status_code=500, detail="Lỗi kết nối MinIO")
-
-    base_name = os.path.basename(version_record.source_path)
+    base_name = version_record.source_filename or os.path.basename(version_record.source_path)
+
+    if version_record.source_keyframe is not None:
+        # Version lưu dạng delta: không có object để stream/redirect, dựng lại từ keyframe (có cache)
+        chain = await find_source_chain(version_record)
+        try:
+            content = await run_in_threadpool(source_history.reconstruct, chain)
+        except ValueError as e:
+            raise HTTPException(status_code=500, detail=f"Lỗi dựng lại source: {str(e)}")
+    elif is_compressed_object(version_record.source_path):
+        # Object trên MinIO là bản nén: presigned URL/Range sẽ trả byte nén, nên giải nén rồi trả qua API
+        content = await run_in_threadpool(storage_service.get_file_content, version_record.source_path)
+        if content is None:
+            raise HTTPException(status_code=500, detail="Lỗi kết nối MinIO")
+    else:
+        return await run_in_threadpool(
+            download_response, request, version_record.source_path, "application/octet-stream", base_name, redirect
+        )
 
     return Response(
-        content=file_content,
+        content=content,
         media_type="application/octet-stream",
-        headers={
-            "Content-Disposition": f"attachment; filename={base_name}"
-        }
+        headers={"Content-Disposition": f"attachment; filename={base_name}"}
     )
 
 
 @router.get("/{doc_id}/pdf")
-def get_document_pdf(doc_id: int, version: int = None, db: Session = Depends(get_db)):
-    query = db.query(DocumentVersion).filter(DocumentVersion.document_id == doc_id)
-    if version:
-        version_record = query.filter(DocumentVersion.version_number == version).first()
-    else:
-        version_record = query.order_by(DocumentVersion.version_number.desc()).first()
+async def get_document_pdf(doc_id: int, request: Request, version: int = None, redirect: Optional[bool] = None):
+    """
+    Tải PDF của một version (mặc định version mới nhất).
+    redirect=true: trả 302 tới presigned URL của MinIO; không truyền thì theo DOWNLOAD_MODE.
+    """
+    version_record = await find_version(doc_id, version)
 
     if not version_record:
         raise HTTPException(status_code=404, detail="Không tìm thấy phiên bản tài liệu.")
 
-    file_content = storage_service.get_file_content(version_record.minio_path)
-    
-    if not file_content:
-         raise HTTPException(status_code=500, detail="Lỗi kết nối MinIO")
-
-    return Response(
-        content=file_content,
-        media_type="application/pdf",
-        headers={
-            "Content-Disposition": f"attachment; filename=document_v{version_record.version_number}.pdf"
-        }
+    return await run_in_threadpool(
+        download_response,
+        request, version_record.minio_path, "application/pdf", f"document_v{version_record.version_number}.pdf", redirect
     )
 
 
@@ -321,18 +672,32 @@ def delete_document(doc_id: int, db: Session = Depends(get_db)):
     if not doc:
         raise HTTPException(status_code=404, detail="Không tìm thấy tài liệu.")
 
-    # Lấy danh sách các version để xóa file trên MinIO
+    # Lấy danh sách các version để bỏ tham chiếu tới file trên MinIO
     versions = db.query(DocumentVersion).filter(DocumentVersion.document_id == doc_id).all()
-    
+
+    released = []
+    legacy_paths = []
     for v in versions:
-        if v.minio_path:
-            storage_service.client.remove_object(settings.MINIO_BUCKET_NAME, v.minio_path)
-        if v.source_path:
-            storage_service.client.remove_object(settings.MINIO_BUCKET_NAME, v.source_path)
+        for path in (v.minio_path, v.source_path):
+            if blob_store.is_blob_path(path):
+                released.append(blob_store.release(db, path))
+            elif path:
+                # Version cũ chưa chuyển sang blob (xem app/migrate_blobs.py)
+                legacy_paths.append(path)
+
+    # Kết quả của job tài liệu là PDF của version (đã xử lý ở trên); chỉ file riêng của job (jobs/...) cần xóa thêm
+    job_paths = [row.result_path for row in db.query(ConversionJob.result_path).filter(ConversionJob.document_id == doc_id)]
 
     # Xóa dữ liệu trong Database
+    db.query(ConversionJob).filter(ConversionJob.document_id == doc_id).delete()
     db.query(DocumentVersion).filter(DocumentVersion.document_id == doc_id).delete()
     db.delete(doc)
     
     db.commit()
+
+    # Chỉ xóa object sau khi commit: blob còn được tài liệu khác tham chiếu thì được giữ lại
+    blob_store.collect(db, released)
+    for path in legacy_paths:
+        storage_service.remove_object(path)
+    remove_job_results(job_paths)
     return None
\ No newline at end of file
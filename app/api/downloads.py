@@ -0,0 +1,91 @@
+import re
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
+from typing import Optional
+from app.core.config import settings
+from app.services.storage import storage_service
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range(header: str, size: int):
+    """
+    Phân tích header Range (RFC 9110) cho một object dài size byte.
+    Trả về (start, end) bao gồm cả end, None nếu không có/không hỗ trợ (nhiều đoạn)
+    để trả toàn bộ file, hoặc ném ValueError nếu đoạn yêu cầu nằm ngoài file (416).
+    """
+    if not header:
+        return None
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # bytes=-N: N byte cuối
+        suffix = int(last)
+        if suffix == 0:
+            raise ValueError(header)
+        return max(0, size - suffix), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end
+
+
+def object_download_response(request: Request, object_name: str, media_type: str, filename: str) -> Response:
+    """
+    Stream object từ MinIO về client theo từng chunk, hỗ trợ Range/206 để trình xem PDF tải dần từng phần.
+    """
+    stat = storage_service.stat(object_name)
+    if stat is None:
+        raise HTTPException(status_code=500, detail="Lỗi kết nối MinIO")
+
+    size = stat.size
+    etag = f'"{stat.etag}"' if stat.etag else None
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        "Accept-Ranges": "bytes",
+    }
+    if etag:
+        headers["ETag"] = etag
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and etag and if_range != etag:
+        # File đã đổi so với bản client đang có: trả toàn bộ file
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}", "Accept-Ranges": "bytes"})
+
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(storage_service.iter_object(object_name), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    length = end - start + 1
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(length)
+    return StreamingResponse(
+        storage_service.iter_object(object_name, offset=start, length=length),
+        status_code=206,
+        media_type=media_type,
+        headers=headers
+    )
+
+
+def download_response(request: Request, object_name: str, media_type: str, filename: str, redirect: Optional[bool] = None) -> Response:
+    """
+    redirect=True: 302 tới presigned URL, client tải thẳng từ MinIO, byte không đi qua API.
+    redirect=False: stream qua API. None: theo DOWNLOAD_MODE của server.
+    """
+    if redirect is None:
+        redirect = settings.DOWNLOAD_MODE == "redirect"
+    if redirect:
+        return RedirectResponse(storage_service.get_presigned_url(object_name, filename=filename), status_code=302)
+    return object_download_response(request, object_name, media_type, filename)
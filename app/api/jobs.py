@@ -0,0 +1,104 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from app.api.downloads import download_response
+from app.core.database import async_session_scope, get_async_db, get_db
+from app.models import ConversionJob
+from app.schemas import HTMLRequest, JobResponse, MarkdownRequest, MathBackend, PageTemplateName
+from app.services.jobs import job_result_path, job_runner
+from app.services.render_executor import render_document_job, render_executor
+from app.services.storage import storage_service
+from typing import Optional
+
+router = APIRouter()
+
+
+def run_export_job(db: Session, job: ConversionJob) -> str:
+    """
+    Handler cho job 'export': render rồi lưu PDF vào MinIO dưới jobs/{id}.pdf
+    (bị xóa cùng job sau JOB_RESULT_TTL_SECONDS, xem JobRunner.cleanup).
+    """
+    pdf_bytes, _ = render_executor.run_sync(
+        render_document_job,
+        job.content,
+        fmt=job.content_format,
+        show_page_number=job.show_page_number,
+        math_backend=job.math_backend,
+        template=job.template
+    )
+    return storage_service.upload_pdf(pdf_bytes, job_result_path(job.id))
+
+
+job_runner.register("export", run_export_job)
+
+
+@router.post("/export/md-pdf", response_model=JobResponse, status_code=202)
+def submit_markdown_export(
+    request: MarkdownRequest,
+    show_page_number: bool = True,
+    math_backend: Optional[MathBackend] = None,
+    template: Optional[PageTemplateName] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Gửi Markdown để render PDF ở chế độ nền. Trả về job ngay lập tức.
+    """
+    return job_runner.submit(
+        db,
+        kind="export",
+        content=request.md_content,
+        content_format="markdown",
+        show_page_number=show_page_number,
+        math_backend=math_backend.value if math_backend else None,
+        template=template.value if template else None
+    )
+
+
+@router.post("/export/html-pdf", response_model=JobResponse, status_code=202)
+def submit_html_export(
+    request: HTMLRequest,
+    show_page_number: bool = True,
+    template: Optional[PageTemplateName] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Gửi HTML để render PDF ở chế độ nền. Trả về job ngay lập tức.
+    """
+    return job_runner.submit(
+        db,
+        kind="export",
+        content=request.html_content,
+        content_format="html",
+        show_page_number=show_page_number,
+        template=template.value if template else None
+    )
+
+
+@router.get("/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    """
+    Trạng thái job: pending, running, succeeded hoặc failed.
+    """
+    job = await db.get(ConversionJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job.")
+    return job
+
+
+@router.get("/{job_id}/result")
+async def get_job_result(job_id: str, request: Request, redirect: Optional[bool] = None):
+    """
+    Tải file PDF kết quả khi job đã hoàn thành.
+    """
+    # Session đóng ngay sau khi đọc, không giữ kết nối trong lúc stream file
+    async with async_session_scope() as db:
+        job = await db.get(ConversionJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job.")
+    if job.status == "failed":
+        raise HTTPException(status_code=409, detail=f"Job thất bại: {job.error}")
+    if job.status != "succeeded" or not job.result_path:
+        raise HTTPException(status_code=409, detail="Job chưa hoàn thành.")
+
+    return await run_in_threadpool(download_response, request, job.result_path, "application/pdf", f"job_{job.id}.pdf", redirect)
@@ -0,0 +1,38 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.responses import PlainTextResponse
+from app.services.profiling import is_admin, profile_store, stats_text
+from typing import Optional
+
+router = APIRouter()
+
+
+def require_admin(x_profile: Optional[str] = Header(None)):
+    if not is_admin(x_profile):
+        raise HTTPException(status_code=403, detail="Cần header X-Profile hợp lệ.")
+
+
+@router.get("/", dependencies=[Depends(require_admin)])
+def list_profiles(limit: int = 50):
+    """
+    Các request có profile, mới nhất trước. File .prof là profile cProfile (request có X-Profile
+    hoặc được lấy mẫu), file .folded là stack samples của job chậm hơn PROFILE_SLOW_SECONDS.
+    """
+    return profile_store.list()[:limit]
+
+
+@router.get("/{request_id}/{name}", dependencies=[Depends(require_admin)])
+def get_profile(request_id: str, name: str, format: Optional[str] = None):
+    """
+    Tải một file profile. format=text với file .prof: trả về bảng pstats sắp theo cumulative time.
+    """
+    data = profile_store.get(request_id, name)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy profile.")
+    if format == "text" and name.endswith(".prof"):
+        return PlainTextResponse(stats_text(data))
+    media_type = "text/plain; charset=utf-8" if name.endswith(".folded") else "application/octet-stream"
+    return Response(
+        content=data,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={request_id}-{name}"}
+    )
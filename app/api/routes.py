@@ -1,26 +1,46 @@
 from fastapi import APIRouter, HTTPException, status, Response, UploadFile, File
-from app.schemas import MarkdownRequest, HTMLResponse, HTMLRequest
-from app.services.converter import converter_service
-from app.services.pdf_generator import pdf_service
+from fastapi.responses import StreamingResponse
+from typing import Optional
+from app.core import metrics
+from app.schemas import MarkdownRequest, HTMLResponse, HTMLRequest, MathBackend, PageTemplateName
+from app.services.batch import BatchArchiveError, list_entries, stream_batch_zip
+from app.services.converter import formula_cache, math_backends
+from app.services.compression import content_compressor
+from app.services.source_history import source_history
+from app.services.templates import page_templates
+from app.services.render_executor import (
+    RenderQueueFull,
+    convert_markdown_job,
+    merge_pdf_job,
+    render_document_job,
+    render_pdf_job,
+    render_executor,
+)
 import os
 import logging
+import zipfile
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 @router.post("/export/md-html", response_model=HTMLResponse)
-async def convert_markdown(request: MarkdownRequest):
+@metrics.tracked("tools.export.md-html", "markdown")
+async def convert_markdown(request: MarkdownRequest, math_backend: Optional[MathBackend] = None):
     """
     API nhận vào Markdown và trả về HTML.
     """
     try:
-        html_result = converter_service.convert_to_html(request.md_content)
+        html_result = await render_executor.run(
+            convert_markdown_job, request.md_content, math_backend=math_backend.value if math_backend else None
+        )
         
         return HTMLResponse(
             html_content=html_result,
             message="Chuyển đổi thành công"
         )
+    except RenderQueueFull:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -29,21 +49,32 @@ async def convert_markdown(request: MarkdownRequest):
     
     
 @router.post("/export/html-pdf")
-async def export_html_to_pdf(request: HTMLRequest, show_page_number: bool = True):
+@metrics.tracked("tools.export.html-pdf", "html")
+async def export_html_to_pdf(
+    request: HTMLRequest,
+    show_page_number: bool = True,
+    template: Optional[PageTemplateName] = None
+):
     """
     API nhận vào chuỗi HTML thô và xuất ra PDF trực tiếp.
     Bỏ qua bước convert Markdown.
     """
     try:
-        pdf_bytes = pdf_service.generate_pdf(request.html_content, show_page_number=show_page_number)
+        metrics.DOCUMENT_SIZE_BYTES.observe(len(request.html_content.encode("utf-8")))
+        pdf_bytes, render_info = await render_executor.run(
+            render_pdf_job, request.html_content, show_page_number=show_page_number, template=template.value if template else None
+        )
         
         return Response(
             content=pdf_bytes,
             media_type="application/pdf",
             headers={
-                "Content-Disposition": "attachment; filename=export_from_html.pdf"
+                "Content-Disposition": "attachment; filename=export_from_html.pdf",
+                "X-Cache": render_info["cache"]
             }
         )
+    except RenderQueueFull:
+        raise
     except Exception as e:
         print(f"Error generating PDF from HTML: {e}")
         raise HTTPException(
@@ -53,22 +84,34 @@ async def export_html_to_pdf(request: HTMLRequest, show_page_number: bool = True
     
 
 @router.post("/export/md-pdf")
-async def export_pdf(request: MarkdownRequest):
+@metrics.tracked("tools.export.md-pdf", "markdown")
+async def export_pdf(
+    request: MarkdownRequest,
+    math_backend: Optional[MathBackend] = None,
+    template: Optional[PageTemplateName] = None
+):
     """
     API nhận vào Markdown, convert sang HTML, sau đó xuất ra file PDF.
     """
     try:
-        html_content = converter_service.convert_to_html(request.md_content)
-        
-        pdf_bytes = pdf_service.generate_pdf(html_content)
+        metrics.DOCUMENT_SIZE_BYTES.observe(len(request.md_content.encode("utf-8")))
+        pdf_bytes, render_info = await render_executor.run(
+            render_document_job,
+            request.md_content,
+            math_backend=math_backend.value if math_backend else None,
+            template=template.value if template else None
+        )
         
         return Response(
             content=pdf_bytes,
             media_type="application/pdf",
             headers={
-                "Content-Disposition": "attachment; filename=export_document.pdf"
+                "Content-Disposition": "attachment; filename=export_document.pdf",
+                "X-Cache": render_info["cache"]
             }
         )
+    except RenderQueueFull:
+        raise
     except Exception as e:
         print(f"Error generating PDF: {e}")
         raise HTTPException(
@@ -78,7 +121,8 @@ async def export_pdf(request: MarkdownRequest):
 
 
 @router.post("/upload/md-html")
-async def upload_markdown_convert(file: UploadFile = File(...)):
+@metrics.tracked("tools.upload.md-html", "markdown")
+async def upload_markdown_convert(file: UploadFile = File(...), math_backend: Optional[MathBackend] = None):
     """
     Upload file .md và nhận về file .html để tải xuống.
     """
@@ -89,7 +133,9 @@ async def upload_markdown_convert(file: UploadFile = File(...)):
         content_bytes = await file.read()
         content_str = content_bytes.decode("utf-8")
         
-        html_result = converter_service.convert_to_html(content_str)
+        html_result = await render_executor.run(
+            convert_markdown_job, content_str, math_backend=math_backend.value if math_backend else None
+        )
         
         base_name = os.path.splitext(file.filename)[0]
         output_filename = f"{base_name}.html"
@@ -99,6 +145,8 @@ async def upload_markdown_convert(file: UploadFile = File(...)):
             media_type="text/html",
             headers={"Content-Disposition": f"attachment; filename={output_filename}"}
         )
+    except RenderQueueFull:
+        raise
     except UnicodeDecodeError:
         raise HTTPException(status_code=400, detail="File không phải định dạng UTF-8 hợp lệ.")
     except Exception as e:
@@ -106,7 +154,12 @@ async def upload_markdown_convert(file: UploadFile = File(...)):
 
 
 @router.post("/upload/html-pdf")
-async def upload_html_to_pdf(file: UploadFile = File(...), show_page_number: bool = True):
+@metrics.tracked("tools.upload.html-pdf", "html")
+async def upload_html_to_pdf(
+    file: UploadFile = File(...),
+    show_page_number: bool = True,
+    template: Optional[PageTemplateName] = None
+):
     """
     Upload file .html và nhận về file PDF.
     """
@@ -120,15 +173,21 @@ async def upload_html_to_pdf(file: UploadFile = File(...), show_page_number: boo
         base_name = os.path.splitext(file.filename)[0]
         output_filename = f"{base_name}.pdf"
 
-        pdf_bytes = pdf_service.generate_pdf(content_str, show_page_number=show_page_number)
+        metrics.DOCUMENT_SIZE_BYTES.observe(len(content_bytes))
+        pdf_bytes, render_info = await render_executor.run(
+            render_pdf_job, content_str, show_page_number=show_page_number, template=template.value if template else None
+        )
         
         return Response(
             content=pdf_bytes,
             media_type="application/pdf",
             headers={
-                "Content-Disposition": f"attachment; filename={output_filename}"
+                "Content-Disposition": f"attachment; filename={output_filename}",
+                "X-Cache": render_info["cache"]
             }
         )
+    except RenderQueueFull:
+        raise
     except UnicodeDecodeError:
         raise HTTPException(status_code=400, detail="File HTML phải có encoding UTF-8.")
     except Exception as e:
@@ -136,7 +195,13 @@ async def upload_html_to_pdf(file: UploadFile = File(...), show_page_number: boo
 
 
 @router.post("/upload/md-pdf")
-async def upload_md_to_pdf(file: UploadFile = File(...), show_page_number: bool = True):
+@metrics.tracked("tools.upload.md-pdf", "markdown")
+async def upload_md_to_pdf(
+    file: UploadFile = File(...),
+    show_page_number: bool = True,
+    math_backend: Optional[MathBackend] = None,
+    template: Optional[PageTemplateName] = None
+):
     """
     Upload file .md, .markdown hoặc .txt và nhận về file PDF.
     """
@@ -147,9 +212,14 @@ async def upload_md_to_pdf(file: UploadFile = File(...), show_page_number: bool
         content_bytes = await file.read()
         content_str = content_bytes.decode("utf-8")
         
-        html_content = converter_service.convert_to_html(content_str)
-        
-        pdf_bytes = pdf_service.generate_pdf(html_content, show_page_number=show_page_number)
+        metrics.DOCUMENT_SIZE_BYTES.observe(len(content_bytes))
+        pdf_bytes, render_info = await render_executor.run(
+            render_document_job,
+            content_str,
+            show_page_number=show_page_number,
+            math_backend=math_backend.value if math_backend else None,
+            template=template.value if template else None
+        )
         
         base_name = os.path.splitext(file.filename)[0]
         output_filename = f"{base_name}.pdf"
@@ -157,15 +227,56 @@ async def upload_md_to_pdf(file: UploadFile = File(...), show_page_number: bool
         return Response(
             content=pdf_bytes,
             media_type="application/pdf",
-            headers={"Content-Disposition": f"attachment; filename={output_filename}"}
+            headers={"Content-Disposition": f"attachment; filename={output_filename}", "X-Cache": render_info["cache"]}
         )
+    except RenderQueueFull:
+        raise
     except UnicodeDecodeError:
         raise HTTPException(status_code=400, detail="File không phải định dạng UTF-8 hợp lệ.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Lỗi khi tạo PDF từ file Markdown: {str(e)}")
 
 
+@router.post("/upload/batch")
+@metrics.tracked("tools.upload.batch", "zip")
+async def upload_batch_convert(
+    file: UploadFile = File(..., description="File ZIP chứa các file .md/.markdown/.txt/.html/.htm và ảnh đi kèm."),
+    show_page_number: bool = True,
+    math_backend: Optional[MathBackend] = None,
+    template: Optional[PageTemplateName] = None
+):
+    """
+    Upload một file ZIP và nhận về file ZIP chứa PDF của từng tài liệu, giữ nguyên cấu trúc thư mục.
+    Ảnh có đường dẫn tương đối được lấy từ chính file ZIP. Kết quả được stream về ngay khi từng PDF xong;
+    manifest.json ở cuối liệt kê các file thành công và thất bại.
+    """
+    if not file.filename.lower().endswith(".zip"):
+        raise HTTPException(status_code=400, detail="File phải có định dạng .zip")
+
+    try:
+        # UploadFile lớn được lưu tạm trên đĩa, ZipFile chỉ đọc phần cần thiết
+        archive = zipfile.ZipFile(file.file)
+        entries, skipped = list_entries(archive)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="File ZIP không hợp lệ.")
+    except BatchArchiveError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    base_name = os.path.splitext(file.filename)[0]
+    return StreamingResponse(
+        stream_batch_zip(
+            archive, entries, skipped,
+            show_page_number=show_page_number,
+            math_backend=math_backend.value if math_backend else None,
+            template=template.value if template else None
+        ),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={base_name}_pdf.zip"}
+    )
+
+
 @router.post("/upload/merge-pdf")
+@metrics.tracked("tools.upload.merge-pdf", "pdf")
 async def upload_and_merge_pdfs(
     body_file: UploadFile = File(..., description="File PDF nội dung chính."),
     footer_file: UploadFile = File(..., description="File PDF chứa footer (1 trang).")
@@ -181,7 +292,7 @@ async def upload_and_merge_pdfs(
         body_bytes = await body_file.read()
         footer_bytes = await footer_file.read()
 
-        merged_pdf_bytes = pdf_service.merge_with_footer(body_bytes, footer_bytes)
+        merged_pdf_bytes = await render_executor.run(merge_pdf_job, body_bytes, footer_bytes)
 
         base_name = os.path.splitext(body_file.filename)[0]
         output_filename = f"{base_name}_merged.pdf"
@@ -193,6 +304,83 @@ async def upload_and_merge_pdfs(
                 "Content-Disposition": f"attachment; filename={output_filename}"
             }
         )
+    except RenderQueueFull:
+        raise
     except Exception as e:
         logger.error(f"Lỗi khi hợp nhất PDF: {e}")
-        raise HTTPException(status_code=500, detail=f"Lỗi khi hợp nhất PDF: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Lỗi khi hợp nhất PDF: {str(e)}")
+
+
+@router.get("/templates")
+async def get_page_templates():
+    """
+    Các mẫu trang có thể chọn qua tham số template (khổ giấy, lề, header/footer, font).
+    """
+    return page_templates.list()
+
+
+@router.get("/stats/math-cache")
+async def get_math_cache_stats():
+    """
+    Thống kê cache công thức toán: số lần trúng/trượt/loại bỏ ở từng tầng.
+    Mỗi process có cache bộ nhớ riêng nên số liệu được trả về theo từng process render.
+    """
+    return {
+        "api": formula_cache.stats(),
+        "render_workers": render_executor.worker_stats("math_cache")
+    }
+
+
+@router.get("/stats/math-backends")
+async def get_math_backend_stats():
+    """
+    Thống kê thời gian render của từng math backend (chỉ tính các lần render thật, không tính cache).
+    """
+    return {
+        "api": {name: backend.stats() for name, backend in math_backends.items()},
+        "render_workers": render_executor.worker_stats("math_backends")
+    }
+
+
+@router.get("/stats/url-fetcher")
+async def get_url_fetcher_stats():
+    """
+    Thống kê tải tài nguyên từ xa (ảnh, CSS, font) trong các process render:
+    trúng cache, xác thực lại (304), tải mới và lỗi.
+    """
+    return {"render_workers": render_executor.worker_stats("url_fetcher")}
+
+
+@router.get("/stats/source-history")
+async def get_source_history_stats():
+    """
+    Chế độ lưu source của version (full/delta) và cache source đã dựng lại của process API.
+    """
+    return source_history.stats()
+
+
+@router.get("/stats/compression")
+async def get_compression_stats():
+    """
+    Cấu hình nén source/nội dung tài liệu: codec, mức nén, dictionary đang dùng và các dictionary giải nén được.
+    Số byte trước/sau khi nén có trong /metrics (mdpdf_compression_bytes_total).
+    """
+    return content_compressor.stats()
+
+
+@router.get("/stats/pdf-generator")
+async def get_pdf_generator_stats():
+    """
+    Thời gian tải trước tài nguyên (prefetch), thời gian layout của WeasyPrint
+    và cache PDF đã render (trúng/trượt ở từng tầng), theo từng process render.
+    """
+    return {"render_workers": render_executor.worker_stats("pdf_generator")}
+
+
+@router.get("/stats/render-executor")
+async def get_render_executor_stats():
+    """
+    Thống kê render executor: số job đang chạy/chờ, số job bị từ chối,
+    số yêu cầu trùng được gộp vào job đang chạy (coalesced), thời gian chờ trong hàng đợi và thời gian render theo từng loại job.
+    """
+    return render_executor.stats()
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,6 +14,14 @@ class Settings:
 
     # Database Config
     DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"  # Cho các route chỉ đọc (async)
+
+    # Connection Pool Config (áp dụng riêng cho pool sync và pool async của mỗi process)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))  # Số kết nối giữ sẵn trong pool
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))  # Số kết nối mở thêm khi pool đã hết, đóng lại khi trả về
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # Giây chờ kết nối tối đa trước khi báo lỗi
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Mở lại kết nối đã sống quá số giây này (-1 = không)
+    DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"  # Kiểm tra kết nối trước khi dùng (Postgres restart không làm hỏng request)
     
     # MinIO Config
     MINIO_ENDPOINT = os.getenv("MINIO_ENDPOINT", "localhost:9000")
@@ -20,5 +29,86 @@ class Settings:
     MINIO_SECRET_KEY = os.getenv("MINIO_ROOT_PASSWORD", "minioadmin")
     MINIO_BUCKET_NAME = os.getenv("MINIO_BUCKET_NAME", "pdf-reports")
     MINIO_SECURE = False  # Đặt True nếu dùng HTTPS
+    MINIO_PUBLIC_ENDPOINT = os.getenv("MINIO_PUBLIC_ENDPOINT", MINIO_ENDPOINT)  # Host trong presigned URL, phải truy cập được từ client
+    MINIO_REGION = os.getenv("MINIO_REGION", "us-east-1")
+
+    # Download Config
+    DOWNLOAD_MODE = os.getenv("DOWNLOAD_MODE", "stream")  # 'stream' = tải qua API, 'redirect' = 302 tới presigned URL của MinIO
+    PRESIGNED_URL_EXPIRY = int(os.getenv("PRESIGNED_URL_EXPIRY", "3600"))  # Thời hạn presigned URL (giây)
+
+    # Render Executor Config
+    RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))  # Số process render PDF chạy đồng thời
+    RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "16"))  # Số job được chờ thêm; vượt quá trả về 503
+
+    # Startup Config
+    STARTUP_WARM_UP = os.getenv("STARTUP_WARM_UP", "true").lower() == "true"  # Khởi động sẵn các process render (WeasyPrint, font, CSS) ngay khi API chạy
+    STARTUP_RETRY_INTERVAL = float(os.getenv("STARTUP_RETRY_INTERVAL", "5"))  # Giây giữa các lần thử lại bước khởi động lỗi (Postgres/MinIO chưa sẵn sàng)
+
+    # Source History Config
+    SOURCE_STORAGE_MODE = os.getenv("SOURCE_STORAGE_MODE", "full")  # 'full' = mỗi version lưu source đầy đủ, 'delta' = keyframe + delta nén so với version trước
+    SOURCE_KEYFRAME_INTERVAL = int(os.getenv("SOURCE_KEYFRAME_INTERVAL", "20"))  # Chế độ delta: cứ N version có một bản đầy đủ (dựng lại tối đa N-1 delta)
+    SOURCE_CACHE_MAX_BYTES = int(os.getenv("SOURCE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # Cache source đã dựng lại, mỗi process API; 0 = tắt
+    BLOB_PENDING_GRACE_SECONDS = int(os.getenv("BLOB_PENDING_GRACE_SECONDS", "3600"))  # Blob đã upload mà sau thời gian này vẫn không có dòng blobs (transaction rollback) thì bị xóa
+
+    # Compression Config (source trên MinIO và Document.current_content; bản cũ chưa nén vẫn đọc được)
+    COMPRESSION_CODEC = os.getenv("COMPRESSION_CODEC", "zstd")  # 'zstd', 'zlib' hoặc 'none' (chỉ tắt nén bản mới, bản đã nén vẫn đọc được)
+    COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL", "3"))  # zstd 1..22 (zlib tối đa 9); 3 nén gần bằng 6 nhưng nhanh gấp 2-3 lần
+    COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "256"))  # Nội dung ngắn hơn được lưu nguyên
+    COMPRESSION_DICTIONARY = os.getenv("COMPRESSION_DICTIONARY", "")  # File dictionary zstd (python -m app.train_dictionary); giữ các file *.zdict cũ cùng thư mục
+
+    # Batch Upload Config
+    BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", str(RENDER_WORKERS)))  # Số tài liệu trong một ZIP được chuyển đổi đồng thời
+    BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "500"))
+    BATCH_MAX_FILE_BYTES = int(os.getenv("BATCH_MAX_FILE_BYTES", str(20 * 1024 * 1024)))  # Tối đa mỗi file trong ZIP (sau giải nén)
+
+    # Conversion Job Config
+    JOB_WORKER_MODE = os.getenv("JOB_WORKER_MODE", "local")  # 'local' = chạy worker trong process API, 'external' = chạy riêng bằng `python -m app.worker`
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))  # Số thread xử lý job
+    JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2"))  # Giây giữa các lần kiểm tra job mới
+    JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "600"))  # Job 'running' quá thời gian này được coi là worker đã chết
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", str(24 * 3600)))  # Job đã kết thúc quá thời gian này bị xóa cùng file kết quả; 0 = giữ mãi
+    JOB_CLEANUP_INTERVAL = float(os.getenv("JOB_CLEANUP_INTERVAL", "300"))  # Giây giữa hai lần dọn job hết hạn của mỗi worker
+
+    # Remote Resource Fetch Config
+    HTTP_FETCH_TIMEOUT = float(os.getenv("HTTP_FETCH_TIMEOUT", "10"))
+    HTTP_FETCH_MAX_BYTES = int(os.getenv("HTTP_FETCH_MAX_BYTES", str(20 * 1024 * 1024)))  # Tối đa mỗi ảnh/CSS/font
+    HTTP_FETCH_PER_HOST = int(os.getenv("HTTP_FETCH_PER_HOST", "4"))  # Số request đồng thời tối đa tới một host
+    HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", os.path.join(tempfile.gettempdir(), "mdpdf_http_cache"))  # Để trống để tắt cache
+    HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+    PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", "8"))  # Số thread tải trước tài nguyên cho một PDF
+    PREFETCH_DEADLINE = float(os.getenv("PREFETCH_DEADLINE", "15"))  # Tổng thời gian tối đa cho bước tải trước (giây)
+
+    # Rendered PDF Cache Config
+    PDF_CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))  # Tầng bộ nhớ, mỗi process render; 0 = tắt cache PDF
+    PDF_CACHE_BACKEND = os.getenv("PDF_CACHE_BACKEND", "disk")  # Tầng phụ: 'disk', 'minio' hoặc 'none'
+    PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "mdpdf_pdf_cache"))
+    PDF_CACHE_DISK_MAX_BYTES = int(os.getenv("PDF_CACHE_DISK_MAX_BYTES", str(1024 * 1024 * 1024)))  # 0 = không giới hạn
+
+    # Page Template Config
+    PDF_DEFAULT_TEMPLATE = os.getenv("PDF_DEFAULT_TEMPLATE", "default")  # Mẫu trang khi tài liệu không chọn mẫu, xem app/services/templates.py
+
+    # Large Document Render Config
+    LARGE_DOC_WORKERS = int(os.getenv("LARGE_DOC_WORKERS", "0"))  # Số đoạn tối đa khi cắt tài liệu lớn (chỉ tại ngắt trang) để layout song song trên pool render (RENDER_WORKERS process); 0/1 = tắt
+    LARGE_DOC_MIN_CHARS = int(os.getenv("LARGE_DOC_MIN_CHARS", "300000"))  # HTML (không tính ảnh data: URI) dài hơn ngưỡng này thì render song song
+
+    # Profiling Config
+    PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")  # Header X-Profile bằng token này: profile request và xem profile; để trống = tắt
+    PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))  # Tỷ lệ request được profile đầy đủ (0-1)
+    PROFILE_SLOW_SECONDS = float(os.getenv("PROFILE_SLOW_SECONDS", "0"))  # Job render chậm hơn ngưỡng này được lưu stack samples; 0 = tắt (mặc định, mỗi job có thêm một thread lấy mẫu khi bật)
+    PROFILE_SAMPLER_INTERVAL = float(os.getenv("PROFILE_SAMPLER_INTERVAL", "0.01"))  # Giây giữa hai lần lấy mẫu stack
+    PROFILE_STORE = os.getenv("PROFILE_STORE", "disk")  # 'disk', 'minio' hoặc 'none'
+    PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "mdpdf_profiles"))
+    PROFILE_MAX_REQUESTS = int(os.getenv("PROFILE_MAX_REQUESTS", "200"))  # Số request giữ profile trên đĩa; 0 = không giới hạn
+
+    # Math Render Config
+    MATH_BACKEND = os.getenv("MATH_BACKEND", "png")  # 'png', 'svg' hoặc 'mathml' (chỉ cho đầu ra HTML; PDF dùng 'svg')
+    MATH_RENDER_WORKERS = int(os.getenv("MATH_RENDER_WORKERS", "4"))  # 0 = render tuần tự, không dùng process pool
+    MATH_PARALLEL_MIN_FORMULAS = int(os.getenv("MATH_PARALLEL_MIN_FORMULAS", "16"))  # Ít hơn ngưỡng này thì render tuần tự
+
+    # Math Cache Config
+    MATH_CACHE_MAX_BYTES = int(os.getenv("MATH_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    MATH_CACHE_DIR = os.getenv("MATH_CACHE_DIR", "")  # Để trống nếu không dùng cache trên đĩa
+    MATH_CACHE_DISK_MAX_BYTES = int(os.getenv("MATH_CACHE_DISK_MAX_BYTES", "0"))  # 0 = không giới hạn
 
 settings = Settings()
\ No newline at end of file
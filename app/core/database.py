@@ -1,11 +1,103 @@
-from sqlalchemy import create_engine
+"""
+Engine/session của Postgres.
+
+- engine/SessionLocal (psycopg2, đồng bộ): các thao tác ghi (tạo version, blob, job) chạy trong threadpool/worker.
+- async_engine/AsyncSessionLocal (asyncpg): các route chỉ đọc chạy thẳng trên event loop, không chiếm thread.
+
+Kích thước pool, overflow, timeout, recycle và pre-ping cấu hình qua DB_POOL_* (xem config.py).
+Thời gian chờ lấy kết nối và thời gian giữ kết nối được xuất ra /metrics theo từng pool (sync/async),
+để thấy ngay khi pool cạn hoặc khi có chỗ giữ kết nối quá lâu.
+"""
+import time
+from contextlib import asynccontextmanager, contextmanager
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from app.core import metrics
 from app.core.config import settings
 
-engine = create_engine(settings.DATABASE_URL)
+DB_POOL_WAIT_SECONDS = metrics.Histogram(
+    "mdpdf_db_pool_wait_seconds",
+    "Thời gian chờ lấy kết nối từ pool (kể cả mở kết nối mới)",
+    ("pool",)
+)
+DB_CHECKOUT_SECONDS = metrics.Histogram(
+    "mdpdf_db_connection_checkout_seconds",
+    "Thời gian một kết nối được giữ, từ lúc lấy ra khỏi pool tới lúc trả lại",
+    ("pool",)
+)
+DB_CONNECTIONS_IN_USE = metrics.Gauge(
+    "mdpdf_db_connections_in_use",
+    "Số kết nối đang được lấy ra khỏi pool",
+    ("pool",)
+)
+DB_POOL_TIMEOUTS = metrics.Counter(
+    "mdpdf_db_pool_timeouts_total",
+    "Số lần chờ kết nối quá DB_POOL_TIMEOUT giây",
+    ("pool",)
+)
+
+
+class _InstrumentedPoolMixin:
+    # Tên pool trong nhãn metrics; QueuePool không có event trước khi chờ nên đo ngay tại _do_get
+    metrics_name = "sync"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            DB_POOL_TIMEOUTS.inc(pool=self.metrics_name)
+            raise
+        finally:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - start, pool=self.metrics_name)
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    metrics_name = "sync"
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    metrics_name = "async"
+
+
+def pool_options() -> dict:
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
+def instrument_checkouts(sync_engine, name: str):
+    """Đo thời gian giữ kết nối qua event checkout/checkin của pool."""
+    @event.listens_for(sync_engine, "checkout")
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checkout_at"] = time.perf_counter()
+        DB_CONNECTIONS_IN_USE.inc(pool=name)
+
+    @event.listens_for(sync_engine, "checkin")
+    def _checkin(dbapi_connection, connection_record):
+        checkout_at = connection_record.info.pop("checkout_at", None)
+        if checkout_at is not None:
+            DB_CONNECTIONS_IN_USE.dec(pool=name)
+            DB_CHECKOUT_SECONDS.observe(time.perf_counter() - checkout_at, pool=name)
+
+
+engine = create_engine(settings.DATABASE_URL, poolclass=InstrumentedQueuePool, **pool_options())
+instrument_checkouts(engine, "sync")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(settings.ASYNC_DATABASE_URL, poolclass=InstrumentedAsyncQueuePool, **pool_options())
+instrument_checkouts(async_engine.sync_engine, "async")
+# expire_on_commit=False: object đọc xong vẫn dùng được sau khi session đóng (trả về response)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 # Dependency để lấy DB session trong API
@@ -14,4 +106,29 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# Dependency cho route async chỉ đọc
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+@contextmanager
+def session_scope(**options):
+    """
+    Session ngắn cho một lượt đọc/ghi: dùng trong route/job thay vì giữ session suốt request,
+    để kết nối không bị giữ trong lúc render PDF hay upload MinIO.
+    """
+    db = SessionLocal(**options)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+@asynccontextmanager
+async def async_session_scope():
+    async with AsyncSessionLocal() as db:
+        yield db
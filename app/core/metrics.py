@@ -0,0 +1,307 @@
+"""
+Metrics theo định dạng Prometheus (text exposition 0.0.4), không phụ thuộc thư viện ngoài.
+
+- Ghi số liệu chỉ tốn một lock và vài phép cộng; việc định dạng chỉ xảy ra khi /metrics được gọi.
+- Process render con chỉ gửi phần tăng thêm từ lần gửi trước (snapshot_delta) kèm kết quả mỗi job
+  (xem render_executor._worker_stats); process API cộng dồn các phần đó và cộng vào số liệu của chính nó khi xuất.
+- Nhãn endpoint/format của request hiện tại nằm trong context (request_labels), được chuyển
+  sang process con cùng job, nên các bước render bên trong service cũng mang đúng nhãn.
+"""
+import bisect
+import contextvars
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+REQUEST_LABELS = ("endpoint", "format")
+
+_request_labels = contextvars.ContextVar("metric_request_labels", default={})
+
+
+def current_labels() -> dict:
+    return _request_labels.get()
+
+
+@contextmanager
+def request_labels(**labels):
+    """Gắn nhãn endpoint/format cho mọi số liệu ghi trong khối lệnh (kể cả job render gửi đi từ đây)."""
+    token = _request_labels.set({**_request_labels.get(), **{k: str(v) for k, v in labels.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _request_labels.reset(token)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        context = _request_labels.get()
+        return tuple(str(labels.get(name, context.get(name, ""))) for name in self.labelnames)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = {key: (list(value) if isinstance(value, list) else value) for key, value in self._values.items()}
+        return {"type": self.type, "help": self.documentation, "labelnames": self.labelnames, "values": values}
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        # function: giá trị được tính lúc xuất (ví dụ số job render đang chạy), không cần cập nhật liên tục
+        self.function = function
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def snapshot(self) -> dict:
+        result = super().snapshot()
+        if self.function is not None:
+            result["values"][()] = self.function()
+        return result
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            # [số mẫu theo từng bucket (không cộng dồn)..., bucket +Inf, sum, count]
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> dict:
+        result = super().snapshot()
+        result["buckets"] = self.buckets
+        return result
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+
+registry = Registry()
+
+
+def merge_snapshots(snapshots) -> dict:
+    """Cộng số liệu của nhiều process (counter, gauge, histogram đều cộng theo từng bộ nhãn)."""
+    merged = {}
+    for snapshot in snapshots:
+        merge_into(merged, snapshot)
+    return merged
+
+
+def merge_into(merged: dict, snapshot: dict):
+    """Cộng snapshot vào merged (sửa tại chỗ)."""
+    for name, metric in snapshot.items():
+        target = merged.setdefault(name, {**metric, "values": {}})
+        for key, value in metric["values"].items():
+            current = target["values"].get(key)
+            if current is None:
+                target["values"][key] = list(value) if isinstance(value, list) else value
+            elif isinstance(value, list):
+                target["values"][key] = [a + b for a, b in zip(current, value)]
+            else:
+                target["values"][key] = current + value
+
+
+def snapshot_delta(current: dict, previous: dict) -> dict:
+    """
+    Phần thay đổi của current so với previous (cùng định dạng snapshot), chỉ gồm các bộ nhãn có thay đổi.
+    Cộng dồn các delta bằng merge_snapshots cho lại đúng giá trị hiện tại.
+    """
+    delta = {}
+    for name, metric in current.items():
+        before = previous.get(name, {}).get("values", {})
+        values = {}
+        for key, value in metric["values"].items():
+            old = before.get(key)
+            if old is None:
+                changed = value
+            elif isinstance(value, list):
+                changed = [a - b for a, b in zip(value, old)]
+            else:
+                changed = value - old
+            if any(changed) if isinstance(changed, list) else changed:
+                values[key] = changed
+        if values:
+            delta[name] = {**metric, "values": values}
+    return delta
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames, key, extra=()) -> str:
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_text(snapshot: dict) -> str:
+    lines = []
+    for name in sorted(snapshot):
+        metric = snapshot[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labelnames = metric["labelnames"]
+        for key in sorted(metric["values"]):
+            value = metric["values"][key]
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + [float("inf")], value[:-2]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labelnames, key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, key)} {_format_value(value[-2])}")
+            lines.append(f"{name}_count{_format_labels(labelnames, key)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+# Số liệu dùng chung giữa các service
+
+STAGE_SECONDS = Histogram(
+    "mdpdf_stage_duration_seconds",
+    "Thời gian từng bước của pipeline (markdown_parse, math_render, url_fetch, prefetch, layout, pdf_merge, storage_upload, db_commit...)",
+    ("stage",) + REQUEST_LABELS
+)
+REQUEST_SECONDS = Histogram(
+    "mdpdf_request_duration_seconds",
+    "Thời gian xử lý request chuyển đổi/tài liệu",
+    REQUEST_LABELS + ("status",)
+)
+RENDERS_IN_PROGRESS = Gauge(
+    "mdpdf_requests_in_progress",
+    "Số request chuyển đổi/tài liệu đang xử lý",
+    REQUEST_LABELS
+)
+DOCUMENT_SIZE_BYTES = Histogram(
+    "mdpdf_document_size_bytes",
+    "Kích thước nội dung đầu vào (Markdown/HTML)",
+    REQUEST_LABELS,
+    buckets=(1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+)
+PDF_SIZE_BYTES = Histogram(
+    "mdpdf_pdf_size_bytes",
+    "Kích thước PDF đã render",
+    REQUEST_LABELS,
+    buckets=(16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864, 268435456)
+)
+PDF_PAGES = Histogram(
+    "mdpdf_pdf_pages",
+    "Số trang PDF đã render",
+    REQUEST_LABELS,
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+)
+CACHE_REQUESTS = Counter(
+    "mdpdf_cache_requests_total",
+    "Số lần tra cache theo loại cache và kết quả (hit/miss)",
+    ("cache", "result") + REQUEST_LABELS
+)
+
+
+@contextmanager
+def stage(name: str):
+    """Đo thời gian một bước của pipeline: with metrics.stage("layout"): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+
+
+@contextmanager
+def track_request(endpoint: str, fmt: str = None):
+    """
+    Dùng trong route: gắn nhãn endpoint/format, đếm request đang xử lý và đo tổng thời gian theo kết quả.
+    """
+    with request_labels(endpoint=endpoint, format=fmt or ""):
+        RENDERS_IN_PROGRESS.inc()
+        start = time.perf_counter()
+        status = "error"
+        try:
+            yield
+            status = "ok"
+        finally:
+            RENDERS_IN_PROGRESS.dec()
+            REQUEST_SECONDS.observe(time.perf_counter() - start, status=status)
+
+
+def tracked(endpoint: str, fmt: str = None):
+    """Decorator cho route async, tương đương bọc toàn bộ thân route trong track_request(endpoint, fmt)."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with track_request(endpoint, fmt):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
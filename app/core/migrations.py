@@ -0,0 +1,35 @@
+from sqlalchemy import text
+from app.core.database import Base, engine
+
+# Base.metadata.create_all chỉ tạo bảng mới, không thêm cột vào bảng đã tồn tại.
+# Các câu lệnh dưới đây phải idempotent và được chạy tuần tự mỗi lần khởi động.
+MIGRATIONS = [
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS math_backend VARCHAR",
+    "ALTER TABLE document_versions ADD COLUMN IF NOT EXISTS source_filename VARCHAR",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS render_mode VARCHAR",
+    "ALTER TABLE conversion_jobs ADD COLUMN IF NOT EXISTS render_mode VARCHAR",
+    "ALTER TABLE documents ADD COLUMN IF NOT EXISTS template VARCHAR",
+    "ALTER TABLE conversion_jobs ADD COLUMN IF NOT EXISTS template VARCHAR",
+    "ALTER TABLE document_versions ADD COLUMN IF NOT EXISTS source_keyframe INTEGER",
+    "ALTER TABLE document_versions ADD COLUMN IF NOT EXISTS source_hash VARCHAR(64)",
+    "ALTER TABLE conversion_jobs ADD COLUMN IF NOT EXISTS profile_request_id VARCHAR",
+    "ALTER TABLE conversion_jobs ADD COLUMN IF NOT EXISTS profile_explicit BOOLEAN DEFAULT FALSE",
+    # Bảng đã lớn thì có thể tạo trước bằng CREATE INDEX CONCURRENTLY (cùng tên) để không khóa ghi; khi đó hai lệnh dưới bỏ qua
+    "CREATE INDEX IF NOT EXISTS ix_documents_updated_at_id ON documents (updated_at, id)",
+    "CREATE INDEX IF NOT EXISTS ix_document_versions_document_id_version_number ON document_versions (document_id, version_number)",
+]
+
+def run_migrations():
+    with engine.begin() as conn:
+        for statement in MIGRATIONS:
+            conn.execute(text(statement))
+
+
+def init_database():
+    """
+    Tạo bảng còn thiếu rồi chạy MIGRATIONS. Gọi ở bước khởi động (không chạy lúc import),
+    nên process chỉ import app mà không cần tới Postgres.
+    """
+    import app.models  # noqa: F401  (đăng ký các bảng vào Base.metadata)
+    Base.metadata.create_all(bind=engine)
+    run_migrations()
@@ -0,0 +1,95 @@
+"""
+Các bước khởi động chạy nền sau khi process đã nhận request (tạo bảng, kiểm tra bucket MinIO,
+khởi động process render...), thay vì chạy lúc import module.
+
+- Bước bắt buộc (required=True) lỗi thì được thử lại sau STARTUP_RETRY_INTERVAL giây cho tới khi thành công:
+  Postgres/MinIO tạm thời chưa sẵn sàng không làm process chết.
+- Bước không bắt buộc (warm-up) chỉ chạy một lần; lỗi được ghi lại nhưng không chặn readiness.
+- ready() = mọi bước bắt buộc đã thành công và mọi bước đã chạy xong, dùng cho /health/ready.
+"""
+import logging
+import threading
+import time
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Startup:
+    def __init__(self, retry_interval: float = settings.STARTUP_RETRY_INTERVAL):
+        self.retry_interval = retry_interval
+        self._steps = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self.started_at = None
+
+    def add(self, name: str, fn, required: bool = True):
+        """Đăng ký bước khởi động fn(); phải gọi trước start()."""
+        self._steps[name] = {"fn": fn, "required": required, "status": "pending", "attempts": 0, "seconds": None, "error": None}
+
+    def start(self):
+        """Chạy mỗi bước trên một thread riêng, không chờ."""
+        self._stop.clear()
+        self.started_at = time.time()
+        for name in self._steps:
+            thread = threading.Thread(target=self._run_step, args=(name,), name=f"startup-{name}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def wait(self, timeout: float = None) -> bool:
+        """Chờ mọi bước chạy xong (dùng trong script/benchmark). Trả về ready()."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        return self.ready()
+
+    def _run_step(self, name: str):
+        step = self._steps[name]
+        while not self._stop.is_set():
+            with self._lock:
+                step["status"] = "running"
+                step["attempts"] += 1
+            start = time.perf_counter()
+            try:
+                step["fn"]()
+            except Exception as e:
+                with self._lock:
+                    step["error"] = str(e)
+                    step["status"] = "retrying" if step["required"] else "failed"
+                logger.error(f"Startup step {name} failed (attempt {step['attempts']}): {e}")
+                if not step["required"]:
+                    return
+                self._stop.wait(self.retry_interval)
+                continue
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                step["status"] = "ok"
+                step["seconds"] = elapsed
+                step["error"] = None
+            logger.info(f"Startup step {name} done in {elapsed:.3f}s")
+            return
+
+    def ready(self) -> bool:
+        with self._lock:
+            return all(
+                step["status"] == "ok" or (not step["required"] and step["status"] == "failed")
+                for step in self._steps.values()
+            )
+
+    def status(self) -> dict:
+        with self._lock:
+            steps = {
+                name: {key: value for key, value in step.items() if key != "fn"}
+                for name, step in self._steps.items()
+            }
+        return {"ready": self.ready(), "started_at": self.started_at, "steps": steps}
+
+
+startup = Startup()
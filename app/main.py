@@ -1,20 +1,103 @@
-from fastapi import FastAPI
-from app.core.database import Base, engine
+import uuid
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import async_engine
+from app.core.migrations import init_database
+from app.core.startup import startup
 from app.api.documents import router as document_router
+from app.api.jobs import router as job_router
+from app.api.profiles import router as profile_router
 from app.api.routes import router as conversion_router
+from app.services import profiling
+from app.services.jobs import job_runner
+from app.services.render_executor import RenderQueueFull, render_executor
+from app.services.storage import storage_service
 
-Base.metadata.create_all(bind=engine)
+# Import module không kết nối Postgres/MinIO hay nạp WeasyPrint: các việc đó là bước khởi động chạy nền,
+# trạng thái xem tại /health/ready
+startup.add("database", init_database)
+startup.add("storage", storage_service.ensure_bucket)
+if settings.STARTUP_WARM_UP:
+    startup.add("render_workers", render_executor.warm_up, required=False)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup.start()
+    if settings.JOB_WORKER_MODE == "local":
+        # Job worker tự thử lại khi DB chưa sẵn sàng
+        job_runner.start(settings.JOB_WORKERS)
+    yield
+    startup.stop(timeout=5)
+    job_runner.stop()
+    render_executor.shutdown()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="Markdown to PDF System",
     description="Hệ thống chuyển đổi Markdown sang PDF",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """
+    Gắn request ID (lấy từ header X-Request-ID nếu hợp lệ) cho mọi request; các job render gửi đi
+    trong request mang theo ID này để profile được lưu theo đúng request.
+    """
+    request_id = request.headers.get("X-Request-ID")
+    if not profiling.valid_request_id(request_id):
+        request_id = uuid.uuid4().hex
+    explicit = profiling.should_profile(request.headers.get("X-Profile"))
+    with profiling.request_context(request_id, explicit=explicit):
+        response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    if explicit:
+        response.headers["X-Profiled"] = "true"
+    return response
+
+@app.exception_handler(RenderQueueFull)
+async def render_queue_full_handler(request: Request, exc: RenderQueueFull):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Hệ thống đang quá tải, vui lòng thử lại sau."},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 app.include_router(conversion_router, prefix="/api/v1/tools", tags=["Tools"])
 
 app.include_router(document_router, prefix="/api/v1/documents", tags=["Documents"])
 
+app.include_router(job_router, prefix="/api/v1/jobs", tags=["Jobs"])
+
+app.include_router(profile_router, prefix="/api/v1/profiles", tags=["Profiles"])
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics():
+    """
+    Metrics định dạng Prometheus: số liệu của process API cộng với số liệu cộng dồn
+    của các process render (phần tăng thêm gửi kèm kết quả mỗi job).
+    """
+    snapshots = [metrics.registry.snapshot(), render_executor.worker_metrics()]
+    return PlainTextResponse(
+        metrics.render_text(metrics.merge_snapshots(snapshots)),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+@app.get("/health/live", include_in_schema=False)
+async def liveness():
+    """Process còn phục vụ được request (event loop không bị treo)."""
+    return {"status": "alive"}
+
+@app.get("/health/ready", include_in_schema=False)
+def readiness():
+    """Sẵn sàng nhận traffic khi các bước khởi động đã xong; 503 kèm trạng thái từng bước nếu chưa."""
+    status = startup.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
 @app.get("/")
 async def root():
     return {"message": "Hệ thống đang hoạt động. Truy cập /docs để xem API."}
@@ -0,0 +1,62 @@
+"""
+Chuyển các version cũ (sources/{folder}/vN_source.ext, documents/{folder}/vN.pdf) sang blob lưu theo hash.
+Chạy được nhiều lần: version đã trỏ tới blobs/... được bỏ qua.
+
+Chạy: python -m app.migrate_blobs
+"""
+import logging
+import os
+from app.core.database import SessionLocal
+from app.core.migrations import init_database
+from app.models import DocumentVersion
+from app.services.blob_store import blob_store
+from app.services.storage import storage_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def migrate_version(db, version: DocumentVersion) -> list:
+    """Chuyển một version sang blob. Trả về các object cũ cần xóa sau khi commit."""
+    old_paths = []
+    for column in ("minio_path", "source_path"):
+        path = getattr(version, column)
+        if not path or blob_store.is_blob_path(path):
+            continue
+        data = storage_service.get_file_content(path)
+        if data is None:
+            logger.warning(f"Version {version.id}: object {path} not found, skipped")
+            continue
+        content_type = "application/pdf" if column == "minio_path" else "application/octet-stream"
+        setattr(version, column, blob_store.acquire(db, data, content_type))
+        old_paths.append(path)
+
+    if version.source_filename is None and version.source_path:
+        source_path = next((p for p in old_paths if p.startswith("sources/")), version.source_path)
+        version.source_filename = os.path.basename(source_path)
+    return old_paths
+
+
+def main():
+    init_database()
+
+    db = SessionLocal()
+    migrated = 0
+    try:
+        version_ids = [row.id for row in db.query(DocumentVersion.id).order_by(DocumentVersion.id)]
+        for version_id in version_ids:
+            version = db.query(DocumentVersion).filter(DocumentVersion.id == version_id).first()
+            old_paths = migrate_version(db, version)
+            db.commit()
+            # Object cũ chỉ bị xóa khi version đã trỏ sang blob
+            for path in old_paths:
+                storage_service.remove_object(path)
+            if old_paths:
+                migrated += 1
+    finally:
+        db.close()
+    logger.info(f"Migrated {migrated} document versions to content-addressed blobs")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,45 @@
-from sqlalchemy import Boolean, Column, Integer, String, Text, ForeignKey, DateTime
+from sqlalchemy import Boolean, Column, Index, Integer, String, Text, ForeignKey, DateTime
 from sqlalchemy.orm import relationship
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime
 from app.core.database import Base
+from app.services.compression import content_compressor
+import uuid
+
+class CompressedText(TypeDecorator):
+    """Cột text được nén khi ghi và giải nén khi đọc (app/services/compression.py); dòng cũ chưa nén đọc nguyên trạng."""
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return content_compressor.encode_text(value)
+
+    def process_result_value(self, value, dialect):
+        return content_compressor.decode_text(value)
+
 
 class Document(Base):
     __tablename__ = "documents"
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
-    current_content = Column(Text) # Nội dung có thể là markdown hoặc HTML
+    current_content = Column(CompressedText) # Nội dung có thể là markdown hoặc HTML, lưu nén
     content_format = Column(String, default="markdown") # 'markdown' hoặc 'html'
     current_version = Column(Integer, default=0)
     show_page_number = Column(Boolean, default=True)
+    math_backend = Column(String, nullable=True) # 'png', 'svg', 'mathml'; None = mặc định hệ thống
+    render_mode = Column(String, nullable=True) # 'full' hoặc 'sections'; None = 'full'
+    template = Column(String, nullable=True) # Tên mẫu trang (app/services/templates.py); None = mẫu mặc định
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     versions = relationship("DocumentVersion", back_populates="document")
 
+    __table_args__ = (
+        # Danh sách tài liệu: sắp theo updated_at, phân trang keyset theo (updated_at, id)
+        Index("ix_documents_updated_at_id", "updated_at", "id"),
+    )
+
 class DocumentVersion(Base):
     __tablename__ = "document_versions"
 
@@ -26,6 +49,49 @@ class DocumentVersion(Base):
     minio_path = Column(String) # Đường dẫn file PDF
     source_path = Column(String) # Đường dẫn file gốc
     source_extension = Column(String) # Loại file gốc
+    source_filename = Column(String, nullable=True) # Tên file gốc khi tải về, ví dụ v2_source.md
+    source_keyframe = Column(Integer, nullable=True) # Có giá trị = source_path là delta so với version trước, chuỗi bắt đầu từ version này (app/services/source_history.py)
+    source_hash = Column(String(64), nullable=True) # sha256 của source đầy đủ
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    document = relationship("Document", back_populates="versions")
\ No newline at end of file
+    document = relationship("Document", back_populates="versions")
+
+    __table_args__ = (
+        # Tìm version theo số hoặc version mới nhất (ORDER BY version_number DESC LIMIT 1) của một tài liệu
+        Index("ix_document_versions_document_id_version_number", "document_id", "version_number"),
+    )
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    # Object trên MinIO lưu theo sha256 của nội dung; DocumentVersion trỏ tới object_name
+    hash = Column(String(64), primary_key=True)
+    object_name = Column(String, nullable=False)
+    size = Column(Integer)
+    content_type = Column(String)
+    ref_count = Column(Integer, default=0) # Số DocumentVersion đang tham chiếu; 0 = chờ dọn
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class ConversionJob(Base):
+    __tablename__ = "conversion_jobs"
+
+    id = Column(String, primary_key=True, default=lambda: uuid.uuid4().hex)
+    kind = Column(String) # 'export', 'document_create' hoặc 'document_update'
+    status = Column(String, default="pending", index=True) # 'pending', 'running', 'succeeded', 'failed'
+    content = Column(Text) # Nội dung cần render (markdown hoặc HTML)
+    content_format = Column(String, default="markdown")
+    show_page_number = Column(Boolean, default=True)
+    math_backend = Column(String, nullable=True)
+    render_mode = Column(String, nullable=True)
+    template = Column(String, nullable=True)
+    source_extension = Column(String, nullable=True) # Đuôi file gốc khi lưu version
+    document_id = Column(Integer, ForeignKey("documents.id"), nullable=True)
+    version_number = Column(Integer, nullable=True) # Version được tạo khi job hoàn thành
+    result_path = Column(String, nullable=True) # Đường dẫn file PDF kết quả trên MinIO
+    error = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0)
+    profile_request_id = Column(String, nullable=True) # Request ID của request gửi job: profile của job lưu theo ID này
+    profile_explicit = Column(Boolean, default=False) # Request gửi job yêu cầu profile (X-Profile hoặc lấy mẫu)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
@@ -1,6 +1,24 @@
 from datetime import datetime
+from enum import Enum
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
+from app.services.templates import page_templates
+
+class MathBackend(str, Enum):
+    png = "png"
+    svg = "svg"
+    mathml = "mathml"  # Chỉ cho đầu ra HTML; khi xuất PDF được render bằng 'svg' (WeasyPrint không hỗ trợ MathML)
+
+class RenderMode(str, Enum):
+    full = "full"
+    sections = "sections"  # Render theo từng phần (tiêu đề cấp 1/ngắt trang), khi cập nhật chỉ render lại phần đã đổi; mỗi phần bắt đầu ở trang mới
+
+class DocumentSort(str, Enum):
+    newest = "-updated_at"  # Sửa gần nhất trước
+    oldest = "updated_at"
+
+# Tên các mẫu trang đã đăng ký (app/services/templates.py)
+PageTemplateName = Enum("PageTemplateName", {name: name for name in page_templates.names()}, type=str)
 
 class MarkdownRequest(BaseModel):
     md_content: str
@@ -17,11 +35,17 @@ class DocumentCreate(BaseModel):
     content: str
     content_format: str = "markdown"
     show_page_number: bool = True
+    math_backend: Optional[MathBackend] = None
+    render_mode: Optional[RenderMode] = None
+    template: Optional[PageTemplateName] = None
 
 class DocumentUpdate(BaseModel):
     md_content: str
     content_format: str = "markdown"
     show_page_number: bool = True
+    math_backend: Optional[MathBackend] = None  # None = giữ backend hiện tại của tài liệu
+    render_mode: Optional[RenderMode] = None  # None = giữ chế độ hiện tại của tài liệu
+    template: Optional[PageTemplateName] = None  # None = giữ mẫu trang hiện tại của tài liệu
 
 class DocumentVersionResponse(BaseModel):
     version_number: int
@@ -35,5 +59,37 @@ class DocumentResponse(BaseModel):
     content_format: str
     current_version: int
     show_page_number: bool
+    math_backend: Optional[str] = None
+    render_mode: Optional[str] = None
+    template: Optional[str] = None
     updated_at: datetime
-    # versions: List[DocumentVersionResponse] = [] # Optional nếu muốn load hết
\ No newline at end of file
+    # versions: List[DocumentVersionResponse] = [] # Optional nếu muốn load hết
+
+class DocumentSummary(BaseModel):
+    """Một dòng của danh sách tài liệu; current_content chỉ có khi được yêu cầu qua ?fields=current_content."""
+    id: int
+    title: str
+    content_format: str
+    current_version: int
+    show_page_number: bool
+    math_backend: Optional[str] = None
+    render_mode: Optional[str] = None
+    template: Optional[str] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    current_content: Optional[str] = None
+
+class DocumentListResponse(BaseModel):
+    items: List[DocumentSummary]
+    next_cursor: Optional[str] = None  # Truyền vào ?cursor= để lấy trang kế tiếp; None = hết
+
+class JobResponse(BaseModel):
+    id: str
+    kind: str
+    status: str
+    document_id: Optional[int] = None
+    version_number: Optional[int] = None
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -0,0 +1,188 @@
+import asyncio
+import base64
+import json
+import logging
+import mimetypes
+import posixpath
+import zipfile
+from functools import partial
+from urllib.parse import unquote, urlsplit
+from app.core import metrics
+from app.core.config import settings
+from app.services.html_pipeline import HTMLPipeline, RewriteRelativeURLs
+from app.services.render_executor import RenderQueueFull, convert_markdown_job, pdf_math_backend, render_executor, render_pdf_job
+
+logger = logging.getLogger(__name__)
+
+MARKDOWN_EXTENSIONS = (".md", ".markdown", ".txt")
+HTML_EXTENSIONS = (".html", ".htm")
+
+class BatchArchiveError(ValueError):
+    pass
+
+
+def list_entries(archive: zipfile.ZipFile):
+    """
+    Chia các file trong ZIP thành (cần chuyển đổi, bỏ qua). Kiểm tra giới hạn số file
+    và dung lượng giải nén trước khi đọc để tránh zip bomb.
+    """
+    convertible = []
+    skipped = []
+    for info in archive.infolist():
+        name = info.filename
+        if info.is_dir() or name.startswith("__MACOSX/") or posixpath.basename(name).startswith("."):
+            continue
+        if not name.lower().endswith(MARKDOWN_EXTENSIONS + HTML_EXTENSIONS):
+            # Ảnh và file khác chỉ dùng làm tài nguyên cho các tài liệu
+            continue
+        if info.file_size > settings.BATCH_MAX_FILE_BYTES:
+            skipped.append({"file": name, "error": f"File lớn hơn {settings.BATCH_MAX_FILE_BYTES} bytes"})
+            continue
+        convertible.append(info)
+
+    if not convertible and not skipped:
+        raise BatchArchiveError("File ZIP không chứa file .md, .markdown, .txt, .html hoặc .htm nào.")
+    if len(convertible) > settings.BATCH_MAX_FILES:
+        raise BatchArchiveError(f"File ZIP chứa quá {settings.BATCH_MAX_FILES} tài liệu.")
+    return convertible, skipped
+
+
+def output_name(entry_name: str) -> str:
+    """docs/intro.md -> docs/intro.pdf (giữ nguyên cấu trúc thư mục)."""
+    return posixpath.splitext(entry_name)[0] + ".pdf"
+
+
+def inline_archive_images(html_content: str, archive: zipfile.ZipFile, entry_name: str) -> str:
+    """
+    Thay src tương đối của <img> bằng data: URI đọc từ chính file ZIP, tính theo thư mục của tài liệu.
+    Đường dẫn thoát ra ngoài archive (../), tuyệt đối hoặc có scheme (http:, data:...) được giữ nguyên.
+    """
+    names = set(archive.namelist())
+    base_dir = posixpath.dirname(entry_name)
+
+    def resolve(src):
+        # RewriteRelativeURLs chỉ gọi với URL tương đối; None = giữ nguyên
+        path = posixpath.normpath(posixpath.join(base_dir, unquote(urlsplit(src).path)))
+        if path.startswith("../") or path not in names:
+            return None
+        if archive.getinfo(path).file_size > settings.BATCH_MAX_FILE_BYTES:
+            return None
+        mime_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        data = base64.b64encode(archive.read(path)).decode("ascii")
+        return f"data:{mime_type};base64,{data}"
+
+    pipeline = HTMLPipeline([partial(RewriteRelativeURLs, resolve, {"img": ("src",)})])
+    return pipeline.run(html_content)
+
+
+class ZipStreamWriter:
+    """
+    Đích ghi không seek được cho zipfile.ZipFile: dữ liệu ZIP được lấy ra dần bằng drain()
+    để stream về client, không giữ cả file ZIP kết quả trong bộ nhớ.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data) -> int:
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+async def _run_job(fn, *args, **kwargs):
+    # Executor đầy thì chờ rồi thử lại thay vì làm hỏng cả lô
+    for attempt in range(3):
+        try:
+            return await render_executor.run(fn, *args, **kwargs)
+        except RenderQueueFull as e:
+            if attempt == 2:
+                raise
+            await asyncio.sleep(e.retry_after)
+
+
+async def convert_entry(
+    archive: zipfile.ZipFile, name: str, show_page_number: bool, math_backend: str = None, template: str = None
+) -> bytes:
+    """Một tài liệu trong ZIP -> PDF. Markdown được convert trước để ảnh tương đối được nhúng từ archive."""
+    content = await asyncio.to_thread(archive.read, name)
+    text = content.decode("utf-8")
+    is_markdown = name.lower().endswith(MARKDOWN_EXTENSIONS)
+    with metrics.track_request("tools.upload.batch", "markdown" if is_markdown else "html"):
+        metrics.DOCUMENT_SIZE_BYTES.observe(len(content))
+        if is_markdown:
+            html_content = await _run_job(convert_markdown_job, text, math_backend=pdf_math_backend(math_backend))
+        else:
+            html_content = text
+        html_content = await asyncio.to_thread(inline_archive_images, html_content, archive, name)
+        pdf_bytes, _ = await _run_job(
+            render_pdf_job, html_content, show_page_number=show_page_number, postprocess=not is_markdown, template=template
+        )
+    return pdf_bytes
+
+
+async def stream_batch_zip(
+    archive: zipfile.ZipFile,
+    entries: list,
+    skipped: list,
+    show_page_number: bool = True,
+    math_backend: str = None,
+    template: str = None,
+    concurrency: int = settings.BATCH_CONCURRENCY
+):
+    """
+    Chuyển đổi các tài liệu với tối đa concurrency tài liệu cùng lúc và stream ZIP kết quả:
+    PDF nào xong trước được ghi trước. manifest.json ở cuối ZIP liệt kê file thành công và thất bại.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(info):
+        async with semaphore:
+            try:
+                return info.filename, await convert_entry(archive, info.filename, show_page_number, math_backend, template), None
+            except UnicodeDecodeError:
+                return info.filename, None, "File không phải định dạng UTF-8 hợp lệ."
+            except Exception as e:
+                logger.error(f"Batch conversion of {info.filename} failed: {e}")
+                return info.filename, None, str(e)
+
+    sink = ZipStreamWriter()
+    converted = []
+    failed = list(skipped)
+    used_names = set()
+    tasks = [asyncio.create_task(run(info)) for info in entries]
+    try:
+        # PDF gần như không nén được thêm nên lưu ZIP_STORED, tiết kiệm CPU
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as output:
+            for next_done in asyncio.as_completed(tasks):
+                name, pdf_bytes, error = await next_done
+                if error is not None:
+                    failed.append({"file": name, "error": error})
+                    continue
+                pdf_name = output_name(name)
+                if pdf_name in used_names:
+                    # a.md và a.html cùng thư mục
+                    pdf_name = name + ".pdf"
+                used_names.add(pdf_name)
+                output.writestr(pdf_name, pdf_bytes)
+                converted.append({"file": name, "pdf": pdf_name})
+                yield sink.drain()
+
+            manifest = {"converted": converted, "failed": failed}
+            output.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+        yield sink.drain()
+    finally:
+        # Client ngắt kết nối giữa chừng: hủy các tài liệu chưa xử lý
+        for task in tasks:
+            task.cancel()
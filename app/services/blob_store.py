@@ -0,0 +1,143 @@
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.models import Blob
+from app.services.compression import COMPRESSED_SUFFIX
+from app.services.storage import StorageService, storage_service
+
+logger = logging.getLogger(__name__)
+
+# Dấu đánh dấu blob đang upload: {PENDING_PREFIX}{object_name}, object rỗng
+PENDING_PREFIX = "pending-blobs/"
+
+
+class BlobStore:
+    """
+    Lưu source/PDF của các version theo nội dung (content-addressed) trên StorageService.
+
+    - acquire() trả về object_name của blob và tăng ref_count; nội dung đã có thì không upload lại.
+    - release() chỉ giảm ref_count. Blob về 0 được collect() xóa sau khi transaction của
+      caller đã commit, nên rollback không bao giờ làm mất object mà version còn trỏ tới.
+    - Source dạng text được StorageService lưu nén (object_name có đuôi .mdz), get_file_content trả về bản gốc.
+    - Mọi thay đổi ref_count đều khóa dòng blobs (FOR UPDATE), an toàn khi nhiều worker chạy song song.
+    - Object mới được upload trước khi transaction của caller commit, nên trước khi upload một dấu
+      PENDING_PREFIX + object_name được ghi lên storage (không phụ thuộc transaction, không cần thêm kết nối DB).
+      Caller rollback (hoặc process chết) thì sweep_pending xóa object không có dòng blobs nào trỏ tới
+      sau pending_grace_seconds.
+    """
+    def __init__(self, storage: StorageService = storage_service, pending_grace_seconds: int = settings.BLOB_PENDING_GRACE_SECONDS):
+        self.storage = storage
+        self.pending_grace_seconds = pending_grace_seconds
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def is_blob_path(object_name: str) -> bool:
+        return bool(object_name) and object_name.startswith("blobs/")
+
+    def _lock(self, db: Session, digest: str):
+        return db.query(Blob).filter(Blob.hash == digest).with_for_update().first()
+
+    def acquire(self, db: Session, data: bytes, content_type: str = "application/octet-stream") -> str:
+        """Thêm một tham chiếu tới blob chứa data. Caller chịu trách nhiệm commit."""
+        digest = self.digest(data)
+        blob = self._lock(db, digest)
+        if blob is None:
+            try:
+                with db.begin_nested():
+                    blob = Blob(
+                        hash=digest,
+                        object_name=self.storage.blob_object_name(digest, content_type, len(data)),
+                        size=len(data),
+                        content_type=content_type,
+                        ref_count=0
+                    )
+                    db.add(blob)
+            except IntegrityError:
+                # Request khác vừa tạo cùng blob: dùng dòng của nó
+                blob = self._lock(db, digest)
+
+        if not blob.ref_count:
+            # Blob mới, hoặc blob đang chờ dọn (object có thể đã bị xóa): upload lại
+            self._record_pending(blob.object_name)
+            self.storage.upload_blob(data, blob.object_name, content_type)
+        blob.ref_count = (blob.ref_count or 0) + 1
+        return blob.object_name
+
+    def _record_pending(self, object_name: str):
+        # Ghi lại mỗi lần upload: thời điểm của dấu là lần upload gần nhất
+        self.storage.put_object(PENDING_PREFIX + object_name, b"")
+
+    def release(self, db: Session, object_name: str):
+        """Bỏ một tham chiếu. Trả về hash của blob để truyền cho collect() sau khi commit."""
+        digest = object_name.rsplit("/", 1)[-1].removesuffix(COMPRESSED_SUFFIX)
+        blob = self._lock(db, digest)
+        if blob is None:
+            return None
+        blob.ref_count = max(0, (blob.ref_count or 0) - 1)
+        return digest
+
+    def collect(self, db: Session, digests) -> int:
+        """Xóa object và dòng blobs của các blob không còn tham chiếu, rồi dọn blob upload dở (sweep_pending). Trả về số object đã xóa."""
+        removed = 0
+        for digest in set(d for d in digests if d):
+            blob = self._lock(db, digest)
+            if blob is None or blob.ref_count:
+                db.rollback()
+                continue
+            try:
+                self.storage.remove_object(blob.object_name)
+            except Exception as e:
+                logger.error(f"Failed to remove blob {blob.object_name}: {e}")
+                db.rollback()
+                continue
+            db.delete(blob)
+            db.commit()
+            removed += 1
+        return removed + self.sweep_pending(db)
+
+    def sweep_pending(self, db: Session, limit: int = 500) -> int:
+        """
+        Xử lý các dấu upload cũ hơn pending_grace_seconds: object có dòng blobs trỏ tới (kể cả ref_count 0,
+        do collect xử lý) được giữ, object không có (transaction upload nó đã rollback) bị xóa; sau đó xóa dấu.
+        Trả về số object đã xóa.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.pending_grace_seconds)
+        markers = []
+        for obj in self.storage.list_objects(PENDING_PREFIX):
+            # Upload lại gần đây (dấu mới): transaction có thể vẫn đang chạy
+            if obj.last_modified is not None and obj.last_modified < cutoff:
+                markers.append(obj.object_name)
+                if len(markers) >= limit:
+                    break
+        if not markers:
+            return 0
+        names = {marker[len(PENDING_PREFIX):] for marker in markers}
+        kept = {name for (name,) in db.query(Blob.object_name).filter(Blob.object_name.in_(names))}
+        db.rollback()
+
+        removed = 0
+        for name in sorted(names):
+            try:
+                if name not in kept:
+                    # Kiểm tra lại ngay trước khi xóa: request khác vừa upload lại cùng blob thì dấu đã mới
+                    marker = self.storage.stat(PENDING_PREFIX + name)
+                    if marker is None or marker.last_modified is None or marker.last_modified >= cutoff:
+                        continue
+                    self.storage.remove_object(name)
+                    removed += 1
+                self.storage.remove_object(PENDING_PREFIX + name)
+            except Exception as e:
+                # Giữ dấu để lần dọn sau thử lại
+                logger.error(f"Failed to remove orphaned blob {name}: {e}")
+        if removed:
+            logger.info(f"Removed {removed} orphaned blobs")
+        return removed
+
+
+blob_store = BlobStore()
@@ -0,0 +1,214 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(*parts) -> str:
+    """
+    Tạo khóa cache (sha256 hex) từ một tập các thành phần.
+    Mỗi thành phần được phân tách bằng byte 0 để tránh va chạm kiểu ("ab", "c") và ("a", "bc").
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, bytes):
+            digest.update(part)
+        else:
+            digest.update(str(part).encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class MemoryLRUCache:
+    """
+    Cache LRU trong bộ nhớ, giới hạn theo tổng số byte của các giá trị.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def contains(self, key: str) -> bool:
+        """Kiểm tra khóa mà không tính vào hits/misses và không đổi thứ tự LRU."""
+        with self._lock:
+            return key in self._data
+
+    def set(self, key: str, value: bytes):
+        size = len(value)
+        # Giá trị lớn hơn cả ngân sách thì bỏ qua, không đẩy toàn bộ cache ra ngoài
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._data[key] = value
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class DiskCache:
+    """
+    Cache trên đĩa, tồn tại qua các lần khởi động lại.
+    Mỗi khóa là một file; mtime được cập nhật khi đọc để phục vụ loại bỏ LRU.
+    max_bytes = 0 nghĩa là không giới hạn dung lượng.
+    """
+    def __init__(self, directory: str, max_bytes: int = 0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._scan())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def _scan(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_mtime, st.st_size
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return value
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def set(self, key: str, value: bytes):
+        if self.max_bytes and len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            # Ghi ra file tạm rồi rename để tránh đọc phải file ghi dở
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Disk cache write failed for {key}: {e}")
+            return
+        with self._lock:
+            self._size += len(value) - old_size
+            if self.max_bytes and self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Xóa các file ít được dùng gần đây nhất cho tới khi về dưới ngưỡng.
+        # Tính lại dung lượng từ thư mục vì nhiều process có thể dùng chung một cache.
+        entries = sorted(self._scan(), key=lambda item: item[1])
+        self._size = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self._size -= size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class TieredCache:
+    """
+    Cache 2 tầng: bộ nhớ (LRU) ở trước, tầng phụ (đĩa, MinIO, ...) ở sau.
+    Tầng phụ chỉ cần có get(key) và set(key, value). Khi trúng ở tầng phụ,
+    giá trị được đưa ngược lên bộ nhớ.
+    """
+    def __init__(self, memory: MemoryLRUCache, secondary=None):
+        self.memory = memory
+        self.secondary = secondary
+
+    def get(self, key: str):
+        value = self.memory.get(key)
+        if value is not None or self.secondary is None:
+            return value
+        value = self.secondary.get(key)
+        if value is not None:
+            self.memory.set(key, value)
+        return value
+
+    def contains(self, key: str) -> bool:
+        if self.memory.contains(key):
+            return True
+        return self.secondary is not None and hasattr(self.secondary, "contains") and self.secondary.contains(key)
+
+    def set(self, key: str, value: bytes):
+        self.memory.set(key, value)
+        if self.secondary is not None:
+            self.secondary.set(key, value)
+
+    def stats(self) -> dict:
+        result = {"memory": self.memory.stats()}
+        if self.secondary is not None and hasattr(self.secondary, "stats"):
+            result["secondary"] = self.secondary.stats()
+        return result
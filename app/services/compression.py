@@ -0,0 +1,170 @@
+"""
+Nén trong suốt source lưu trên MinIO và cột Document.current_content.
+
+Định dạng (mỗi bản nén tự mô tả, bản cũ chưa nén vẫn đọc được):
+- Frame nhị phân: FRAME_MAGIC + 1 byte codec + payload. Codec 'zstd' dùng dictionary nếu có
+  (dict id nằm trong header của frame zstd, nên đổi dictionary không làm hỏng bản đã ghi), 'zlib' dự phòng,
+  'raw' = không nén.
+- Object trên MinIO: blob được nén có đuôi COMPRESSED_SUFFIX (blobs/ab/abcd....mdz). Tên object là dấu hiệu
+  duy nhất để giải nén, object cũ (không đuôi) được đọc nguyên trạng.
+- Cột text: TEXT_MARKER + base64 của frame. Nội dung chưa nén không bao giờ bắt đầu bằng ký tự điều khiển \\x01
+  (nội dung bắt đầu như vậy luôn được lưu dưới dạng frame, kể cả codec 'raw').
+
+Dictionary: file COMPRESSION_DICTIONARY dùng để nén bản mới; mọi file *.zdict cùng thư mục được nạp để giải nén
+bản cũ. Tạo dictionary từ tài liệu thật bằng `python -m app.train_dictionary`.
+"""
+import base64
+import glob
+import os
+import threading
+import zlib
+import zstandard
+from app.core import metrics
+from app.core.config import settings
+
+FRAME_MAGIC = b"\x00MDZ"
+COMPRESSED_SUFFIX = ".mdz"
+COMPRESSED_CONTENT_TYPE = "application/x-mdpdf-compressed"
+TEXT_MARKER = "\x01mdz:"
+
+CODECS = {"raw": 0, "zstd": 1, "zlib": 2}
+_CODEC_NAMES = {value: name for name, value in CODECS.items()}
+
+COMPRESSION_BYTES = metrics.Counter(
+    "mdpdf_compression_bytes_total",
+    "Số byte trước (raw) và sau khi nén (stored), theo nơi lưu",
+    ("target", "state")
+)
+
+
+def load_dictionary(path: str) -> zstandard.ZstdCompressionDict:
+    with open(path, "rb") as f:
+        return zstandard.ZstdCompressionDict(f.read())
+
+
+def train_dictionary(samples: list, size: int = 112 * 1024) -> bytes:
+    """Huấn luyện dictionary zstd từ các mẫu (bytes). Cần khoảng vài trăm mẫu trở lên."""
+    return zstandard.train_dictionary(size, samples).as_bytes()
+
+
+class ContentCompressor:
+    def __init__(
+        self,
+        codec: str = settings.COMPRESSION_CODEC,
+        level: int = settings.COMPRESSION_LEVEL,
+        min_bytes: int = settings.COMPRESSION_MIN_BYTES,
+        dictionary_path: str = settings.COMPRESSION_DICTIONARY
+    ):
+        if codec not in ("none",) + tuple(CODECS):
+            raise ValueError(f"COMPRESSION_CODEC không hợp lệ: {codec}")
+        self.codec = None if codec in ("none", "raw") else codec
+        self.level = level
+        self.min_bytes = min_bytes
+        self.dictionary = None
+        # Giải nén được mọi dictionary đã từng dùng, theo dict id
+        self.dictionaries = {}
+        if dictionary_path:
+            self.dictionary = load_dictionary(dictionary_path)
+            for path in glob.glob(os.path.join(os.path.dirname(dictionary_path) or ".", "*.zdict")):
+                dictionary = load_dictionary(path)
+                self.dictionaries[dictionary.dict_id()] = dictionary
+            self.dictionaries[self.dictionary.dict_id()] = self.dictionary
+            self.dictionary.precompute_compress(level=level)
+        # ZstdCompressor/ZstdDecompressor không dùng chung được giữa các thread
+        self._local = threading.local()
+
+    @property
+    def enabled(self) -> bool:
+        return self.codec is not None
+
+    def should_compress(self, content_type: str, size: int) -> bool:
+        """Chỉ nén nội dung dạng text đủ lớn; PDF, ảnh, delta đã nén sẵn nên bỏ qua."""
+        return self.enabled and size >= self.min_bytes and bool(content_type) and content_type.startswith("text/")
+
+    def _compressor(self) -> zstandard.ZstdCompressor:
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            compressor = self._local.compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self.dictionary)
+        return compressor
+
+    def _decompressor(self, dict_id: int) -> zstandard.ZstdDecompressor:
+        decompressors = getattr(self._local, "decompressors", None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+        decompressor = decompressors.get(dict_id)
+        if decompressor is None:
+            dictionary = None
+            if dict_id:
+                dictionary = self.dictionaries.get(dict_id)
+                if dictionary is None:
+                    raise ValueError(f"Thiếu dictionary nén {dict_id} (xem COMPRESSION_DICTIONARY).")
+            decompressor = decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=dictionary)
+        return decompressor
+
+    def compress(self, data: bytes, codec: str = None) -> bytes:
+        codec = codec or self.codec or "raw"
+        if codec == "zstd":
+            payload = self._compressor().compress(data)
+        elif codec == "zlib":
+            payload = zlib.compress(data, min(max(self.level, 1), 9))
+        else:
+            payload = data
+        return FRAME_MAGIC + bytes((CODECS[codec],)) + payload
+
+    def decompress(self, frame: bytes) -> bytes:
+        if not frame.startswith(FRAME_MAGIC) or len(frame) <= len(FRAME_MAGIC):
+            raise ValueError("Dữ liệu nén không hợp lệ.")
+        codec = _CODEC_NAMES.get(frame[len(FRAME_MAGIC)])
+        payload = frame[len(FRAME_MAGIC) + 1:]
+        if codec == "zstd":
+            dict_id = zstandard.get_frame_parameters(payload).dict_id
+            return self._decompressor(dict_id).decompress(payload)
+        if codec == "zlib":
+            return zlib.decompress(payload)
+        if codec == "raw":
+            return payload
+        raise ValueError("Dữ liệu nén không hợp lệ.")
+
+    def encode_blob(self, data: bytes) -> bytes:
+        stored = self.compress(data)
+        COMPRESSION_BYTES.inc(len(data), target="object", state="raw")
+        COMPRESSION_BYTES.inc(len(stored), target="object", state="stored")
+        return stored
+
+    def encode_text(self, value: str) -> str:
+        """Giá trị lưu vào cột text: bản gốc nếu ngắn hoặc nén không lợi, ngược lại TEXT_MARKER + base64(frame)."""
+        if value is None:
+            return None
+        must_frame = value.startswith(TEXT_MARKER[0])
+        if not must_frame and (not self.enabled or len(value) < self.min_bytes):
+            return value
+        data = value.encode("utf-8")
+        encoded = TEXT_MARKER + base64.b64encode(self.compress(data)).decode("ascii")
+        if len(encoded) >= len(data):
+            if not must_frame:
+                return value
+            encoded = TEXT_MARKER + base64.b64encode(self.compress(data, "raw")).decode("ascii")
+        COMPRESSION_BYTES.inc(len(data), target="column", state="raw")
+        COMPRESSION_BYTES.inc(len(encoded), target="column", state="stored")
+        return encoded
+
+    def decode_text(self, value: str) -> str:
+        if value is None or not value.startswith(TEXT_MARKER):
+            return value
+        return self.decompress(base64.b64decode(value[len(TEXT_MARKER):])).decode("utf-8")
+
+    def stats(self) -> dict:
+        return {
+            "codec": self.codec or "none",
+            "level": self.level,
+            "min_bytes": self.min_bytes,
+            "dictionary_id": self.dictionary.dict_id() if self.dictionary is not None else None,
+            "dictionaries": sorted(self.dictionaries),
+        }
+
+
+def is_compressed_object(object_name: str) -> bool:
+    return bool(object_name) and object_name.endswith(COMPRESSED_SUFFIX)
+
+
+content_compressor = ContentCompressor()
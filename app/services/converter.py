@@ -1,72 +1,463 @@
 import mistune
 from mistune.renderers.html import HTMLRenderer
-import matplotlib.pyplot as plt
+import latex2mathml.converter
 import io
 import base64
+import multiprocessing
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from app.core import metrics
+from app.core.config import settings
+from app.services.cache import DiskCache, MemoryLRUCache, TieredCache, make_cache_key
 
-# Cấu hình Matplotlib để vẽ công thức toán
-plt.rcParams.update({
-    "text.usetex": False,
-    "mathtext.fontset": "cm",
-})
+_pyplot = None
 
-def latex_to_base64_image(latex_str, fontsize=12, color='black'):
+def get_pyplot():
     """
-    Hàm vẽ chuỗi LaTeX thành ảnh PNG trong suốt và trả về chuỗi Base64.
+    Import matplotlib khi cần (chỉ backend png/svg dùng tới),
+    tránh kéo thư viện nặng vào mọi worker.
     """
+    global _pyplot
+    if _pyplot is None:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        # Cấu hình Matplotlib để vẽ công thức toán
+        plt.rcParams.update({
+            "text.usetex": False,
+            "mathtext.fontset": "cm",
+            "svg.fonttype": "path",  # SVG xuất glyph dạng path, không phụ thuộc font máy đích
+        })
+        _pyplot = plt
+    return _pyplot
+
+# Cache công thức đã render: khóa theo (backend, latex, fontsize, color, dpi)
+formula_cache = TieredCache(
+    MemoryLRUCache(settings.MATH_CACHE_MAX_BYTES),
+    DiskCache(settings.MATH_CACHE_DIR, settings.MATH_CACHE_DISK_MAX_BYTES) if settings.MATH_CACHE_DIR else None
+)
+
+def _render_mathtext(latex_str, fmt, fontsize, color, dpi):
+    plt = get_pyplot()
+    fig = plt.figure(figsize=(0.1, 0.1))
     try:
-        fig = plt.figure(figsize=(0.1, 0.1))
-        
         clean_latex = latex_str.strip('$')
         text = f"${clean_latex}$"
-        
+
         fig.text(0, 0, text, fontsize=fontsize, color=color)
-        
+
         buffer = io.BytesIO()
-        
-        fig.savefig(buffer, format='png', transparent=True, dpi=200, bbox_inches='tight', pad_inches=0.02)
+        # Bỏ metadata ngày tạo để cùng công thức luôn cho cùng một output
+        metadata = {"Date": None} if fmt == "svg" else None
+        fig.savefig(buffer, format=fmt, transparent=True, dpi=dpi, bbox_inches='tight', pad_inches=0.02, metadata=metadata)
+        return buffer.getvalue()
+    finally:
         plt.close(fig)
-        
-        buffer.seek(0)
-        img_str = base64.b64encode(buffer.read()).decode('utf-8')
+
+def latex_to_base64_image(latex_str, fontsize=12, color='black', dpi=200):
+    """
+    Hàm vẽ chuỗi LaTeX thành ảnh PNG trong suốt và trả về chuỗi Base64.
+    """
+    try:
+        img_str = base64.b64encode(_render_mathtext(latex_str, 'png', fontsize, color, dpi)).decode('utf-8')
         return f"data:image/png;base64,{img_str}"
     except Exception as e:
         print(f"Error rendering math: {e}")
         return None
 
+def latex_to_base64_svg(latex_str, fontsize=12, color='black'):
+    """
+    Hàm vẽ chuỗi LaTeX thành ảnh SVG dạng vector (glyph là path) và trả về chuỗi Base64.
+    """
+    try:
+        svg_str = base64.b64encode(_render_mathtext(latex_str, 'svg', fontsize, color, 72)).decode('utf-8')
+        return f"data:image/svg+xml;base64,{svg_str}"
+    except Exception as e:
+        print(f"Error rendering math: {e}")
+        return None
+
+def latex_to_mathml(latex_str, display=False):
+    """
+    Chuyển chuỗi LaTeX sang MathML bằng latex2mathml (không cần matplotlib).
+    Lưu ý: WeasyPrint không dàn trang MathML, nên backend này phù hợp nhất cho xuất HTML.
+    """
+    try:
+        return latex2mathml.converter.convert(latex_str.strip('$'), display="block" if display else "inline")
+    except Exception as e:
+        print(f"Error rendering math: {e}")
+        return None
+
+class MathBackend:
+    """
+    Backend render công thức toán. Lớp con cài đặt _render() (trả về payload)
+    và to_html() (bọc payload thành HTML). Thời gian render được cộng dồn để so sánh các backend.
+    """
+    name = None
+    # Backend đủ chậm để đáng render song song trên process pool
+    parallel = True
+
+    def __init__(self, color='black'):
+        self.color = color
+        self._lock = threading.Lock()
+        self.renders = 0
+        self.failures = 0
+        self.render_seconds = 0.0
+
+    def cache_key(self, text, display):
+        raise NotImplementedError
+
+    def _render(self, text, display):
+        raise NotImplementedError
+
+    def to_html(self, payload, text, display):
+        raise NotImplementedError
+
+    def render(self, text, display=False):
+        """Trả về payload của công thức, tra formula_cache trước. Lỗi (None) không được cache."""
+        key = self.cache_key(text, display)
+        cached = formula_cache.get(key)
+        if cached is not None:
+            return cached.decode('utf-8')
+
+        start = time.perf_counter()
+        payload = self._render(text, display)
+        self._record(key, payload, time.perf_counter() - start)
+        return payload
+
+    def _record(self, key, payload, elapsed):
+        metrics.STAGE_SECONDS.observe(elapsed, stage="math_render")
+        with self._lock:
+            self.renders += 1
+            self.render_seconds += elapsed
+            if not payload:
+                self.failures += 1
+
+        if payload:
+            formula_cache.set(key, payload.encode('utf-8'))
+
+    def prerender(self, formulas, pool: ProcessPoolExecutor, workers: int) -> int:
+        """
+        Render trước danh sách công thức (text, display) trên process pool.
+        Công thức trùng lặp hoặc đã có trong cache bị bỏ qua; kết quả được ghi vào formula_cache
+        để renderer chỉ việc thay thế. Trả về số công thức đã render.
+        Nếu cache quá nhỏ và kết quả bị loại bỏ trước khi dùng, renderer sẽ render lại tuần tự.
+        """
+        pending = {}
+        for text, display in formulas:
+            key = self.cache_key(text, display)
+            if key not in pending and not formula_cache.contains(key):
+                pending[key] = (text, display)
+
+        if len(pending) < settings.MATH_PARALLEL_MIN_FORMULAS:
+            return 0
+
+        keys = list(pending)
+        chunksize = max(1, len(keys) // (workers * 4))
+        try:
+            results = pool.map(
+                _render_formula_job,
+                [self.name] * len(keys),
+                [pending[key][0] for key in keys],
+                [pending[key][1] for key in keys],
+                chunksize=chunksize
+            )
+            for key, (payload, elapsed) in zip(keys, results):
+                self._record(key, payload, elapsed)
+        except Exception as e:
+            # Pool lỗi (ví dụ process con bị kill): phần còn lại render tuần tự như bình thường
+            print(f"Error prerendering math: {e}")
+        return len(keys)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "renders": self.renders,
+                "failures": self.failures,
+                "render_seconds": round(self.render_seconds, 6),
+                "avg_render_ms": round(self.render_seconds * 1000 / self.renders, 3) if self.renders else None,
+            }
+
+class PngMathBackend(MathBackend):
+    """Ảnh PNG raster qua matplotlib (hành vi mặc định trước đây)."""
+    name = "png"
+
+    def __init__(self, dpi=200, **kwargs):
+        super().__init__(**kwargs)
+        self.dpi = dpi
+
+    def _fontsize(self, display):
+        return 18 if display else 14
+
+    def cache_key(self, text, display):
+        return make_cache_key(self.name, text, self._fontsize(display), self.color, self.dpi)
+
+    def _render(self, text, display):
+        return latex_to_base64_image(text, fontsize=self._fontsize(display), color=self.color, dpi=self.dpi)
+
+    def to_html(self, payload, text, display):
+        if display:
+            return f'<div class="math-block" style="text-align: center; margin: 1em 0;"><img src="{payload}" alt="{text}" /></div>'
+        return f'<img src="{payload}" alt="{text}" style="vertical-align: -20%; height: 1.2em;" class="math-inline" />'
+
+class SvgMathBackend(PngMathBackend):
+    """Ảnh SVG vector dựng từ path của mathtext, không phụ thuộc dpi."""
+    name = "svg"
+
+    def cache_key(self, text, display):
+        return make_cache_key(self.name, text, self._fontsize(display), self.color)
+
+    def _render(self, text, display):
+        return latex_to_base64_svg(text, fontsize=self._fontsize(display), color=self.color)
+
+class MathMLBackend(MathBackend):
+    """MathML qua latex2mathml, không dùng matplotlib."""
+    name = "mathml"
+    parallel = False  # latex2mathml đủ nhanh, chi phí IPC lớn hơn lợi ích
+
+    def cache_key(self, text, display):
+        return make_cache_key(self.name, text, display)
+
+    def _render(self, text, display):
+        return latex_to_mathml(text, display=display)
+
+    def to_html(self, payload, text, display):
+        if display:
+            return f'<div class="math-block" style="text-align: center; margin: 1em 0;">{payload}</div>'
+        return f'<span class="math-inline">{payload}</span>'
+
+math_backends = {
+    backend.name: backend
+    for backend in (PngMathBackend(), SvgMathBackend(), MathMLBackend())
+}
+
+def _init_render_worker():
+    # Import matplotlib một lần khi process con khởi động, không phải ở công thức đầu tiên
+    get_pyplot()
+
+def _render_formula_job(backend_name, text, display):
+    """
+    Chạy trong process con: render một công thức (không qua cache), trả về (payload, thời gian).
+    """
+    start = time.perf_counter()
+    payload = math_backends[backend_name]._render(text, display)
+    return payload, time.perf_counter() - start
+
+def _collect_math(md, tokens, state, formulas):
+    """
+    Parse inline cho các block token (giống Markdown._iter_render của mistune, token đã có
+    children sẽ không bị parse lại) và thu thập các công thức toán gặp được.
+    """
+    for tok in tokens:
+        if "children" in tok:
+            _collect_math(md, tok["children"], state, formulas)
+        elif "text" in tok:
+            text = tok.pop("text")
+            tok["children"] = md.inline(text.strip(" \r\n\t\f"), state.env)
+            _collect_math(md, tok["children"], state, formulas)
+
+        if tok["type"] == "inline_math":
+            formulas.append((tok["raw"], False))
+        elif tok["type"] == "block_math":
+            formulas.append((tok["raw"], True))
+
+def _tighten_list_items(md, state):
+    """
+    Hook trước khi render: mục list có đúng một đoạn văn con trực tiếp (ngoài nó chỉ có list lồng nhau)
+    được render đoạn đó không kèm <p> (giống list "tight"), cùng quy tắc với UnwrapListParagraphs của
+    PDFGenerator.clean_html, nên HTML sinh từ Markdown không cần qua clean_html nữa.
+    """
+    def walk(tokens):
+        for tok in tokens:
+            children = tok.get("children")
+            if not children:
+                continue
+            if tok["type"] in ("list_item", "task_list_item"):
+                paragraphs = [child for child in children if child["type"] == "paragraph"]
+                others = [child for child in children if child["type"] not in ("paragraph", "list", "blank_line")]
+                if len(paragraphs) == 1 and not others:
+                    paragraphs[0]["type"] = "block_text"
+            walk(children)
+    walk(state.tokens)
+
 class MathImageRenderer(HTMLRenderer):
     """
-    Custom Renderer: Biến LaTeX thành thẻ <img> thay vì text.
+    Custom Renderer: Biến LaTeX thành thẻ <img> (hoặc MathML) thay vì text.
     """
+    def __init__(self, backend: MathBackend = None, **kwargs):
+        super().__init__(**kwargs)
+        self.backend = backend or math_backends[settings.MATH_BACKEND]
+
     def inline_math(self, text):
-        img_src = latex_to_base64_image(text, fontsize=14)
-        if img_src:
-            return f'<img src="{img_src}" alt="{text}" style="vertical-align: -20%; height: 1.2em;" class="math-inline" />'
+        payload = self.backend.render(text, display=False)
+        if payload:
+            return self.backend.to_html(payload, text, display=False)
         return f'<span class="math-error">\\({text}\\)</span>'
 
     def block_math(self, text):
-        img_src = latex_to_base64_image(text, fontsize=18)
-        if img_src:
-            return f'<div class="math-block" style="text-align: center; margin: 1em 0;"><img src="{img_src}" alt="{text}" /></div>'
+        payload = self.backend.render(text, display=True)
+        if payload:
+            return self.backend.to_html(payload, text, display=True)
         return f'<div class="math-error">$${text}$$</div>'
 
+_FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})")
+_H1_RE = re.compile(r"^ {0,3}#(?:[ \t]|$)")
+_LINK_DEF_RE = re.compile(r"^ {0,3}\[(?!\^)(?:[^\]\\]|\\.)+\]:[ \t]*\S")
+_LINK_TITLE_RE = re.compile(r"^[ \t]+[\"'(]")
+_FOOTNOTE_DEF_RE = re.compile(r"^ {0,3}\[\^[^\]]+\]:")
+_PAGE_BREAK_RE = re.compile(
+    r"^\s*<div[^>]*\b(?:page-)?break-(?:before|after)\s*:\s*(?:always|page)[^>]*>\s*</div>\s*$",
+    re.IGNORECASE
+)
+
+
+def _scan_lines(content: str):
+    """Duyệt từng dòng Markdown, kèm cờ dòng đó có nằm trong code block (``` hoặc ~~~) hay không."""
+    fence = None
+    for line in content.splitlines(keepends=True):
+        if fence is not None:
+            stripped = line.strip()
+            if stripped.startswith(fence) and set(stripped) == {fence[0]}:
+                fence = None
+            yield line, True
+            continue
+        match = _FENCE_RE.match(line)
+        if match:
+            fence = match.group(1)
+        yield line, fence is not None
+
+
+def has_footnote_definitions(content: str) -> bool:
+    """Tài liệu có định nghĩa chú thích ([^1]: ...) ngoài code block."""
+    return any(not in_fence and _FOOTNOTE_DEF_RE.match(line) for line, in_fence in _scan_lines(content))
+
+
+def link_definitions(content: str) -> str:
+    """
+    Các định nghĩa link kiểu tham chiếu ([id]: url "title") ngoài code block, nối thành một khối.
+    Dòng title nằm riêng ở dòng kế tiếp được giữ cùng định nghĩa.
+    """
+    definitions = []
+    previous_is_definition = False
+    for line, in_fence in _scan_lines(content):
+        if in_fence:
+            previous_is_definition = False
+        elif _LINK_DEF_RE.match(line):
+            definitions.append(line.rstrip("\n") + "\n")
+            previous_is_definition = True
+        elif previous_is_definition and _LINK_TITLE_RE.match(line):
+            definitions.append(line.rstrip("\n") + "\n")
+        else:
+            previous_is_definition = False
+    return "".join(definitions)
+
+
+def split_sections(content: str) -> list:
+    """
+    Tách Markdown thành các phần tại tiêu đề cấp 1 (# ...) và tại dòng ngắt trang HTML
+    (<div style="page-break-after: always"></div>). Không tách bên trong code block.
+    Dòng ngắt trang được bỏ đi vì mỗi phần đã bắt đầu ở trang mới khi render riêng.
+
+    Mỗi phần được render riêng nên luôn bắt đầu ở trang mới, kể cả tại các tiêu đề cấp 1
+    vốn không ngắt trang khi render cả tài liệu một lượt.
+    Định nghĩa link tham chiếu của cả tài liệu được chép vào đầu mỗi phần, để link dùng ở phần này
+    nhưng định nghĩa ở phần khác vẫn được giải. Chú thích ([^1]) không tách được theo phần
+    (đánh số và danh sách chú thích thuộc cả tài liệu): xem has_footnote_definitions.
+    """
+    sections = []
+    current = []
+    definitions = link_definitions(content)
+
+    def flush():
+        if "".join(current).strip():
+            sections.append(definitions + "\n" + "".join(current) if definitions else "".join(current))
+        current.clear()
+
+    for line, in_fence in _scan_lines(content):
+        if not in_fence:
+            if _PAGE_BREAK_RE.match(line):
+                flush()
+                continue
+            if _H1_RE.match(line):
+                flush()
+        current.append(line)
+    flush()
+    return sections
+
+
 class MarkdownConverter:
-    def __init__(self):
-        self.markdown = mistune.create_markdown(
-            renderer=MathImageRenderer(),
-            plugins=[
-                'table', 
-                'url', 
-                'task_lists', 
-                'strikethrough', 
-                'footnotes', 
-                'math'
-            ]
-        )
-
-    def convert_to_html(self, content: str) -> str:
+    def __init__(self, default_math_backend: str = settings.MATH_BACKEND, math_render_workers: int = settings.MATH_RENDER_WORKERS):
+        self.default_math_backend = default_math_backend
+        self.math_render_workers = math_render_workers
+        # Mỗi backend một parser mistune, tạo khi dùng lần đầu
+        self._markdowns = {}
+        self._lock = threading.Lock()
+        self._math_pool = None
+
+    def _get_math_pool(self):
+        if self.math_render_workers <= 0:
+            return None
+        with self._lock:
+            if self._math_pool is None:
+                # spawn thay vì fork: an toàn khi process cha đang chạy nhiều thread (uvicorn)
+                self._math_pool = ProcessPoolExecutor(
+                    max_workers=self.math_render_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_render_worker
+                )
+            return self._math_pool
+
+    def close(self):
+        with self._lock:
+            if self._math_pool is not None:
+                self._math_pool.shutdown(cancel_futures=True)
+                self._math_pool = None
+
+    def _prerender_hook(self, backend: MathBackend):
+        """
+        Hook chạy trước khi mistune render: thu thập mọi công thức trong tài liệu,
+        bỏ trùng và render hàng loạt trên process pool.
+        """
+        def hook(md, state):
+            if not backend.parallel or "$" not in state.src:
+                return
+            pool = self._get_math_pool()
+            if pool is None:
+                return
+            formulas = []
+            _collect_math(md, state.tokens, state, formulas)
+            backend.prerender(formulas, pool, self.math_render_workers)
+        return hook
+
+    def _get_markdown(self, math_backend: str):
+        if math_backend not in math_backends:
+            raise ValueError(f"Math backend không hợp lệ: {math_backend}")
+        with self._lock:
+            markdown = self._markdowns.get(math_backend)
+            if markdown is None:
+                markdown = mistune.create_markdown(
+                    renderer=MathImageRenderer(backend=math_backends[math_backend]),
+                    plugins=[
+                        'table',
+                        'url',
+                        'task_lists',
+                        'strikethrough',
+                        'footnotes',
+                        'math'
+                    ]
+                )
+                markdown.before_render_hooks.append(_tighten_list_items)
+                markdown.before_render_hooks.append(self._prerender_hook(math_backends[math_backend]))
+                self._markdowns[math_backend] = markdown
+        return markdown
+
+    def convert_to_html(self, content: str, math_backend: str = None) -> str:
         if not content:
             return ""
-        return self.markdown(content)
+        markdown = self._get_markdown(math_backend or self.default_math_backend)
+        with metrics.stage("markdown_parse"):
+            return markdown(content)
 
-converter_service = MarkdownConverter()
\ No newline at end of file
+converter_service = MarkdownConverter()
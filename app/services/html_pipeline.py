@@ -0,0 +1,412 @@
+"""
+Hậu xử lý HTML trước khi render: một lần quét token duy nhất, các bước (pass) biến đổi
+được cắm vào và cùng nhận từng thẻ khi quét.
+
+Thời gian tuyến tính theo độ dài HTML kể cả với HTML lỗi (thẻ/chuỗi/comment không đóng):
+mỗi lần tìm ký tự kết thúc đều nhớ kết quả (_Scanner.find) nên không ký tự nào bị quét lại,
+và không dùng regex có thể quay lui trên toàn văn bản như clean_html cũ.
+Pass chỉ chạy khi HTML có thẻ mà nó quan tâm (HTMLPass.triggers); không pass nào cần thì trả lại nguyên văn.
+"""
+import html as html_lib
+import re
+from urllib.parse import urlsplit
+
+VOID_TAGS = frozenset({"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"})
+# Nội dung là văn bản thô tới thẻ đóng tương ứng, không chứa thẻ con
+RAW_TEXT_TAGS = frozenset({"script", "style", "textarea", "title"})
+
+_TAG_NAME_RE = re.compile(r"[A-Za-z][^\s/>]*")
+_SPACE_RE = re.compile(r"[\s/]*")
+_ATTR_NAME_RE = re.compile(r"[^\s/>][^\s/>=]*")
+_EQUALS_RE = re.compile(r"\s*=\s*")
+_UNQUOTED_RE = re.compile(r"[^\s>]*")
+_RAW_TEXT_END_RES = {tag: re.compile(rf"</{tag}[\s/>]", re.IGNORECASE) for tag in RAW_TEXT_TAGS}
+# Thẻ mở thông thường khớp trong một lần match. Mọi lượng từ đều có giới hạn nên một lần thử
+# (kể cả thất bại) chỉ tốn thời gian hằng số; thẻ dài hơn (ví dụ ảnh data: URI) đi đường chậm
+_FAST_START_TAG_RE = re.compile(
+    r"""<([A-Za-z][^\s/>]{0,63})((?:\s+[^\s/>="']{1,64}(?:\s*=\s*(?:"[^"]{0,1024}"|'[^']{0,1024}'|[^\s"'>]{1,1024}))?){0,32})\s*/?>"""
+)
+
+
+class Token:
+    """
+    Một thẻ mở/đóng. text là đoạn HTML gốc; pass sửa thuộc tính bằng set()/remove()
+    thì thẻ được ghi lại từ attrs, còn không thì giữ nguyên văn bản gốc.
+    Thuộc tính chỉ được phân tích khi có pass đọc tới (attrs), phần lớn thẻ không cần.
+    """
+    __slots__ = ("kind", "tag", "text", "self_closing", "index", "changed", "_attrs")
+
+    def __init__(self, kind: str, tag: str, text: str, self_closing: bool = False):
+        self.kind = kind
+        self.tag = tag
+        self.text = text
+        self.self_closing = self_closing
+        self.index = None
+        self.changed = False
+        self._attrs = None
+
+    @property
+    def attrs(self) -> list:
+        if self._attrs is None:
+            self._attrs = _parse_attrs(self.text, len(self.tag) + 1) if self.kind == "start" else []
+        return self._attrs
+
+    def get(self, name: str):
+        for key, value in self.attrs:
+            if key == name:
+                return value
+        return None
+
+    def set(self, name: str, value: str):
+        for attr in self.attrs:
+            if attr[0] == name:
+                attr[1] = value
+                break
+        else:
+            self.attrs.append([name, value])
+        self.changed = True
+
+    def remove(self, name: str):
+        attrs = [attr for attr in self.attrs if attr[0] != name]
+        if len(attrs) != len(self.attrs):
+            self._attrs = attrs
+            self.changed = True
+
+    def serialize(self) -> str:
+        if not self.changed:
+            return self.text
+        if self.kind == "end":
+            return f"</{self.tag}>"
+        parts = [self.tag]
+        for name, value in self.attrs:
+            parts.append(name if value is None else f'{name}="{html_lib.escape(value, quote=True)}"')
+        return "<" + " ".join(parts) + (" />" if self.self_closing else ">")
+
+
+class _Scanner:
+    def __init__(self, text: str):
+        self.text = text
+        self._next = {}
+
+    def find(self, needle: str, pos: int) -> int:
+        # Vị trí tìm luôn tăng dần: kết quả cũ còn nằm sau pos (hoặc -1) thì dùng lại, không quét lại
+        cached = self._next.get(needle)
+        if cached is None or (cached != -1 and cached < pos):
+            cached = self.text.find(needle, pos)
+            self._next[needle] = cached
+        return cached
+
+
+def tokenize(text: str):
+    """
+    Sinh ra các cặp (kind, value): ('text', str), ('other', str) cho comment/doctype,
+    ('start'|'end', Token). Phần HTML lỗi không phân tích được được trả về nguyên văn dạng 'text'.
+    """
+    scanner = _Scanner(text)
+    fast_match = _FAST_START_TAG_RE.match
+    n = len(text)
+    pos = 0
+    while pos < n:
+        # '<' tìm được luôn trở thành pos mới nên find thường không quét lại
+        lt = text.find("<", pos)
+        if lt == -1:
+            yield "text", text[pos:]
+            return
+        if lt > pos:
+            yield "text", text[pos:lt]
+        nxt = text[lt + 1:lt + 2]
+
+        if nxt.isalpha():
+            match = fast_match(text, lt)
+            if match is not None:
+                raw = match.group()
+                token = Token("start", match.group(1).lower(), raw, self_closing=raw.endswith("/>"))
+                end = match.end()
+            else:
+                end = _start_tag_end(text, lt, scanner)
+                if end == -1:
+                    yield "text", text[lt:]
+                    return
+                raw = text[lt:end]
+                token = Token("start", _TAG_NAME_RE.match(text, lt + 1).group().lower(), raw, self_closing=raw.endswith("/>"))
+            yield "start", token
+            pos = end
+            if token.tag in RAW_TEXT_TAGS and not token.self_closing:
+                match = _RAW_TEXT_END_RES[token.tag].search(text, pos)
+                end = n if match is None else match.start()
+                if end > pos:
+                    yield "text", text[pos:end]
+                pos = end
+        elif nxt == "/" and text[lt + 2:lt + 3].isalpha():
+            end = scanner.find(">", lt)
+            if end == -1:
+                yield "text", text[lt:]
+                return
+            name = _TAG_NAME_RE.match(text, lt + 2).group().lower()
+            yield "end", Token("end", name, text[lt:end + 1])
+            pos = end + 1
+        elif text.startswith("<!--", lt):
+            end = scanner.find("-->", lt + 4)
+            end = n if end == -1 else end + 3
+            yield "other", text[lt:end]
+            pos = end
+        elif nxt in ("!", "?", "/"):
+            end = scanner.find(">", lt)
+            end = n if end == -1 else end + 1
+            yield "other", text[lt:end]
+            pos = end
+        else:
+            yield "text", "<"
+            pos = lt + 1
+
+
+def _start_tag_end(text: str, lt: int, scanner: _Scanner) -> int:
+    """Vị trí ngay sau '>' của thẻ mở bắt đầu tại lt (bỏ qua '>' trong giá trị có ngoặc), -1 nếu thẻ không đóng."""
+    n = len(text)
+    i = _TAG_NAME_RE.match(text, lt + 1).end()
+    while True:
+        i = _SPACE_RE.match(text, i).end()
+        if i >= n:
+            return -1
+        if text[i] == ">":
+            return i + 1
+        i = _ATTR_NAME_RE.match(text, i).end()
+        equals = _EQUALS_RE.match(text, i)
+        if equals:
+            i = equals.end()
+            if i < n and text[i] in "\"'":
+                end = scanner.find(text[i], i + 1)
+                if end == -1:
+                    return -1
+                i = end + 1
+            else:
+                i = _UNQUOTED_RE.match(text, i).end()
+
+
+def _parse_attrs(raw: str, start: int) -> list:
+    """Danh sách [tên, giá trị] từ văn bản một thẻ mở hoàn chỉnh; giá trị đã giải mã entity, None nếu không có '='."""
+    attrs = []
+    n = len(raw)
+    i = start
+    while True:
+        i = _SPACE_RE.match(raw, i).end()
+        if i >= n or raw[i] == ">":
+            return attrs
+        name = _ATTR_NAME_RE.match(raw, i)
+        i = name.end()
+        value = None
+        equals = _EQUALS_RE.match(raw, i)
+        if equals:
+            i = equals.end()
+            if i < n and raw[i] in "\"'":
+                end = raw.find(raw[i], i + 1)
+                value = raw[i + 1:end]
+                i = end + 1
+            else:
+                unquoted = _UNQUOTED_RE.match(raw, i)
+                value = unquoted.group()
+                i = unquoted.end()
+            value = html_lib.unescape(value)
+        attrs.append([name.group().lower(), value])
+
+
+class HTMLPass:
+    """
+    Một bước biến đổi. Mỗi lần chạy pipeline tạo instance mới nên pass được giữ trạng thái riêng.
+    triggers: các thẻ mà pass quan tâm; HTML không có thẻ nào trong số đó thì pipeline bỏ qua hẳn.
+    """
+    triggers = ()
+
+    def start_tag(self, token: Token, run: "PipelineRun"):
+        """Thẻ mở, gọi trước khi thẻ được đưa vào run.stack (run.stack[-1] là thẻ cha)."""
+
+    def element_closed(self, tag: str, depth: int, end_token: Token, run: "PipelineRun"):
+        """Phần tử ở độ sâu depth đóng lại; end_token là None nếu đóng ngầm (thiếu thẻ đóng)."""
+
+    def text(self, value: str, run: "PipelineRun"):
+        """Đoạn văn bản giữa hai thẻ; run.stack[-1] là phần tử chứa nó."""
+
+
+class PipelineRun:
+    """
+    Trạng thái của một lần chạy: đầu ra đã sinh và các phần tử đang mở.
+    _depths giữ độ sâu các phần tử đang mở theo tên thẻ, nên tìm phần tử cần đóng là O(1)
+    thay vì quét ngược cả stack (HTML lồng sâu với thẻ đóng lạc sẽ thành bậc hai).
+    """
+    def __init__(self, passes: list):
+        self.passes = passes
+        self.out = []
+        self.stack = []
+        self._depths = {}
+        # Chỉ gọi hook text cho pass có dùng tới, phần lớn token là văn bản
+        self._text_passes = [html_pass for html_pass in passes if type(html_pass).text is not HTMLPass.text]
+
+    def drop(self, index: int):
+        """Bỏ token đã sinh ở vị trí index khỏi đầu ra (ví dụ gỡ cặp <p></p>)."""
+        self.out[index] = ""
+
+    def _innermost(self, tag: str) -> int:
+        depths = self._depths.get(tag)
+        return depths[-1] if depths else -1
+
+    def _close(self, depth: int, end_token: Token = None):
+        # Đóng mọi phần tử từ trong ra ngoài tới độ sâu depth; chỉ phần tử ngoài cùng có thẻ đóng thật
+        while len(self.stack) > depth:
+            tag = self.stack[-1]
+            closing = end_token if len(self.stack) == depth + 1 else None
+            for html_pass in self.passes:
+                html_pass.element_closed(tag, len(self.stack) - 1, closing, self)
+            self.stack.pop()
+            self._depths[tag].pop()
+
+    def start_tag(self, token: Token):
+        if token.tag == "li":
+            # <li> mới đóng ngầm <li> trước đó trong cùng danh sách
+            depth = self._innermost("li")
+            if depth > max(self._innermost("ul"), self._innermost("ol")):
+                self._close(depth)
+        for html_pass in self.passes:
+            html_pass.start_tag(token, self)
+        if token.tag not in VOID_TAGS and not token.self_closing:
+            self._depths.setdefault(token.tag, []).append(len(self.stack))
+            self.stack.append(token.tag)
+
+    def end_tag(self, token: Token):
+        depth = self._innermost(token.tag)
+        # Thẻ đóng không khớp phần tử nào đang mở: giữ nguyên trong đầu ra, bỏ qua khi theo dõi cây
+        if depth >= 0:
+            self._close(depth, token)
+
+    def text(self, value: str):
+        for html_pass in self._text_passes:
+            html_pass.text(value, self)
+
+
+class HTMLPipeline:
+    def __init__(self, passes: list):
+        """passes: các lớp (hoặc hàm tạo) HTMLPass, theo thứ tự chạy trên mỗi thẻ."""
+        self.passes = list(passes)
+        triggers = {tag for html_pass in (factory() for factory in self.passes) for tag in html_pass.triggers}
+        self._trigger_re = re.compile(r"<(?:%s)[\s/>]" % "|".join(sorted(triggers)), re.IGNORECASE) if triggers else None
+
+    def run(self, text: str) -> str:
+        if not text or self._trigger_re is None or self._trigger_re.search(text) is None:
+            return text
+        run = PipelineRun([factory() for factory in self.passes])
+        out = run.out
+        for kind, value in tokenize(text):
+            if kind == "start":
+                value.index = len(out)
+                run.start_tag(value)
+                out.append(value.serialize())
+            elif kind == "end":
+                value.index = len(out)
+                out.append(value.text)
+                run.end_tag(value)
+            else:
+                if kind == "text" and run._text_passes:
+                    run.text(value)
+                out.append(value)
+        run._close(0)
+        return "".join(out)
+
+
+class UnwrapListParagraphs(HTMLPass):
+    """
+    <li><p>nội dung</p>...</li> -> <li>nội dung...</li> khi <li> có đúng một <p> con trực tiếp
+    (không thuộc tính) đóng đầy đủ, kể cả khi sau nó là danh sách lồng nhau. Mục có nhiều đoạn giữ nguyên,
+    mục có văn bản hoặc phần tử khác (ngoài <ul>/<ol>) nằm cạnh <p> cũng giữ nguyên để không dính chữ.
+    """
+    triggers = ("li",)
+    LIST_TAGS = ("ul", "ol")
+
+    def __init__(self):
+        # Độ sâu của <li> đang mở -> [số <p> con, vị trí thẻ mở <p>, vị trí thẻ đóng </p>, có nội dung khác]
+        self.items = {}
+
+    def start_tag(self, token, run):
+        depth = len(run.stack)
+        if token.tag == "li":
+            self.items[depth] = [0, None, None, False]
+        elif depth and run.stack[-1] == "li":
+            item = self.items.get(depth - 1)
+            if item is None:
+                return
+            if token.tag == "p":
+                item[0] += 1
+                # Chỉ gỡ <p> không thuộc tính
+                item[1] = token.index if token.text in ("<p>", "<P>") else None
+            elif token.tag not in self.LIST_TAGS:
+                item[3] = True
+
+    def text(self, value, run):
+        if run.stack and run.stack[-1] == "li" and not value.isspace():
+            item = self.items.get(len(run.stack) - 1)
+            if item is not None:
+                item[3] = True
+
+    def element_closed(self, tag, depth, end_token, run):
+        if tag == "p" and depth and run.stack[depth - 1] == "li":
+            item = self.items.get(depth - 1)
+            if item is not None and end_token is not None:
+                item[2] = end_token.index
+        elif tag == "li":
+            item = self.items.pop(depth, None)
+            if (item is not None and end_token is not None and item[0] == 1 and not item[3]
+                    and item[1] is not None and item[2] is not None):
+                run.drop(item[1])
+                run.drop(item[2])
+
+
+class NormalizeImages(HTMLPass):
+    """
+    Chuẩn hóa <img> cho WeasyPrint: bỏ khoảng trắng thừa và mã hóa dấu cách trong src,
+    width/height dạng "300px" -> "300" (presentational hints chỉ hiểu số),
+    bỏ srcset/sizes/loading/decoding mà WeasyPrint không dùng.
+    """
+    triggers = ("img",)
+    UNUSED_ATTRIBUTES = ("srcset", "sizes", "loading", "decoding")
+
+    def start_tag(self, token, run):
+        if token.tag != "img":
+            return
+        src = token.get("src")
+        if src is not None and not src.startswith("data:"):
+            normalized = src.strip().replace(" ", "%20")
+            if normalized != src:
+                token.set("src", normalized)
+        for name in ("width", "height"):
+            value = token.get(name)
+            if value is not None:
+                value = value.strip().lower()
+                if value.endswith("px") and value[:-2].strip().isdigit():
+                    token.set(name, value[:-2].strip())
+        for name in self.UNUSED_ATTRIBUTES:
+            token.remove(name)
+
+
+def is_relative_url(url: str) -> bool:
+    """Đường dẫn tương đối thuần (không scheme, không host, không bắt đầu bằng / hoặc #)."""
+    parts = urlsplit(url)
+    return not parts.scheme and not parts.netloc and bool(parts.path) and not url.startswith(("/", "#"))
+
+
+class RewriteRelativeURLs(HTMLPass):
+    """
+    Thay URL tương đối trong các thuộc tính attributes ({thẻ: (thuộc tính, ...)}) bằng resolve(url);
+    resolve trả về None thì giữ nguyên. Dùng với functools.partial để truyền resolve/attributes.
+    """
+    DEFAULT_ATTRIBUTES = {"img": ("src",), "source": ("src",), "a": ("href",), "link": ("href",)}
+
+    def __init__(self, resolve, attributes: dict = None):
+        self.resolve = resolve
+        self.attributes = attributes or self.DEFAULT_ATTRIBUTES
+        self.triggers = tuple(self.attributes)
+
+    def start_tag(self, token, run):
+        for name in self.attributes.get(token.tag, ()):
+            url = token.get(name)
+            if url and is_relative_url(url):
+                resolved = self.resolve(url)
+                if resolved is not None and resolved != url:
+                    token.set(name, resolved)
@@ -0,0 +1,308 @@
+import contextvars
+import email.utils
+import json
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from app.core import metrics
+from app.core.config import settings
+from app.services.cache import DiskCache, make_cache_key
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+
+class ResourceTooLarge(Exception):
+    pass
+
+
+_CSS_URL_RE = re.compile(r"""url\(\s*['"]?([^'")\s]+)['"]?\s*\)|@import\s+['"]([^'"]+)['"]""", re.IGNORECASE)
+
+
+def _css_urls(css: str, base_url: str = None):
+    for match in _CSS_URL_RE.finditer(css):
+        url = match.group(1) or match.group(2)
+        yield urljoin(base_url, url) if base_url else url
+
+
+class _ResourceCollector(HTMLParser):
+    """Thu thập URL của ảnh, stylesheet và url(...) trong <style>/style="" sau một lần duyệt HTML."""
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.urls = []
+        self._in_style = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "img" and attrs.get("src"):
+            self.urls.append(attrs["src"])
+        elif tag == "link" and attrs.get("href") and "stylesheet" in (attrs.get("rel") or "").lower():
+            self.urls.append(attrs["href"])
+        elif tag == "style":
+            self._in_style = True
+        if attrs.get("style"):
+            self.urls.extend(_css_urls(attrs["style"]))
+
+    def handle_endtag(self, tag):
+        if tag == "style":
+            self._in_style = False
+
+    def handle_data(self, data):
+        if self._in_style:
+            self.urls.extend(_css_urls(data))
+
+
+def collect_remote_urls(html_content: str) -> list:
+    """Danh sách URL http(s) (không trùng, giữ thứ tự) mà HTML tham chiếu tới."""
+    collector = _ResourceCollector()
+    collector.feed(html_content)
+    collector.close()
+    return list(dict.fromkeys(url for url in collector.urls if url.startswith(("http://", "https://"))))
+
+
+def _parse_cache_control(value: str) -> dict:
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, arg = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = arg.strip('"')
+    return directives
+
+
+def _parse_http_date(value: str):
+    if not value:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _freshness_lifetime(headers, now: float) -> float:
+    """
+    Thời gian (giây) phản hồi còn "tươi" theo RFC 9111: max-age, rồi Expires,
+    rồi heuristic 10% khoảng thời gian kể từ Last-Modified.
+    """
+    directives = _parse_cache_control(headers.get("Cache-Control"))
+    if "no-cache" in directives:
+        return 0
+    if "max-age" in directives:
+        try:
+            return max(0, int(directives["max-age"]))
+        except ValueError:
+            return 0
+    expires = _parse_http_date(headers.get("Expires"))
+    if expires is not None:
+        date = _parse_http_date(headers.get("Date")) or now
+        return max(0, expires - date)
+    last_modified = _parse_http_date(headers.get("Last-Modified"))
+    if last_modified is not None:
+        return max(0, (now - last_modified) * 0.1)
+    return 0
+
+
+class CachedHTTPFetcher:
+    """
+    Tải tài nguyên từ xa (ảnh, CSS, font) cho WeasyPrint:
+    - Một requests.Session dùng chung để tái sử dụng kết nối TCP/TLS.
+    - Cache trên đĩa theo chuẩn HTTP (ETag/Last-Modified/Cache-Control), giới hạn dung lượng, loại bỏ LRU.
+    - Giới hạn số request đồng thời tới cùng một host và kích thước tối đa mỗi tài nguyên.
+    """
+    def __init__(
+        self,
+        cache_dir: str = settings.HTTP_CACHE_DIR,
+        cache_max_bytes: int = settings.HTTP_CACHE_MAX_BYTES,
+        max_bytes: int = settings.HTTP_FETCH_MAX_BYTES,
+        per_host: int = settings.HTTP_FETCH_PER_HOST,
+        timeout: float = settings.HTTP_FETCH_TIMEOUT
+    ):
+        self.max_bytes = max_bytes
+        self.per_host = per_host
+        self.timeout = timeout
+        self.cache = DiskCache(cache_dir, cache_max_bytes) if cache_dir else None
+
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = USER_AGENT
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=max(per_host, 10))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _slot(self, url: str) -> threading.BoundedSemaphore:
+        host = urlsplit(url).netloc
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return slot
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _load(self, key: str):
+        if self.cache is None:
+            return None
+        blob = self.cache.get(key)
+        if blob is None:
+            return None
+        meta, _, body = blob.partition(b"\n")
+        try:
+            return json.loads(meta), body
+        except ValueError:
+            return None
+
+    def _store(self, key: str, meta: dict, body: bytes):
+        if self.cache is None:
+            return
+        if "no-store" in _parse_cache_control(meta["headers"].get("Cache-Control")):
+            return
+        # Metadata JSON không chứa ký tự xuống dòng nên dùng '\n' làm dấu phân cách với body
+        self.cache.set(key, json.dumps(meta).encode("utf-8") + b"\n" + body)
+
+    def _read_body(self, response) -> bytes:
+        length = response.headers.get("Content-Length")
+        if length and length.isdigit() and int(length) > self.max_bytes:
+            raise ResourceTooLarge(f"{response.url}: {length} bytes > {self.max_bytes}")
+        chunks = []
+        total = 0
+        for chunk in response.iter_content(64 * 1024):
+            total += len(chunk)
+            if total > self.max_bytes:
+                raise ResourceTooLarge(f"{response.url}: > {self.max_bytes} bytes")
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    @staticmethod
+    def _result(meta: dict, body: bytes) -> dict:
+        # Định dạng kết quả mà url_fetcher của WeasyPrint yêu cầu
+        return {
+            'string': body,
+            'mime_type': meta["headers"].get("Content-Type"),
+            'encoding': meta.get("encoding"),
+            'redirected_url': meta["url"],
+        }
+
+    def fetch(self, url: str) -> dict:
+        key = make_cache_key("http", url)
+        now = time.time()
+        cached = self._load(key)
+        request_headers = {}
+
+        if cached is not None:
+            meta, body = cached
+            if now < meta["stored_at"] + meta["fresh_for"]:
+                self._count("hits")
+                return self._result(meta, body)
+            if meta["headers"].get("ETag"):
+                request_headers["If-None-Match"] = meta["headers"]["ETag"]
+            if meta["headers"].get("Last-Modified"):
+                request_headers["If-Modified-Since"] = meta["headers"]["Last-Modified"]
+
+        try:
+            with self._slot(url), metrics.stage("url_fetch"):
+                with self.session.get(url, headers=request_headers, timeout=self.timeout, stream=True) as response:
+                    if response.status_code == 304 and cached is not None:
+                        meta, body = cached
+                        # Giữ header cũ, cập nhật các header cache mà server gửi lại
+                        for name in ("Cache-Control", "Expires", "Date", "ETag", "Last-Modified"):
+                            if name in response.headers:
+                                meta["headers"][name] = response.headers[name]
+                        meta["stored_at"] = now
+                        meta["fresh_for"] = _freshness_lifetime(meta["headers"], now)
+                        self._store(key, meta, body)
+                        self._count("revalidated")
+                        return self._result(meta, body)
+
+                    response.raise_for_status()
+                    body = self._read_body(response)
+                    meta = {
+                        "url": response.url,
+                        "encoding": response.encoding,
+                        "headers": {
+                            name: response.headers[name]
+                            for name in ("Content-Type", "Cache-Control", "Expires", "Date", "ETag", "Last-Modified")
+                            if name in response.headers
+                        },
+                        "stored_at": now,
+                        "fresh_for": _freshness_lifetime(response.headers, now),
+                    }
+        except Exception:
+            self._count("errors")
+            raise
+
+        self._store(key, meta, body)
+        self._count("misses")
+        return self._result(meta, body)
+
+    def prefetch(self, urls, deadline: float = settings.PREFETCH_DEADLINE, workers: int = settings.PREFETCH_WORKERS) -> dict:
+        """
+        Tải đồng thời các URL trong tổng thời gian deadline (giây). Stylesheet tải về được quét
+        thêm một vòng để lấy font/ảnh mà nó tham chiếu. Trả về {url: kết quả fetch()} cho các URL
+        tải thành công kịp hạn; URL lỗi hoặc quá hạn không có trong kết quả.
+        """
+        results = {}
+        if not urls:
+            return results
+
+        end = time.monotonic() + deadline
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        # Thread của pool không kế thừa context: chạy fetch trong bản sao context hiện tại để metrics giữ nhãn request
+        context = contextvars.copy_context()
+
+        def fetch(url):
+            return context.copy().run(self.fetch, url)
+
+        try:
+            pending = {pool.submit(fetch, url): url for url in urls}
+            while pending:
+                done, _ = wait(pending, timeout=max(0, end - time.monotonic()))
+                if not done:
+                    logger.warning(f"Prefetch deadline reached, {len(pending)} resources left to the layout stage")
+                    break
+                for future in done:
+                    url = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Failed to prefetch {url}: {e}")
+                        continue
+                    results[url] = result
+                    if "css" in (result["mime_type"] or ""):
+                        css = result["string"].decode(result["encoding"] or "utf-8", errors="replace")
+                        for child in _css_urls(css, result["redirected_url"] or url):
+                            if child.startswith(("http://", "https://")) and child not in results \
+                                    and child not in pending.values():
+                                pending[pool.submit(fetch, child)] = child
+        finally:
+            # Không chờ các request còn dở; chúng vẫn ghi vào cache đĩa khi xong
+            pool.shutdown(wait=False, cancel_futures=True)
+        return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {
+                "hits": self.hits,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "errors": self.errors,
+            }
+        if self.cache is not None:
+            result["disk"] = self.cache.stats()
+        return result
+
+
+http_fetcher = CachedHTTPFetcher()
@@ -0,0 +1,226 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models import ConversionJob
+from app.services import profiling
+from app.services.blob_store import blob_store
+from app.services.render_executor import RenderQueueFull
+from app.services.storage import storage_service
+
+logger = logging.getLogger(__name__)
+
+JOB_RESULT_PREFIX = "jobs/"
+
+
+def job_result_path(job_id: str) -> str:
+    """Object kết quả riêng của job (job 'export'); job tài liệu trỏ tới PDF của version."""
+    return f"{JOB_RESULT_PREFIX}{job_id}.pdf"
+
+
+def remove_job_results(paths):
+    """
+    Xóa các object kết quả riêng của job (gọi sau khi commit xóa dòng job).
+    Đường dẫn ngoài JOB_RESULT_PREFIX (PDF của version) do version quản lý nên được bỏ qua.
+    """
+    for path in paths:
+        if not path or not path.startswith(JOB_RESULT_PREFIX):
+            continue
+        try:
+            storage_service.remove_object(path)
+        except Exception as e:
+            logger.error(f"Failed to remove job result {path}: {e}")
+
+
+class JobRunner:
+    """
+    Hàng đợi job chuyển đổi lưu trong bảng conversion_jobs.
+
+    - submit() chỉ ghi một dòng 'pending' và trả về ngay.
+    - Worker nhận job bằng SELECT ... FOR UPDATE SKIP LOCKED nên nhiều worker
+      (thread trong API hoặc process `python -m app.worker`) chạy song song an toàn.
+    - Việc xử lý từng loại job do handler đăng ký qua register(kind, handler) đảm nhiệm.
+      handler(db, job) trả về đường dẫn file kết quả trên MinIO.
+    - run_once() xử lý đồng bộ một job, tiện cho test và debug.
+    - Job đã kết thúc quá JOB_RESULT_TTL_SECONDS bị xóa cùng file kết quả (cleanup), worker tự dọn
+      mỗi JOB_CLEANUP_INTERVAL giây khi rảnh, cùng lúc dọn blob upload dở (BlobStore.sweep_pending).
+    """
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        poll_interval: float = settings.JOB_POLL_INTERVAL,
+        cleanup_interval: float = settings.JOB_CLEANUP_INTERVAL
+    ):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.cleanup_interval = cleanup_interval
+        self._next_cleanup = 0.0
+        self._cleanup_lock = threading.Lock()
+        self.handlers = {}
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def register(self, kind: str, handler):
+        self.handlers[kind] = handler
+
+    def submit(self, db: Session, kind: str, **fields) -> ConversionJob:
+        # Ghi lại request đang gửi job để worker profile job như chính request đó (X-Profile, lấy mẫu)
+        request = profiling.current_request()
+        if request is not None:
+            fields.setdefault("profile_request_id", request["request_id"])
+            fields.setdefault("profile_explicit", request["explicit"])
+        job = ConversionJob(kind=kind, status="pending", **fields)
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        # Đánh thức worker cục bộ thay vì đợi tới lần poll kế tiếp
+        self._wakeup.set()
+        return job
+
+    def claim(self, db: Session):
+        """Nhận một job đang chờ (hoặc job 'running' đã quá hạn do worker chết)."""
+        lease_cutoff = datetime.utcnow() - timedelta(seconds=settings.JOB_LEASE_SECONDS)
+        job = (
+            db.query(ConversionJob)
+            .filter(or_(
+                ConversionJob.status == "pending",
+                and_(ConversionJob.status == "running", ConversionJob.started_at < lease_cutoff)
+            ))
+            .order_by(ConversionJob.created_at)
+            .with_for_update(skip_locked=True)
+            .first()
+        )
+        if job is None:
+            return None
+
+        job.attempts = (job.attempts or 0) + 1
+        if job.attempts > settings.JOB_MAX_ATTEMPTS:
+            job.status = "failed"
+            job.error = "Vượt quá số lần thử tối đa."
+            job.finished_at = datetime.utcnow()
+            db.commit()
+            return None
+
+        job.status = "running"
+        job.started_at = datetime.utcnow()
+        db.commit()
+        return job
+
+    def run_once(self) -> bool:
+        """Xử lý tối đa một job. Trả về True nếu đã nhận được job."""
+        # expire_on_commit=False: handler đọc job đã nhận mà không mở lại transaction,
+        # nên kết nối DB không bị giữ trong lúc render
+        db = self.session_factory(expire_on_commit=False)
+        try:
+            job = self.claim(db)
+            if job is None:
+                return False
+            self._execute(db, job)
+            return True
+        finally:
+            db.close()
+
+    def _execute(self, db: Session, job: ConversionJob):
+        handler = self.handlers.get(job.kind)
+        try:
+            if handler is None:
+                raise ValueError(f"Không có handler cho loại job: {job.kind}")
+            # Profile lưu theo request ID của request gửi job; job không gắn request nào thì theo 'job-<id>'
+            with profiling.request_context(job.profile_request_id or f"job-{job.id}", explicit=bool(job.profile_explicit)):
+                result_path = handler(db, job)
+        except RenderQueueFull as e:
+            # Executor đang quá tải: trả job về hàng đợi, không tính là một lần thử
+            db.rollback()
+            job.status = "pending"
+            job.attempts -= 1
+            db.commit()
+            time.sleep(e.retry_after)
+            return
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+            db.rollback()
+            job.status = "failed"
+            job.error = str(e)
+            job.finished_at = datetime.utcnow()
+            db.commit()
+            return
+
+        job.status = "succeeded"
+        job.result_path = result_path
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        logger.info(f"Job {job.id} ({job.kind}) succeeded")
+
+    def cleanup(self, db: Session, ttl_seconds: int = settings.JOB_RESULT_TTL_SECONDS, limit: int = 500) -> int:
+        """
+        Xóa tối đa limit job đã kết thúc (succeeded/failed) trước ttl_seconds, cùng file kết quả jobs/{id}.pdf.
+        Sau đó GET /jobs/{id} trả về 404. Trả về số job đã xóa.
+        """
+        if ttl_seconds <= 0:
+            return 0
+        cutoff = datetime.utcnow() - timedelta(seconds=ttl_seconds)
+        jobs = (
+            db.query(ConversionJob)
+            .filter(ConversionJob.status.in_(("succeeded", "failed")), ConversionJob.finished_at < cutoff)
+            .order_by(ConversionJob.finished_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        paths = [job.result_path for job in jobs]
+        for job in jobs:
+            db.delete(job)
+        db.commit()
+        # Chỉ xóa object sau khi commit: rollback thì job vẫn còn và vẫn tải được kết quả
+        remove_job_results(paths)
+        if jobs:
+            logger.info(f"Removed {len(jobs)} expired jobs")
+        return len(jobs)
+
+    def _maybe_cleanup(self):
+        with self._cleanup_lock:
+            now = time.monotonic()
+            if now < self._next_cleanup:
+                return
+            self._next_cleanup = now + self.cleanup_interval
+        db = self.session_factory()
+        try:
+            self.cleanup(db)
+            # Blob upload dở do transaction rollback/process chết (xem BlobStore.sweep_pending)
+            blob_store.sweep_pending(db)
+        finally:
+            db.close()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    continue
+                self._maybe_cleanup()
+            except Exception as e:
+                # Lỗi DB tạm thời: chờ rồi thử lại, không để thread worker chết
+                logger.error(f"Job worker error: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def start(self, workers: int = settings.JOB_WORKERS):
+        self._stop.clear()
+        for i in range(workers):
+            thread = threading.Thread(target=self._loop, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+job_runner = JobRunner()
@@ -1,165 +1,351 @@
-from weasyprint import HTML, CSS, default_url_fetcher
-from weasyprint.text.fonts import FontConfiguration
+from weasyprint import HTML, default_url_fetcher
+import bisect
 import logging
-import requests
+import multiprocessing
 import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from html import escape, unescape
+from html.parser import HTMLParser
 from io import BytesIO
 import pypdf
+from app.core import metrics
+from app.core.config import settings
+from app.services.cache import DiskCache, MemoryLRUCache, TieredCache, make_cache_key
+from app.services.html_pipeline import HTMLPipeline, NormalizeImages, UnwrapListParagraphs
+from app.services.http_fetcher import ResourceTooLarge, collect_remote_urls, http_fetcher
+from app.services.templates import page_templates
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+def _build_pdf_cache():
+    """Cache PDF đã render: bộ nhớ (LRU) + tầng phụ trên đĩa hoặc MinIO theo PDF_CACHE_BACKEND."""
+    if not settings.PDF_CACHE_MAX_BYTES:
+        return None
+    secondary = None
+    if settings.PDF_CACHE_BACKEND == "disk" and settings.PDF_CACHE_DIR:
+        secondary = DiskCache(settings.PDF_CACHE_DIR, settings.PDF_CACHE_DISK_MAX_BYTES)
+    elif settings.PDF_CACHE_BACKEND == "minio":
+        # Import tại đây để process không dùng tầng MinIO không phải kết nối tới MinIO
+        from app.services.storage import ObjectStorageCache
+        secondary = ObjectStorageCache("cache/pdf")
+    return TieredCache(MemoryLRUCache(settings.PDF_CACHE_MAX_BYTES), secondary)
+
+
+_VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+_DATA_URI_RE = re.compile(r"data:[^\"')\s]+")
+
+
+def layout_size(html_content: str) -> int:
+    """Độ dài HTML không tính ảnh nhúng (data: URI), xấp xỉ khối lượng layout."""
+    return len(_DATA_URI_RE.sub("", html_content))
+
+
+def _has_page_break(style: str, side: str) -> bool:
+    style = style.replace(" ", "").lower()
+    return f"page-break-{side}:always" in style or f"break-{side}:page" in style
+
+
+class _BlockBoundaryScanner(HTMLParser):
+    """
+    Quét HTML một lượt để biết chỗ được phép cắt và trạng thái cần mang sang đoạn sau:
+
+    - breaks: ngắt trang tường minh ở phần tử cấp cao nhất, dạng (start, end). Phần tử có break-before
+      cho (start, start); phần tử rỗng có break-after (<div style="page-break-after: always"></div>) cho
+      (start, end) và bị bỏ khỏi các đoạn, vì đoạn sau đã bắt đầu ở trang mới.
+    - titles: vị trí và nội dung các h1 (mẫu trang đặt string-set: doc-title trên h1).
+    - ids/links: id trong tài liệu và các link nội bộ (href="#..."), ví dụ chú thích #fn-1.
+    """
+    def __init__(self, html_content: str):
+        super().__init__(convert_charrefs=False)
+        self.html_content = html_content
+        self.line_offsets = [0]
+        for line in html_content.splitlines(keepends=True):
+            self.line_offsets.append(self.line_offsets[-1] + len(line))
+        self.depth = 0
+        self.breaks = []
+        self.titles = []
+        self.ids = {}
+        self.links = []
+        self._top = None  # (start, có break-after) của phần tử cấp cao nhất đang mở
+        self._top_has_content = False
+        self._title = None
+
+    def _offset(self) -> int:
+        line, col = self.getpos()
+        return self.line_offsets[line - 1] + col
+
+    def _start(self, tag, attrs):
+        offset = self._offset()
+        values = dict(attrs)
+        style = values.get("style") or ""
+        if self.depth == 0:
+            if _has_page_break(style, "before"):
+                self.breaks.append((offset, offset))
+            self._top = (offset, _has_page_break(style, "after"))
+            self._top_has_content = False
+        elif tag in _VOID_TAGS and tag != "br":
+            # Ảnh, hr... bên trong: phần tử không rỗng, không bỏ được
+            self._top_has_content = True
+        for name in ("id", "name") if tag == "a" else ("id",):
+            if values.get(name):
+                self.ids.setdefault(values[name], offset)
+        href = values.get("href") or ""
+        if href.startswith("#") and len(href) > 1:
+            self.links.append((offset, href[1:]))
+        if tag == "h1":
+            self._title = (offset, [])
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs)
+        if tag not in _VOID_TAGS:
+            self.depth += 1
+        elif self.depth == 0:
+            self._top = None
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs)
+        if self.depth == 0:
+            self._top = None
+
+    def handle_endtag(self, tag):
+        if tag in _VOID_TAGS:
+            return
+        if tag == "h1" and self._title is not None:
+            offset, parts = self._title
+            self.titles.append((offset, unescape("".join(parts)).strip()))
+            self._title = None
+        self.depth = max(0, self.depth - 1)
+        if self.depth == 0 and self._top is not None:
+            start, break_after = self._top
+            if break_after and not self._top_has_content:
+                end = self.html_content.find(">", self._offset())
+                self.breaks.append((start, len(self.html_content) if end < 0 else end + 1))
+            self._top = None
+
+    def handle_data(self, data):
+        if self._title is not None:
+            self._title[1].append(data)
+        if data.strip():
+            self._top_has_content = True
+
+    def handle_entityref(self, name):
+        self.handle_data(f"&{name};")
+
+    def handle_charref(self, name):
+        self.handle_data(f"&#{name};")
+
+
+def _chunk_lead(title: str) -> str:
+    """
+    Trang dẫn đặt trước mỗi đoạn (trừ đoạn đầu) và bị bỏ khi ghép: mang giá trị doc-title của đoạn trước
+    sang, nên header string(doc-title) của trang đầu đoạn giống hệt render một lượt; trang đầu của đoạn
+    cũng không còn bị coi là trang đầu tài liệu (@page :first).
+    """
+    string_set = ""
+    if title is not None:
+        value = title.replace("\\", "\\\\").replace("'", "\\'").replace("\n", " ")
+        string_set = f" string-set: doc-title '{value}';"
+    return f'<div style="break-after: page;{escape(string_set)}">&nbsp;</div>'
+
+
+def split_html(html_content: str, parts: int) -> list:
+    """
+    Cắt HTML thành tối đa parts đoạn dài xấp xỉ nhau, chỉ tại các ngắt trang tường minh ở phần tử cấp cao nhất,
+    nơi render một lượt cũng sang trang mới, nên ghép các đoạn lại cho đúng bố cục của render một lượt.
+    Mọi đoạn trừ đoạn đầu mở đầu bằng một trang dẫn (_chunk_lead) mà PDFGenerator.merge_chunks bỏ đi.
+
+    Không cắt (trả về [html_content]) khi: không có ngắt trang, HTML có <style>/<link> riêng (stylesheet chỉ
+    áp dụng cho đoạn chứa nó), hoặc có link nội bộ (#fn-1, #muc-2...) trỏ sang đoạn khác.
+    """
+    if parts < 2 or re.search(r"<(style|link)\b", html_content, re.IGNORECASE):
+        return [html_content]
+
+    scanner = _BlockBoundaryScanner(html_content)
+    scanner.feed(html_content)
+    scanner.close()
+
+    candidates = [(start, end) for start, end in scanner.breaks if start > 0 and end < len(html_content)]
+    if not candidates:
+        return [html_content]
+
+    chunk_size = len(html_content) / parts
+    cuts = []
+    for i in range(1, parts):
+        target = i * chunk_size
+        cut = min(candidates, key=lambda candidate: abs(candidate[0] - target))
+        if not cuts or cut[0] > cuts[-1][1]:
+            cuts.append(cut)
+
+    edges = [(0, 0)] + cuts + [(len(html_content), len(html_content))]
+    spans = [(previous[1], cut[0]) for previous, cut in zip(edges, edges[1:])]
+    spans = [(start, end) for start, end in spans if html_content[start:end].strip()]
+    if len(spans) < 2:
+        return [html_content]
+
+    ends = [end for _, end in spans]
+
+    def chunk_index(offset):
+        return min(bisect.bisect_right(ends, offset), len(spans) - 1)
+
+    for offset, target in scanner.links:
+        if target in scanner.ids and chunk_index(offset) != chunk_index(scanner.ids[target]):
+            return [html_content]
+
+    chunks = []
+    for index, (start, end) in enumerate(spans):
+        if index == 0:
+            chunks.append(html_content[start:end])
+            continue
+        title = None
+        for offset, text in scanner.titles:
+            if offset < start:
+                title = text
+        chunks.append(_chunk_lead(title) + html_content[start:end])
+    return chunks
+
+
+def _init_chunk_worker():
+    # Nạp font/CSS sẵn khi process con khởi động
+    try:
+        from app.services.pdf_generator import pdf_service
+        pdf_service.warm_up()
+    except Exception as e:
+        logger.error(f"Chunk render worker warm-up failed: {e}")
+
+
+def _render_chunk_job(html_content: str, template: str = None) -> bytes:
+    # Đoạn cắt ra từ HTML đã hậu xử lý, không chạy lại pipeline
+    return pdf_service.render(
+        html_content, show_page_number=False, allow_parallel=False, record_output=False, postprocess=False, template=template
+    )[0]
+
+
 class PDFGenerator:
-    def __init__(self):
-        self.font_config = FontConfiguration()
-
-        common_css_rules = """
-            /* NUCLEAR RESET - ÉP PHÔNG CHỮ SERIF CHO TOÀN BỘ VĂN BẢN */
-            /* Dùng dấu * để chọn tất cả mọi thành phần */
-            * {
-                /* Thứ tự ưu tiên: 
-                   1. Times New Roman (Windows/Mac chuẩn)
-                   2. Liberation Serif (Linux chuẩn - giống hệt Times)
-                   3. Nimbus Roman No9 L (Linux dự phòng)
-                   4. DejaVu Serif (Linux dự phòng)
-                   5. serif (Font có chân bất kỳ - Chặn tuyệt đối việc nhảy về Sans-serif) 
-                */
-                font-family: 'Times New Roman', 'Liberation Serif', 'Nimbus Roman No9 L', 'DejaVu Serif', serif !important;
-            }
-
-            /* Cấu hình body cụ thể */
-            body {
-                font-size: 13pt;
-                line-height: 1.4;
-                color: #000;
-                text-align: justify;
-            }
-
-            /* XỬ LÝ IN ĐẬM VÀ TIÊU ĐỀ */
-            strong, b {
-                font-weight: bold !important;
-                /* Font-family đã được xử lý bởi dấu * ở trên nên sẽ đồng bộ */
-            }
-
-            h1, h2, h3, h4, h5, h6 {
-                font-weight: bold !important;
-                font-style: normal !important; /* Không in nghiêng */
-                margin-top: 20px;
-                margin-bottom: 10px;
-                page-break-after: avoid;
-            }
-
-            h1 { font-size: 24pt; text-transform: uppercase; text-align: center; margin-bottom: 30px; }
-            h2 { font-size: 16pt; margin-top: 30px; margin-bottom: 15px; }
-            h3 { font-size: 14pt; }
-
-            /* GIỮ NGUYÊN FIX LỖI CĂN LỀ DẤU * */
-            ul, ol {
-                margin: 10px 0 15px 0;
-                padding-left: 40px;
-            }
-            li {
-                margin-bottom: 8px;
-                list-style-position: outside !important;
-                text-align: justify;
-            }
-            /* Gỡ bỏ margin của thẻ p bên trong li nếu có, nhưng không làm nó inline */
-            li p { margin: 0; padding: 0; }
-            /* Đảm bảo hình ảnh trong list vẫn là block để có thể căn lề */
-            li img { display: block; }
-
-            /* BLOCKQUOTE */
-            blockquote {
-                margin: 15px 0 15px 20px;
-                padding: 10px 15px;
-                border-left: 4px solid #ddd;
-                background-color: #f9f9f9;
-                color: #555;
-            }
-
-            /* CODE BLOCK & TABLE */
-            pre {
-                font-family: 'Courier New', 'Liberation Mono', monospace !important;
-                font-size: 11pt;
-                background-color: #f5f5f5;
-                padding: 12px;
-                border: 1px solid #ddd;
-                white-space: pre-wrap; 
-                word-wrap: break-word;
-            }
-            
-            /* Inline code */
-            code, span.code {
-                font-family: 'Courier New', 'Liberation Mono', monospace !important;
-                font-size: 0.9em; /* Hơi nhỏ hơn văn bản thường */
-                background-color: #f0f0f0;
-                padding: 2px 4px;
-                border-radius: 3px;
-            }
-
-            table { width: 100%; border-collapse: collapse; margin: 20px 0; }
-            th, td { border: 1px solid #000; padding: 8px; vertical-align: top; }
-            img { max-width: 100%; height: auto; display: block; margin: 15px auto; }
-            
-            .text-danger, .title-danger { color: #FF0000 !important; }
-            .text-center { text-align: center; }
-            .row, .header-container { display: flex; justify-content: space-between; width: 100%; margin-bottom: 25px; }
-        """
-
-        # CSS cho trang có đánh số
-        page_with_number_css = """
-            @page {
-                size: A4;
-                margin: 2cm 2.5cm;
-                @bottom-right {
-                    content: "" counter(page) " / " counter(pages);
-                    font-size: 10pt;
-                    font-family: 'Times New Roman', 'Liberation Serif', 'Nimbus Roman No9 L', 'DejaVu Serif', serif;
-                    color: #555;
-                }
-            }
-        """
-
-        # CSS cho trang không đánh số
-        page_without_number_css = """
-            @page {
-                size: A4;
-                margin: 2cm 2.5cm;
-            }
-        """
-
-        self.default_css = CSS(string=page_with_number_css + common_css_rules, font_config=self.font_config)
-        self.no_page_number_css = CSS(string=page_without_number_css + common_css_rules, font_config=self.font_config)
+    def __init__(self, parallel_workers: int = settings.LARGE_DOC_WORKERS, parallel_min_chars: int = settings.LARGE_DOC_MIN_CHARS):
+        self.parallel_workers = parallel_workers
+        self.parallel_min_chars = parallel_min_chars
+        self._chunk_pool = None
+        self._chunk_pool_lock = threading.Lock()
+        self.postprocessor = HTMLPipeline([UnwrapListParagraphs, NormalizeImages])
+        self.cache = _build_pdf_cache()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "renders": 0,
+            "cache_hits": 0,
+            "prefetch_seconds": 0.0,
+            "layout_seconds": 0.0,
+            "prefetched_resources": 0,
+            "prefetch_misses": 0,
+            "sections_reused": 0,
+            "sections_rendered": 0,
+            "parallel_renders": 0,
+            "parallel_chunks": 0,
+        }
+
+    def warm_up(self):
+        """
+        Biên dịch mọi mẫu trang (FontConfiguration của process + CSS từng biến thể, xem app/services/templates.py).
+        Tốn cỡ vài trăm ms nên chạy ở bước khởi động process render; gọi lại nhiều lần không tốn gì.
+        """
+        for name in page_templates.names():
+            page_templates.compile(name)
 
     @staticmethod
     def custom_url_fetcher(url):
         if url.startswith("http"):
             try:
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                }
-                response = requests.get(url, headers=headers, timeout=10)
-                response.raise_for_status()
-                return {
-                    'string': response.content,
-                    'mime_type': response.headers.get('Content-Type'),
-                    'encoding': response.encoding,
-                    'redirected_url': response.url,
-                }
+                # Session dùng chung + cache HTTP trên đĩa, xem app/services/http_fetcher.py
+                return http_fetcher.fetch(url)
+            except ResourceTooLarge as e:
+                # Không fallback về default_url_fetcher, nếu không file quá lớn vẫn bị tải về
+                logger.error(f"Remote resource too large, skipped: {e}")
+                raise
             except Exception as e:
                 logger.error(f"Failed to fetch image {url}: {e}")
                 return default_url_fetcher(url)
         return default_url_fetcher(url)
 
+    def prefetching_url_fetcher(self, prefetched: dict):
+        """
+        url_fetcher cho một lần render: trả tài nguyên đã tải trước từ bộ nhớ,
+        URL không có trong prefetched (lỗi, quá hạn, hoặc phát sinh lúc layout) thì tải như cũ.
+        """
+        def fetcher(url):
+            result = prefetched.get(url)
+            if result is not None:
+                return dict(result)
+            with self._stats_lock:
+                self._stats["prefetch_misses"] += 1
+            return self.custom_url_fetcher(url)
+        return fetcher
+
     def clean_html(self, html_content: str) -> str:
-        # Gỡ thẻ <p> bên trong <li>: <li<...><p>content</p></li> -> <li<...>>content</li>
-        # Regex này tìm các thẻ li, bắt lấy nội dung bên trong thẻ p và thay thế toàn bộ
-        cleaned_html = re.sub(r'<li([^>]*)>\s*<p>(.*?)</p>\s*</li>', r'<li\1>\2</li>', html_content, flags=re.DOTALL)
+        # Gỡ thẻ <p> duy nhất bên trong <li> (<li ...><p>content</p></li> -> <li ...>content</li>)
+        # và chuẩn hóa thẻ <img>, trong một lần quét (xem app/services/html_pipeline.py)
+        return self.postprocessor.run(html_content)
+
+    def cache_key(self, cleaned_html: str, show_page_number: bool, prefetched: dict, template_version: str) -> str:
+        """
+        Khóa của PDF đã render: HTML đã làm sạch, mẫu trang (theo nội dung CSS) và biến thể stylesheet,
+        digest nội dung từng tài nguyên từ xa (ảnh/CSS/font đổi thì khóa đổi theo).
+        """
+        resources = [
+            make_cache_key(url, prefetched[url]["string"])
+            for url in sorted(prefetched)
+        ]
+        variant = "page-number" if show_page_number else "no-page-number"
+        return make_cache_key("pdf", template_version, variant, cleaned_html, *resources)
+
+    def generate_pdf(self, html_content: str, show_page_number: bool = True, template: str = None) -> bytes:
+        return self.render(html_content, show_page_number=show_page_number, template=template)[0]
+
+    def _get_chunk_pool(self):
+        """
+        Pool riêng chỉ dùng khi PDFGenerator được gọi trực tiếp (benchmark, script).
+        Trong process render (render_pdf_job) các đoạn được trả về RenderExecutor (defer_chunks) và
+        chạy trên pool render chung, không process render nào tự tạo pool con.
+        """
+        with self._chunk_pool_lock:
+            if self._chunk_pool is None:
+                self._chunk_pool = ProcessPoolExecutor(
+                    max_workers=self.parallel_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_chunk_worker
+                )
+            return self._chunk_pool
 
-        return cleaned_html
+    def close(self):
+        with self._chunk_pool_lock:
+            if self._chunk_pool is not None:
+                self._chunk_pool.shutdown(cancel_futures=True)
+                self._chunk_pool = None
 
-    def generate_pdf(self, html_content: str, show_page_number: bool = True) -> bytes:
-        cleaned_html = self.clean_html(html_content)
+    def render(
+        self,
+        html_content: str,
+        show_page_number: bool = True,
+        allow_parallel: bool = True,
+        record_output: bool = True,
+        postprocess: bool = True,
+        template: str = None,
+        defer_chunks: bool = False
+    ):
+        """
+        Render HTML ra PDF, dùng lại kết quả trong cache nếu có.
+        HTML lớn hơn parallel_min_chars được cắt thành nhiều đoạn và layout song song (xem render_parallel).
+        defer_chunks=True (trong process render): không tự layout các đoạn mà trả về ({"chunks", "cache_key"}, 'split')
+        để RenderExecutor chạy chúng trên pool render chung rồi gọi merge_chunks.
+        record_output=False khi HTML chỉ là một phần của tài liệu: không ghi số trang/kích thước vào metrics.
+        postprocess=False khi HTML không cần clean_html, ví dụ HTML sinh từ Markdown (list đã gọn sẵn).
+        template: tên mẫu trang (app/services/templates.py), None = mẫu mặc định.
+        Trả về (pdf_bytes, cache_status) với cache_status là 'hit' hoặc 'miss'.
+        """
+        cleaned_html = self.clean_html(html_content) if postprocess else html_content
+        compiled = page_templates.compile(template)
         full_html_string = f"""
         <!DOCTYPE html>
         <html lang="en">
@@ -174,21 +360,209 @@ class PDFGenerator:
         </html>
         """
 
-        html = HTML(string=full_html_string, base_url=".", url_fetcher=self.custom_url_fetcher)
+        # Tải trước song song mọi tài nguyên từ xa, thay vì để WeasyPrint tải tuần tự trong lúc layout
+        prefetch_start = time.perf_counter()
+        remote_urls = collect_remote_urls(cleaned_html)
+        prefetched = http_fetcher.prefetch(remote_urls)
+        prefetch_seconds = time.perf_counter() - prefetch_start
+        if remote_urls:
+            metrics.STAGE_SECONDS.observe(prefetch_seconds, stage="prefetch")
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache_key(cleaned_html, show_page_number, prefetched, compiled.version)
+            cached = self.cache.get(cache_key)
+            metrics.CACHE_REQUESTS.inc(cache="pdf", result="miss" if cached is None else "hit")
+            if cached is not None:
+                with self._stats_lock:
+                    self._stats["cache_hits"] += 1
+                    self._stats["prefetch_seconds"] += prefetch_seconds
+                logger.info(f"PDF cache hit: prefetch={prefetch_seconds:.3f}s")
+                return cached, "hit"
+
+        if allow_parallel and self.parallel_workers > 1 and layout_size(cleaned_html) >= self.parallel_min_chars:
+            chunks = split_html(cleaned_html, self.parallel_workers)
+            if len(chunks) > 1:
+                # Tài nguyên tải lỗi/quá hạn thì PDF có thể thiếu ảnh: không cache (như render một lượt)
+                chunk_cache_key = cache_key if all(url in prefetched for url in remote_urls) else None
+                if defer_chunks:
+                    return {"chunks": chunks, "cache_key": chunk_cache_key}, "split"
+                pdf_bytes = self.render_parallel(
+                    chunks, show_page_number=show_page_number, record_output=record_output,
+                    template=template, cache_key=chunk_cache_key
+                )
+                return pdf_bytes, "miss"
 
-        stylesheet = self.default_css if show_page_number else self.no_page_number_css
+        html = HTML(string=full_html_string, base_url=".", url_fetcher=self.prefetching_url_fetcher(prefetched))
 
         try:
-            pdf_bytes = html.write_pdf(
-                stylesheets=[stylesheet],
-                font_config=self.font_config,
+            layout_start = time.perf_counter()
+            # render() rồi write_pdf() tương đương html.write_pdf(), nhưng biết được số trang
+            document = html.render(
+                stylesheets=[compiled.stylesheet(show_page_number)],
+                font_config=compiled.font_config,
                 presentational_hints=True
             )
-            return pdf_bytes
+            pdf_bytes = document.write_pdf()
+            layout_seconds = time.perf_counter() - layout_start
         except Exception as e:
             logger.error(f"WeasyPrint error: {e}")
             raise e
 
+        with self._stats_lock:
+            self._stats["renders"] += 1
+            self._stats["prefetch_seconds"] += prefetch_seconds
+            self._stats["layout_seconds"] += layout_seconds
+            self._stats["prefetched_resources"] += len(prefetched)
+        metrics.STAGE_SECONDS.observe(layout_seconds, stage="layout")
+        if record_output:
+            self._record_output(pdf_bytes, len(document.pages))
+        logger.info(f"PDF rendered: prefetch={prefetch_seconds:.3f}s ({len(prefetched)} resources) layout={layout_seconds:.3f}s")
+
+        # Tài nguyên tải lỗi/quá hạn thì PDF có thể thiếu ảnh: không cache để lần sau render lại
+        if cache_key is not None and all(url in prefetched for url in remote_urls):
+            self.cache.set(cache_key, pdf_bytes)
+        return pdf_bytes, "miss"
+
+    @staticmethod
+    def _record_output(pdf_bytes: bytes, page_count: int = None):
+        """Ghi kích thước và số trang của một tài liệu vừa render (không tính cache hit) vào metrics."""
+        if page_count is None:
+            # Chỉ đọc cây trang, không phân tích nội dung: rẻ so với lượt layout vừa xong
+            page_count = len(pypdf.PdfReader(BytesIO(pdf_bytes)).pages)
+        metrics.PDF_SIZE_BYTES.observe(len(pdf_bytes))
+        metrics.PDF_PAGES.observe(page_count)
+
+    def concat_pdfs(self, pdfs: list) -> bytes:
+        """Nối các PDF theo thứ tự thành một file."""
+        writer = pypdf.PdfWriter()
+        for pdf_bytes in pdfs:
+            writer.append(pypdf.PdfReader(BytesIO(pdf_bytes)))
+        with BytesIO() as final_io:
+            writer.write(final_io)
+            return final_io.getvalue()
+
+    def page_number_overlay(self, page_count: int, template: str = None) -> bytes:
+        """
+        PDF gồm page_count trang trống, mỗi trang chỉ có số trang của mẫu (ví dụ "n / N" ở @bottom-right),
+        render bằng đúng khổ giấy, lề và ô số trang của mẫu để vị trí và font khớp với render một lượt.
+        Header/footer không nằm trong overlay vì các phần đã render kèm chúng.
+        """
+        compiled = page_templates.compile(template)
+        key = make_cache_key("page-numbers", compiled.version, page_count)
+        cached = self.cache.get(key) if self.cache is not None else None
+        if cached is not None:
+            return cached
+
+        pages = '<div style="break-after: page">&nbsp;</div>' * (page_count - 1) + '<div>&nbsp;</div>'
+        overlay = HTML(string=f"<!DOCTYPE html><html><body>{pages}</body></html>", base_url=".").write_pdf(
+            stylesheets=[compiled.stylesheets["numbers"]],
+            font_config=compiled.font_config
+        )
+        if len(pypdf.PdfReader(BytesIO(overlay)).pages) != page_count:
+            raise ValueError(f"Page number overlay has wrong page count, expected {page_count}")
+        if self.cache is not None:
+            self.cache.set(key, overlay)
+        return overlay
+
+    def stamp_page_numbers(self, pdf_bytes: bytes, template: str = None) -> bytes:
+        """
+        Đánh số trang toàn cục cho PDF ghép từ nhiều phần render không có số trang,
+        giống merge_with_footer: phủ từng trang của overlay lên trang tương ứng.
+        """
+        reader = pypdf.PdfReader(BytesIO(pdf_bytes))
+        if not reader.pages:
+            return pdf_bytes
+        overlay_reader = pypdf.PdfReader(BytesIO(self.page_number_overlay(len(reader.pages), template)))
+
+        writer = pypdf.PdfWriter()
+        for page, overlay_page in zip(reader.pages, overlay_reader.pages):
+            page.merge_page(overlay_page)
+            writer.add_page(page)
+        with BytesIO() as final_io:
+            writer.write(final_io)
+            return final_io.getvalue()
+
+    def render_sections(self, sections_html: list, show_page_number: bool = True, postprocess: bool = True, template: str = None):
+        """
+        Render từng phần riêng (không số trang, qua cache PDF), ghép lại rồi đánh số trang toàn cục.
+        Phần không đổi so với lần trước trúng cache nên không phải layout lại.
+        Trả về (pdf_bytes, số phần dùng lại từ cache).
+        """
+        pdfs = []
+        reused = 0
+        for html_content in sections_html:
+            pdf_bytes, cache_status = self.render(
+                html_content, show_page_number=False, allow_parallel=False, record_output=False,
+                postprocess=postprocess, template=template
+            )
+            pdfs.append(pdf_bytes)
+            reused += cache_status == "hit"
+
+        with metrics.stage("pdf_merge"):
+            merged = self.concat_pdfs(pdfs)
+            if show_page_number:
+                merged = self.stamp_page_numbers(merged, template)
+        self._record_output(merged)
+
+        with self._stats_lock:
+            self._stats["sections_reused"] += reused
+            self._stats["sections_rendered"] += len(sections_html) - reused
+        logger.info(f"Sections rendered: {len(sections_html) - reused}, reused: {reused}")
+        return merged, reused
+
+    def render_parallel(
+        self, chunks: list, show_page_number: bool = True, record_output: bool = True, template: str = None, cache_key: str = None
+    ) -> bytes:
+        """
+        Layout các đoạn HTML (từ split_html) đồng thời trên pool riêng rồi ghép lại (xem merge_chunks).
+        """
+        start = time.perf_counter()
+        with metrics.stage("layout"):
+            pdfs = list(self._get_chunk_pool().map(_render_chunk_job, chunks, [template] * len(chunks)))
+        merged = self.merge_chunks(pdfs, show_page_number=show_page_number, record_output=record_output, template=template, cache_key=cache_key)
+        logger.info(f"PDF rendered in parallel: {len(chunks)} chunks in {time.perf_counter() - start:.3f}s")
+        return merged
+
+    def render_chunk(self, html_content: str, template: str = None) -> bytes:
+        """Layout một đoạn của split_html (không số trang, không cắt tiếp)."""
+        return _render_chunk_job(html_content, template)
+
+    def merge_chunks(
+        self, pdfs: list, show_page_number: bool = True, record_output: bool = True, template: str = None, cache_key: str = None
+    ) -> bytes:
+        """
+        Ghép PDF của các đoạn theo thứ tự, bỏ trang dẫn ở đầu mỗi đoạn sau đoạn đầu, đánh số trang toàn cục
+        và lưu cache theo cache_key của cả tài liệu.
+        """
+        with metrics.stage("pdf_merge"):
+            writer = pypdf.PdfWriter()
+            for index, pdf_bytes in enumerate(pdfs):
+                reader = pypdf.PdfReader(BytesIO(pdf_bytes))
+                for page in reader.pages[1 if index else 0:]:
+                    writer.add_page(page)
+            with BytesIO() as final_io:
+                writer.write(final_io)
+                merged = final_io.getvalue()
+            if show_page_number:
+                merged = self.stamp_page_numbers(merged, template)
+        if record_output:
+            self._record_output(merged)
+        if cache_key is not None and self.cache is not None:
+            self.cache.set(cache_key, merged)
+
+        with self._stats_lock:
+            self._stats["parallel_renders"] += 1
+            self._stats["parallel_chunks"] += len(pdfs)
+        return merged
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            result = dict(self._stats)
+        if self.cache is not None:
+            result["cache"] = self.cache.stats()
+        return result
+
     def merge_with_footer(self, body_pdf_bytes: bytes, footer_pdf_bytes: bytes) -> bytes:
         """
         Hợp nhất hai file PDF.
@@ -196,44 +570,45 @@ class PDFGenerator:
         trang đầu tiên của 'footer_pdf'.
         """
         try:
-            body_io = BytesIO(body_pdf_bytes) # param body_pdf_bytes: Bytes của file PDF nội dung chính
-            footer_io = BytesIO(footer_pdf_bytes) # param footer_pdf_bytes: Bytes của file PDF chứa footer
+            with metrics.stage("pdf_merge"):
+                body_io = BytesIO(body_pdf_bytes) # param body_pdf_bytes: Bytes của file PDF nội dung chính
+                footer_io = BytesIO(footer_pdf_bytes) # param footer_pdf_bytes: Bytes của file PDF chứa footer
 
-            body_reader = pypdf.PdfReader(body_io)
-            writer = pypdf.PdfWriter()
+                body_reader = pypdf.PdfReader(body_io)
+                writer = pypdf.PdfWriter()
 
-            # Giữ lại metadata từ file gốc
-            if body_reader.metadata:
-                writer.add_metadata(body_reader.metadata)
+                # Giữ lại metadata từ file gốc
+                if body_reader.metadata:
+                    writer.add_metadata(body_reader.metadata)
 
-            # Thêm tất cả các trang của body, trừ trang cuối cùng
-            for page in body_reader.pages[:-1]:
-                writer.add_page(page)
+                # Thêm tất cả các trang của body, trừ trang cuối cùng
+                for page in body_reader.pages[:-1]:
+                    writer.add_page(page)
 
-            # Nếu body PDF không có trang nào
-            if not body_reader.pages:
-                logger.warning("Body PDF is empty. Cannot perform merge.")
-                # Trả về footer hoặc một PDF rỗng tùy theo yêu cầu logic
-                with BytesIO() as final_io:
-                    writer.write(final_io)
-                    return final_io.getvalue()
+                # Nếu body PDF không có trang nào
+                if not body_reader.pages:
+                    logger.warning("Body PDF is empty. Cannot perform merge.")
+                    # Trả về footer hoặc một PDF rỗng tùy theo yêu cầu logic
+                    with BytesIO() as final_io:
+                        writer.write(final_io)
+                        return final_io.getvalue()
 
-            # Xử lý trang cuối cùng
-            footer_reader = pypdf.PdfReader(footer_io)
-            if not footer_reader.pages:
-                logger.error("Footer PDF is empty. Cannot merge.")
-                raise ValueError("Footer PDF has no pages and cannot be used for merging.")
+                # Xử lý trang cuối cùng
+                footer_reader = pypdf.PdfReader(footer_io)
+                if not footer_reader.pages:
+                    logger.error("Footer PDF is empty. Cannot merge.")
+                    raise ValueError("Footer PDF has no pages and cannot be used for merging.")
 
-            last_page_body = body_reader.pages[-1]
-            footer_page_template = footer_reader.pages[0]
+                last_page_body = body_reader.pages[-1]
+                footer_page_template = footer_reader.pages[0]
 
-            # Phủ nội dung của trang cuối lên trên trang footer
-            footer_page_template.merge_page(last_page_body)
-            writer.add_page(footer_page_template)
+                # Phủ nội dung của trang cuối lên trên trang footer
+                footer_page_template.merge_page(last_page_body)
+                writer.add_page(footer_page_template)
 
-            with BytesIO() as final_io:
-                writer.write(final_io)
-                return final_io.getvalue()
+                with BytesIO() as final_io:
+                    writer.write(final_io)
+                    return final_io.getvalue()
         except Exception as e:
             logger.error(f"PyPDF Error during merge: {e}")
             raise e
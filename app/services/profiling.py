@@ -0,0 +1,309 @@
+"""
+Profile các job render theo từng request để tìm nguyên nhân tài liệu chậm.
+
+- Request có header X-Profile bằng PROFILE_ADMIN_TOKEN, hoặc được chọn ngẫu nhiên theo PROFILE_SAMPLE_RATE:
+  job chạy dưới cProfile, luôn lưu lại file .prof (mở bằng snakeviz hoặc pstats).
+- Khi đặt PROFILE_SLOW_SECONDS > 0 (mặc định tắt), mọi job khác chạy kèm một bộ lấy mẫu stack
+  (PROFILE_SAMPLER_INTERVAL); chỉ khi job chậm hơn ngưỡng đó thì kết quả mới được lưu, dạng folded stacks
+  (speedscope, flamegraph.pl). Nên đặt PROFILE_SAMPLER_INTERVAL thô (0.05-0.1s) khi bật thường trực.
+
+Profile được ghi ngay trong process render vào ProfileStore (đĩa hoặc MinIO), theo request ID.
+Job nền (async_mode, /jobs) mang theo request ID và yêu cầu profile của request đã gửi nó (JobRunner.submit).
+"""
+import contextvars
+import cProfile
+import hmac
+import io
+import logging
+import marshal
+import os
+import pstats
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Ký tự đầu phải là chữ/số: ID dùng làm tên thư mục nên không được là '.', '..' hay bắt đầu bằng '-'
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+_NAME_RE = re.compile(r"^[A-Za-z0-9._-]{1,128}$")
+
+_request = contextvars.ContextVar("profile_request", default=None)
+
+
+def valid_request_id(value: str) -> bool:
+    return bool(value) and _REQUEST_ID_RE.match(value) is not None
+
+
+def valid_profile_name(value: str) -> bool:
+    return bool(value) and _NAME_RE.match(value) is not None and not value.startswith(".")
+
+
+def current_request():
+    """{"request_id", "explicit"} của request đang xử lý, None nếu không nằm trong request nào."""
+    return _request.get()
+
+
+@contextmanager
+def request_context(request_id: str, explicit: bool = False):
+    token = _request.set({"request_id": request_id, "explicit": explicit})
+    try:
+        yield
+    finally:
+        _request.reset(token)
+
+
+def is_admin(token: str) -> bool:
+    return bool(settings.PROFILE_ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, settings.PROFILE_ADMIN_TOKEN)
+
+
+def should_profile(token: str = None) -> bool:
+    """Profile đầy đủ request này: header admin hợp lệ hoặc trúng tỷ lệ lấy mẫu."""
+    if is_admin(token):
+        return True
+    return settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+class StackSampler:
+    """
+    Thread lấy mẫu stack của một thread khác mỗi interval giây qua sys._current_frames().
+    Chi phí cỡ vài chục micro giây mỗi mẫu, không phụ thuộc số lời gọi hàm như cProfile.
+    """
+    def __init__(self, interval: float = settings.PROFILE_SAMPLER_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self._target = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._target = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self) -> bytes:
+        """Định dạng collapsed stacks: mỗi dòng 'hàm_ngoài;...;hàm_trong số_mẫu'."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common()).encode("utf-8")
+
+
+def run_profiled(name: str, call, profile: dict):
+    """
+    Chạy call() trong process render theo chế độ profile của request (xem current_request()).
+    Kết quả profile được lưu vào profile_store với tên '<name>-<thời điểm>.prof|.folded'.
+    """
+    if profile.get("explicit"):
+        profiler = cProfile.Profile()
+        start = time.perf_counter()
+        try:
+            return profiler.runcall(call)
+        finally:
+            elapsed = time.perf_counter() - start
+            profiler.create_stats()
+            # Cùng định dạng với pstats.Stats.dump_stats()
+            profile_store.save(profile["request_id"], f"{name}-{time.time_ns()}.prof", marshal.dumps(profiler.stats))
+            logger.info(f"Profiled {name} for request {profile['request_id']} ({elapsed:.3f}s)")
+
+    if settings.PROFILE_SLOW_SECONDS <= 0:
+        return call()
+
+    sampler = StackSampler()
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        return call()
+    finally:
+        sampler.stop()
+        elapsed = time.perf_counter() - start
+        if elapsed >= settings.PROFILE_SLOW_SECONDS and sampler.samples:
+            profile_store.save(profile["request_id"], f"{name}-{time.time_ns()}.folded", sampler.folded())
+            logger.warning(f"Slow job {name} for request {profile['request_id']} ({elapsed:.3f}s), stack samples saved")
+
+
+def stats_text(data: bytes, limit: int = 60) -> str:
+    """Bảng pstats (sắp theo cumulative time) của một file .prof."""
+    with tempfile.NamedTemporaryFile(suffix=".prof") as f:
+        f.write(data)
+        f.flush()
+        output = io.StringIO()
+        stats = pstats.Stats(f.name, stream=output)
+        stats.strip_dirs().sort_stats("cumulative").print_stats(limit)
+    return output.getvalue()
+
+
+class DiskProfileStore:
+    """Profile lưu tại {directory}/{request_id}/{name}; giữ tối đa max_requests request mới nhất."""
+    def __init__(self, directory: str, max_requests: int = settings.PROFILE_MAX_REQUESTS):
+        self.directory = directory
+        self.max_requests = max_requests
+        self._lock = threading.Lock()
+
+    def _request_dir(self, request_id: str) -> str:
+        """Thư mục của request, luôn nằm trong self.directory (request ID đến từ header của client)."""
+        if not valid_request_id(request_id):
+            raise ValueError(f"Request ID không hợp lệ: {request_id!r}")
+        root = os.path.realpath(self.directory)
+        path = os.path.realpath(os.path.join(root, request_id))
+        if os.path.dirname(path) != root:
+            raise ValueError(f"Request ID không hợp lệ: {request_id!r}")
+        return path
+
+    def save(self, request_id: str, name: str, data: bytes):
+        if not valid_profile_name(name):
+            raise ValueError(f"Tên profile không hợp lệ: {name!r}")
+        path = self._request_dir(request_id)
+        # Process render khác có thể vừa dọn mất thư mục này (_prune): tạo lại rồi ghi lại
+        for attempt in range(3):
+            try:
+                os.makedirs(path, exist_ok=True)
+                tmp_path = os.path.join(path, f".{name}.tmp")
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, os.path.join(path, name))
+                break
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+        self._prune()
+
+    def _prune(self):
+        """
+        Xóa các request cũ nhất vượt quá max_requests. Mọi process render cùng ghi và dọn thư mục này
+        (_lock chỉ có tác dụng trong một process), nên file/thư mục process khác đã xóa thì bỏ qua.
+        """
+        if not self.max_requests:
+            return
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    continue
+            entries.sort()
+            for _, path in entries[:-self.max_requests]:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def list(self) -> list:
+        if not os.path.isdir(self.directory):
+            return []
+        result = []
+        for entry in os.scandir(self.directory):
+            try:
+                files = [
+                    {"name": child.name, "size": child.stat().st_size, "created_at": child.stat().st_mtime}
+                    for child in os.scandir(entry.path) if not child.name.startswith(".")
+                ]
+            except FileNotFoundError:
+                # Vừa bị _prune của process khác xóa
+                continue
+            result.append({"request_id": entry.name, "files": sorted(files, key=lambda f: f["name"])})
+        return result
+
+    def get(self, request_id: str, name: str):
+        if not valid_profile_name(name):
+            return None
+        try:
+            path = os.path.join(self._request_dir(request_id), name)
+        except ValueError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+
+class ObjectProfileStore:
+    """Profile lưu trên MinIO tại {prefix}/{request_id}/{name}, dùng chung giữa các máy chạy render."""
+    def __init__(self, prefix: str = "profiles"):
+        # Import tại đây để process dùng đĩa không phải kết nối tới MinIO
+        from app.services.storage import storage_service
+        self.prefix = prefix
+        self.storage = storage_service
+
+    def save(self, request_id: str, name: str, data: bytes):
+        self.storage.put_object(f"{self.prefix}/{request_id}/{name}", data)
+
+    def list(self) -> list:
+        requests = {}
+        for obj in self.storage.list_objects(f"{self.prefix}/"):
+            request_id, _, name = obj.object_name[len(self.prefix) + 1:].partition("/")
+            requests.setdefault(request_id, []).append({
+                "name": name,
+                "size": obj.size,
+                "created_at": obj.last_modified.timestamp() if obj.last_modified else None,
+            })
+        return [{"request_id": request_id, "files": files} for request_id, files in requests.items()]
+
+    def get(self, request_id: str, name: str):
+        return self.storage.get_file_content(f"{self.prefix}/{request_id}/{name}")
+
+
+class ProfileStore:
+    """Bọc backend theo PROFILE_STORE ('disk', 'minio', 'none'); lỗi lưu không làm hỏng job render."""
+    def __init__(self, backend: str = settings.PROFILE_STORE):
+        self.backend_name = backend
+        self._backend = None
+        self._lock = threading.Lock()
+
+    def _get_backend(self):
+        with self._lock:
+            if self._backend is None and self.backend_name != "none":
+                if self.backend_name == "minio":
+                    self._backend = ObjectProfileStore()
+                else:
+                    self._backend = DiskProfileStore(settings.PROFILE_DIR)
+            return self._backend
+
+    def save(self, request_id: str, name: str, data: bytes):
+        if not valid_request_id(request_id) or not valid_profile_name(name):
+            logger.error(f"Refusing to save profile with invalid name {request_id!r}/{name!r}")
+            return
+        try:
+            backend = self._get_backend()
+            if backend is not None:
+                backend.save(request_id, name, data)
+        except Exception as e:
+            logger.error(f"Failed to save profile {request_id}/{name}: {e}")
+
+    def list(self) -> list:
+        backend = self._get_backend()
+        if backend is None:
+            return []
+        # Request mới nhất trước
+        return sorted(
+            backend.list(),
+            key=lambda item: max((f["created_at"] or 0 for f in item["files"]), default=0),
+            reverse=True
+        )
+
+    def get(self, request_id: str, name: str):
+        if not valid_request_id(request_id) or not valid_profile_name(name):
+            return None
+        backend = self._get_backend()
+        return backend.get(request_id, name) if backend is not None else None
+
+
+profile_store = ProfileStore()
@@ -0,0 +1,497 @@
+import asyncio
+import logging
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from app.core import metrics
+from app.core.config import settings
+from app.services import profiling
+from app.services.cache import make_cache_key
+
+logger = logging.getLogger(__name__)
+
+
+class RenderQueueFull(Exception):
+    """
+    Hàng đợi render đã đầy. retry_after là số giây gợi ý client chờ trước khi thử lại.
+    """
+    def __init__(self, retry_after: int):
+        super().__init__("Render queue is full")
+        self.retry_after = retry_after
+
+
+# Các job dưới đây chạy trong process con. Import service bên trong hàm để
+# process cha không phải nạp WeasyPrint/matplotlib chỉ vì có executor.
+
+def pdf_math_backend(math_backend: str = None) -> str:
+    """
+    Backend công thức khi đầu ra là PDF: WeasyPrint không layout được MathML, nên 'mathml'
+    (chọn theo request/tài liệu hoặc MATH_BACKEND) được thay bằng 'svg'. MathML chỉ dùng cho đầu ra HTML.
+    """
+    if (math_backend or settings.MATH_BACKEND) == "mathml":
+        return "svg"
+    return math_backend
+
+
+def convert_markdown_job(content: str, math_backend: str = None) -> str:
+    from app.services.converter import converter_service
+    return converter_service.convert_to_html(content, math_backend=math_backend)
+
+
+class ChunkedRender:
+    """
+    Kết quả trung gian của render_pdf_job với tài liệu lớn (LARGE_DOC_WORKERS > 1): các đoạn HTML cần layout.
+    RenderExecutor layout từng đoạn trên chính pool render rồi chạy merge_chunks_job;
+    caller chỉ nhận (pdf_bytes, info) như mọi job khác.
+    """
+    def __init__(self, chunks: list, cache_key: str, show_page_number: bool, template: str):
+        self.chunks = chunks
+        self.cache_key = cache_key
+        self.show_page_number = show_page_number
+        self.template = template
+
+
+def render_pdf_job(html_content: str, show_page_number: bool = True, postprocess: bool = True, template: str = None):
+    """
+    Trả về (pdf_bytes, info), info["cache"] là 'hit' hoặc 'miss'.
+    postprocess=False với HTML sinh từ Markdown: bỏ qua clean_html (xem PDFGenerator.render).
+    template: tên mẫu trang, None = mẫu mặc định.
+    """
+    from app.services.pdf_generator import pdf_service
+    result, cache_status = pdf_service.render(
+        html_content, show_page_number=show_page_number, postprocess=postprocess, template=template, defer_chunks=True
+    )
+    if cache_status == "split":
+        return ChunkedRender(result["chunks"], result["cache_key"], show_page_number, template)
+    return result, {"cache": cache_status}
+
+
+def render_chunk_job(html_content: str, template: str = None) -> bytes:
+    from app.services.pdf_generator import pdf_service
+    return pdf_service.render_chunk(html_content, template)
+
+
+def merge_chunks_job(pdfs: list, show_page_number: bool = True, template: str = None, cache_key: str = None) -> bytes:
+    from app.services.pdf_generator import pdf_service
+    return pdf_service.merge_chunks(pdfs, show_page_number=show_page_number, template=template, cache_key=cache_key)
+
+
+def render_sections_job(content: str, show_page_number: bool = True, math_backend: str = None, template: str = None):
+    """
+    Markdown -> PDF theo từng phần (tách tại tiêu đề cấp 1/ngắt trang), chỉ phần thay đổi được render lại.
+    info["sections"] cho biết số phần dùng lại và số phần render lại.
+    Mỗi phần bắt đầu ở trang mới (mỗi tiêu đề cấp 1 thành một lần ngắt trang), nên bố cục có thể khác render
+    cả tài liệu một lượt. Tài liệu có chú thích ([^1]: ...) luôn được render một lượt như render_mode='full'.
+    """
+    from app.services.converter import has_footnote_definitions, split_sections
+    from app.services.pdf_generator import pdf_service
+    math_backend = pdf_math_backend(math_backend)
+    sections = [] if has_footnote_definitions(content) else split_sections(content)
+    if len(sections) < 2:
+        return render_document_job(content, show_page_number=show_page_number, math_backend=math_backend, template=template)
+
+    sections_html = [convert_markdown_job(section, math_backend=math_backend) for section in sections]
+    pdf_bytes, reused = pdf_service.render_sections(
+        sections_html, show_page_number=show_page_number, postprocess=False, template=template
+    )
+    return pdf_bytes, {
+        "cache": "hit" if reused == len(sections) else "miss",
+        "sections": {"total": len(sections), "reused": reused, "rendered": len(sections) - reused},
+    }
+
+
+def render_document_job(
+    content: str,
+    fmt: str = "markdown",
+    show_page_number: bool = True,
+    math_backend: str = None,
+    render_mode: str = "full",
+    template: str = None
+):
+    """
+    Markdown -> HTML -> PDF, hoặc HTML -> PDF nếu fmt khác 'markdown'. Trả về giống render_pdf_job.
+    render_mode='sections' (chỉ với Markdown): render theo từng phần, xem render_sections_job.
+    math_backend='mathml' được render bằng 'svg' (xem pdf_math_backend).
+    """
+    if fmt == "markdown" and render_mode == "sections":
+        return render_sections_job(content, show_page_number=show_page_number, math_backend=math_backend, template=template)
+    if fmt == "markdown":
+        html_content = convert_markdown_job(content, math_backend=pdf_math_backend(math_backend))
+        return render_pdf_job(html_content, show_page_number=show_page_number, postprocess=False, template=template)
+    return render_pdf_job(content, show_page_number=show_page_number, template=template)
+
+
+def merge_pdf_job(body_pdf_bytes: bytes, footer_pdf_bytes: bytes) -> bytes:
+    from app.services.pdf_generator import pdf_service
+    return pdf_service.merge_with_footer(body_pdf_bytes, footer_pdf_bytes)
+
+
+def warm_up_job() -> int:
+    """Job khởi động process con (xem RenderExecutor.warm_up); lỗi nạp WeasyPrint/font được báo ra ở đây."""
+    from app.services.pdf_generator import pdf_service
+    pdf_service.warm_up()
+    return os.getpid()
+
+
+def _init_render_worker():
+    # Nạp sẵn WeasyPrint, font và CSS khi process con khởi động thay vì ở job đầu tiên.
+    # Lỗi ở đây không được làm hỏng cả pool: job cần WeasyPrint sẽ tự báo lỗi khi chạy.
+    try:
+        from app.services.pdf_generator import pdf_service
+        pdf_service.warm_up()
+        import app.services.converter  # noqa: F401
+    except Exception as e:
+        logger.error(f"Render worker warm-up failed: {e}")
+
+
+# Bộ đếm đã gửi lần trước (trong process con), để mỗi job chỉ gửi phần thay đổi
+_shipped_stats = {}
+_shipped_metrics = {}
+
+
+def _worker_stats():
+    """
+    Bộ đếm của các service trong process con, gửi kèm kết quả mỗi job: chỉ các nhóm đã thay đổi
+    từ job trước, và "metrics" là phần tăng thêm (metrics.snapshot_delta), không phải toàn bộ snapshot.
+    """
+    global _shipped_metrics
+    stats = {}
+    converter = sys.modules.get("app.services.converter")
+    if converter is not None:
+        stats["math_cache"] = converter.formula_cache.stats()
+        stats["math_backends"] = {name: backend.stats() for name, backend in converter.math_backends.items()}
+    generator = sys.modules.get("app.services.pdf_generator")
+    if generator is not None:
+        stats["pdf_generator"] = generator.pdf_service.stats()
+    fetcher = sys.modules.get("app.services.http_fetcher")
+    if fetcher is not None:
+        stats["url_fetcher"] = fetcher.http_fetcher.stats()
+    changed = {section: value for section, value in stats.items() if _shipped_stats.get(section) != value}
+    _shipped_stats.update(changed)
+
+    snapshot = metrics.registry.snapshot()
+    delta = metrics.snapshot_delta(snapshot, _shipped_metrics)
+    _shipped_metrics = snapshot
+    if delta:
+        changed["metrics"] = delta
+    return changed
+
+
+def _run_job(fn, args, kwargs, labels=None, profile=None):
+    # time.time() (không phải perf_counter) để so sánh được mốc thời gian giữa các process
+    started_at = time.time()
+    # Nhãn endpoint/format của request gửi job, để metrics ghi trong process con mang đúng nhãn
+    with metrics.request_labels(**(labels or {})):
+        if profile is None:
+            result = fn(*args, **kwargs)
+        else:
+            result = profiling.run_profiled(fn.__name__, lambda: fn(*args, **kwargs), profile)
+    return result, started_at, time.time(), os.getpid(), _worker_stats()
+
+
+RENDER_JOBS = metrics.Counter(
+    "mdpdf_render_jobs_total",
+    "Số job render theo kết quả (completed/failed/coalesced/rejected)",
+    ("job", "result")
+)
+RENDER_QUEUE_WAIT_SECONDS = metrics.Histogram(
+    "mdpdf_render_queue_wait_seconds",
+    "Thời gian job chờ process con rảnh",
+    ("job",)
+)
+RENDER_JOB_SECONDS = metrics.Histogram(
+    "mdpdf_render_job_duration_seconds",
+    "Thời gian chạy job trong process con",
+    ("job",)
+)
+
+
+class RenderExecutor:
+    """
+    Process pool cho các tác vụ render nặng (WeasyPrint, matplotlib), tách khỏi event loop.
+    Số job đồng thời giới hạn bởi workers, số job chờ giới hạn bởi max_queue;
+    vượt quá thì submit() ném RenderQueueFull thay vì xếp hàng vô hạn.
+
+    Các job đều là hàm thuần (cùng tham số cho cùng kết quả), nên yêu cầu trùng với một job
+    đang chạy/chờ được gộp vào job đó (single-flight): dùng chung Future, không chiếm thêm slot.
+    """
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._pool = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.rejected = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._jobs = {}
+        self._worker_stats = {}  # pid -> (pool, {nhóm: bộ đếm mới nhất})
+        self._worker_metrics = {}  # tổng các delta metrics của mọi process con, kể cả process đã dừng
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_render_worker
+                )
+            return self._pool
+
+    def warm_up(self) -> int:
+        """
+        Khởi động đủ workers process con và chờ chúng nạp xong WeasyPrint/font/CSS, để request
+        đầu tiên không phải chờ spawn process và import. Trả về số process đã sẵn sàng.
+        """
+        pool = self._get_pool()
+        try:
+            # Pool spawn thêm process khi không có process rảnh, nên gửi cùng lúc workers job
+            futures = [pool.submit(warm_up_job) for _ in range(self.workers)]
+            return len({future.result() for future in futures})
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise
+
+    def _retry_after(self) -> int:
+        # Ước lượng: thời gian để các job đang chờ/chạy giải phóng một slot
+        with self._lock:
+            completed = sum(job["completed"] for job in self._jobs.values())
+            render_seconds = sum(job["render_seconds"] for job in self._jobs.values())
+            in_flight = self.in_flight
+        avg = render_seconds / completed if completed else 1.0
+        return max(1, math.ceil(avg * in_flight / self.workers))
+
+    @staticmethod
+    def _flight_key(fn, args, kwargs) -> str:
+        return make_cache_key(fn.__module__, fn.__name__, *args, *(part for item in sorted(kwargs.items()) for part in item))
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        name = fn.__name__
+        key = self._flight_key(fn, args, kwargs)
+        profile = profiling.current_request()
+        if profile is not None and profile["explicit"]:
+            # Request cần profile riêng: không gộp vào job của request khác
+            key = make_cache_key(key, profile["request_id"])
+        with self._lock:
+            shared = self._flights.get(key)
+            if shared is not None:
+                self.coalesced += 1
+                self._job_stats(name)["coalesced"] += 1
+            elif self._slots.acquire(blocking=False):
+                # Tra cứu và đăng ký trong cùng một lần giữ khóa: hai caller đồng thời không thể cùng render
+                result_future = self._flights[key] = Future()
+                self.in_flight += 1
+            else:
+                self.rejected += 1
+                result_future = None
+        if shared is not None:
+            RENDER_JOBS.inc(job=name, result="coalesced")
+            return shared
+        if result_future is None:
+            RENDER_JOBS.inc(job=name, result="rejected")
+            raise RenderQueueFull(self._retry_after())
+
+        def finish(result=None, error=None):
+            with self._lock:
+                self._flights.pop(key, None)
+            self._release()
+            if error is not None:
+                result_future.set_exception(error)
+            else:
+                result_future.set_result(result)
+
+        pool = self._get_pool()
+        labels = metrics.current_labels()
+
+        def on_result(result):
+            if isinstance(result, ChunkedRender):
+                self._render_chunks(pool, result, labels, finish)
+            else:
+                finish(result)
+
+        try:
+            self._dispatch(pool, fn, args, kwargs, labels, profile, on_result, lambda e: finish(error=e))
+        except Exception as e:
+            # Caller khác có thể đã gộp vào result_future: báo lỗi cho họ qua Future
+            finish(error=e)
+            raise
+        return result_future
+
+    def _dispatch(self, pool, fn, args, kwargs, labels, profile, on_result, on_error):
+        """Gửi một job lên pool, ghi thời gian chờ/chạy, rồi gọi on_result(kết quả) hoặc on_error(lỗi)."""
+        name = fn.__name__
+        submitted_at = time.time()
+        try:
+            future = pool.submit(_run_job, fn, args, kwargs, labels, profile)
+        except BrokenProcessPool:
+            self._discard_pool(pool)
+            raise
+
+        def on_done(f):
+            try:
+                result, started_at, finished_at, pid, worker_stats = f.result()
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    # Process con chết (OOM, segfault...): bỏ pool cũ, lần submit sau tạo pool mới
+                    self._discard_pool(pool)
+                self._record(name, None, None, failed=True)
+                on_error(e)
+                return
+            self._record(name, started_at - submitted_at, finished_at - started_at)
+            self._update_worker_stats(pool, pid, worker_stats)
+            on_result(result)
+
+        future.add_done_callback(on_done)
+
+    def _render_chunks(self, pool, plan: ChunkedRender, labels, finish):
+        """
+        Layout các đoạn của tài liệu lớn song song trên pool render (không tạo pool riêng), rồi ghép bằng merge_chunks_job.
+        Các job con thuộc về job đã giữ slot, nên không chiếm thêm slot của hàng đợi.
+        """
+        pdfs = [None] * len(plan.chunks)
+        state = {"remaining": len(plan.chunks), "failed": False}
+        lock = threading.Lock()
+
+        def on_error(e):
+            with lock:
+                if state["failed"]:
+                    return
+                state["failed"] = True
+            finish(error=e)
+
+        def merged(pdf_bytes):
+            finish((pdf_bytes, {"cache": "miss", "chunks": len(pdfs)}))
+
+        def chunk_done(index, pdf_bytes):
+            with lock:
+                pdfs[index] = pdf_bytes
+                state["remaining"] -= 1
+                ready = state["remaining"] == 0 and not state["failed"]
+            if ready:
+                try:
+                    self._dispatch(
+                        pool, merge_chunks_job, (pdfs,),
+                        {"show_page_number": plan.show_page_number, "template": plan.template, "cache_key": plan.cache_key},
+                        labels, None, merged, on_error
+                    )
+                except Exception as e:
+                    on_error(e)
+
+        for index, chunk in enumerate(plan.chunks):
+            try:
+                self._dispatch(
+                    pool, render_chunk_job, (chunk,), {"template": plan.template}, labels, None,
+                    lambda pdf_bytes, index=index: chunk_done(index, pdf_bytes), on_error
+                )
+            except Exception as e:
+                on_error(e)
+                return
+
+    def _update_worker_stats(self, pool, pid, worker_stats: dict):
+        delta = worker_stats.pop("metrics", None)
+        with self._lock:
+            if delta:
+                metrics.merge_into(self._worker_metrics, delta)
+            entry = self._worker_stats.get(pid)
+            if entry is None or entry[0] is not pool:
+                entry = self._worker_stats[pid] = (pool, {})
+            entry[1].update(worker_stats)
+
+    def _drop_worker_stats(self, pool):
+        # Gọi khi đang giữ self._lock: process con của pool đã dừng, bộ đếm theo pid của chúng không còn ý nghĩa
+        for pid in [pid for pid, (owner, _) in self._worker_stats.items() if owner is pool]:
+            del self._worker_stats[pid]
+
+    def _discard_pool(self, pool):
+        # Pool hỏng đã tự dừng các process con; chỉ cần bỏ tham chiếu.
+        # Không gọi pool.shutdown() ở đây vì hàm này có thể chạy trong thread quản lý của chính pool đó.
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+            self._drop_worker_stats(pool)
+
+    def _release(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def _job_stats(self, name) -> dict:
+        # Gọi khi đang giữ self._lock
+        return self._jobs.setdefault(name, {
+            "completed": 0,
+            "failed": 0,
+            "coalesced": 0,
+            "queue_wait_seconds": 0.0,
+            "max_queue_wait_seconds": 0.0,
+            "render_seconds": 0.0,
+            "max_render_seconds": 0.0,
+        })
+
+    def _record(self, name, queue_wait, render_time, failed=False):
+        RENDER_JOBS.inc(job=name, result="failed" if failed else "completed")
+        if not failed:
+            RENDER_QUEUE_WAIT_SECONDS.observe(queue_wait, job=name)
+            RENDER_JOB_SECONDS.observe(render_time, job=name)
+        with self._lock:
+            job = self._job_stats(name)
+            if failed:
+                job["failed"] += 1
+                return
+            job["completed"] += 1
+            job["queue_wait_seconds"] += queue_wait
+            job["max_queue_wait_seconds"] = max(job["max_queue_wait_seconds"], queue_wait)
+            job["render_seconds"] += render_time
+            job["max_render_seconds"] = max(job["max_render_seconds"], render_time)
+        logger.info(f"Render job {name}: queue_wait={queue_wait:.3f}s render={render_time:.3f}s")
+
+    async def run(self, fn, *args, **kwargs):
+        """Dùng trong route async: chờ kết quả mà không chặn event loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def run_sync(self, fn, *args, **kwargs):
+        """Dùng trong route sync (chạy trên threadpool của FastAPI)."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+            with self._lock:
+                self._drop_worker_stats(pool)
+
+    def worker_stats(self, section: str) -> dict:
+        """Bộ đếm mới nhất của từng process con đang chạy (theo pid) cho một nhóm, ví dụ 'math_cache'."""
+        with self._lock:
+            return {pid: stats[section] for pid, (_, stats) in self._worker_stats.items() if section in stats}
+
+    def worker_metrics(self) -> dict:
+        """Snapshot metrics cộng dồn của mọi process con (counter không bị giảm khi pool được tạo lại)."""
+        with self._lock:
+            return metrics.merge_snapshots([self._worker_metrics])
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "rejected": self.rejected,
+                "coalesced": self.coalesced,
+                "jobs": {name: dict(job) for name, job in self._jobs.items()},
+            }
+
+
+render_executor = RenderExecutor(settings.RENDER_WORKERS, settings.RENDER_QUEUE_SIZE)
+
+metrics.Gauge(
+    "mdpdf_render_jobs_in_flight",
+    "Số job render đang chạy hoặc đang chờ trong process pool",
+    function=lambda: render_executor.in_flight
+)
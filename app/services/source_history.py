@@ -0,0 +1,197 @@
+"""
+Lưu source của các version theo kiểu delta (SOURCE_STORAGE_MODE=delta).
+
+- Cứ SOURCE_KEYFRAME_INTERVAL version có một keyframe: source đầy đủ, lưu y như chế độ 'full'.
+- Các version ở giữa chỉ lưu delta nén (zlib) so với version ngay trước. Delta cũng là blob theo nội dung
+  (BlobStore), nên được đếm tham chiếu và dọn cùng các blob khác khi xóa tài liệu.
+- DocumentVersion.source_keyframe = số version của keyframe đầu chuỗi (None = source_path là bản đầy đủ);
+  source_hash = sha256 của source đầy đủ, dùng để kiểm tra bản dựng lại và làm khóa cache.
+
+Dựng lại version N: tải keyframe và các delta K+1..N song song rồi áp lần lượt. Nếu cache đã có một version
+trong chuỗi gần N hơn thì bắt đầu từ version đó. Bản dựng lại được cache LRU theo source_hash.
+
+Delta theo dòng: phần đầu/cuối giống nhau được cắt trước, difflib chỉ so khớp phần giữa, nên với
+các sửa nhỏ trên tài liệu dài chi phí gần như tuyến tính theo số dòng.
+"""
+import difflib
+import hashlib
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import Session
+from app.core import metrics
+from app.core.config import settings
+from app.models import Document, DocumentVersion
+from app.services.blob_store import BlobStore, blob_store
+from app.services.cache import MemoryLRUCache
+
+DELTA_MAGIC = b"MDD1"
+DELTA_CONTENT_TYPE = "application/x-mdpdf-delta"
+
+_COPY = struct.Struct("<BII")  # 0, dòng bắt đầu trong bản gốc, số dòng
+_INSERT = struct.Struct("<BI")  # 1, số byte, rồi tới các byte được chèn
+
+
+def make_delta(base: bytes, target: bytes) -> bytes:
+    """Delta để dựng target từ base: các đoạn dòng chép từ base xen với các byte mới, nén zlib."""
+    base_lines = base.splitlines(keepends=True)
+    target_lines = target.splitlines(keepends=True)
+
+    limit = min(len(base_lines), len(target_lines))
+    prefix = 0
+    while prefix < limit and base_lines[prefix] == target_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and base_lines[-1 - suffix] == target_lines[-1 - suffix]:
+        suffix += 1
+
+    ops = []
+    if prefix:
+        ops.append(_COPY.pack(0, 0, prefix))
+    middle_base = base_lines[prefix:len(base_lines) - suffix]
+    middle_target = target_lines[prefix:len(target_lines) - suffix]
+    matcher = difflib.SequenceMatcher(None, middle_base, middle_target)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(_COPY.pack(0, prefix + i1, i2 - i1))
+        elif j2 > j1:
+            data = b"".join(middle_target[j1:j2])
+            ops.append(_INSERT.pack(1, len(data)) + data)
+    if suffix:
+        ops.append(_COPY.pack(0, len(base_lines) - suffix, suffix))
+    return DELTA_MAGIC + zlib.compress(b"".join(ops), 9)
+
+
+def apply_delta(base: bytes, delta: bytes) -> bytes:
+    if not delta.startswith(DELTA_MAGIC):
+        raise ValueError("Delta không hợp lệ.")
+    payload = zlib.decompress(delta[len(DELTA_MAGIC):])
+    base_lines = base.splitlines(keepends=True)
+    parts = []
+    pos = 0
+    while pos < len(payload):
+        if payload[pos] == 0:
+            _, start, count = _COPY.unpack_from(payload, pos)
+            pos += _COPY.size
+            parts.extend(base_lines[start:start + count])
+        elif payload[pos] == 1:
+            _, length = _INSERT.unpack_from(payload, pos)
+            pos += _INSERT.size
+            parts.append(payload[pos:pos + length])
+            pos += length
+        else:
+            raise ValueError("Delta không hợp lệ.")
+    return b"".join(parts)
+
+
+def source_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class SourceHistory:
+    def __init__(
+        self,
+        blobs: BlobStore = blob_store,
+        mode: str = settings.SOURCE_STORAGE_MODE,
+        keyframe_interval: int = settings.SOURCE_KEYFRAME_INTERVAL,
+        cache_max_bytes: int = settings.SOURCE_CACHE_MAX_BYTES,
+        fetch_concurrency: int = 8
+    ):
+        self.blobs = blobs
+        self.mode = mode
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.cache = MemoryLRUCache(cache_max_bytes) if cache_max_bytes else None
+        self._fetch_pool = ThreadPoolExecutor(max_workers=fetch_concurrency, thread_name_prefix="source-fetch")
+
+    def store(self, db: Session, doc: Document, version_number: int, source: bytes, content_type: str) -> dict:
+        """
+        Lưu source của version mới, trả về các cột source_path/source_keyframe/source_hash cho DocumentVersion.
+        Phải gọi trước khi doc.current_content được đổi sang nội dung mới: bản gốc của delta là
+        nội dung hiện tại của tài liệu, chỉ dùng khi hash khớp với source_hash của version trước.
+        """
+        digest = source_digest(source)
+        keyframe, delta = None, None
+        if self.mode == "delta" and version_number > 1 and doc.current_content is not None:
+            previous = db.query(DocumentVersion).filter(
+                DocumentVersion.document_id == doc.id,
+                DocumentVersion.version_number == version_number - 1
+            ).first()
+            base = doc.current_content.encode("utf-8")
+            if previous is not None and previous.source_hash == source_digest(base):
+                chain_start = previous.source_keyframe or previous.version_number
+                if version_number - chain_start < self.keyframe_interval:
+                    delta = make_delta(base, source)
+                    # Viết lại gần như toàn bộ: lưu bản đầy đủ, chuỗi delta mới bắt đầu từ version này
+                    if len(delta) < len(source):
+                        keyframe = chain_start
+
+        if keyframe is None:
+            source_path = self.blobs.acquire(db, source, content_type)
+        else:
+            source_path = self.blobs.acquire(db, delta, DELTA_CONTENT_TYPE)
+        if self.cache is not None:
+            self.cache.set(digest, source)
+        return {"source_path": source_path, "source_keyframe": keyframe, "source_hash": digest}
+
+    def _fetch(self, object_name: str) -> bytes:
+        data = self.blobs.storage.get_file_content(object_name)
+        if data is None:
+            raise ValueError(f"Không đọc được {object_name}")
+        return data
+
+    def _cached(self, version: DocumentVersion):
+        if self.cache is None or not version.source_hash or not self.cache.contains(version.source_hash):
+            return None
+        return self.cache.get(version.source_hash)
+
+    def reconstruct(self, chain: list) -> bytes:
+        """
+        Source đầy đủ của chain[-1]. chain là các version từ keyframe tới version cần dựng lại, theo thứ tự tăng dần.
+        """
+        target = chain[-1]
+        if chain[0].source_keyframe is not None or target.source_keyframe != chain[0].version_number:
+            raise ValueError("Chuỗi delta không hợp lệ.")
+        if len(chain) != target.version_number - chain[0].version_number + 1:
+            raise ValueError("Chuỗi delta bị thiếu version.")
+
+        cached = self._cached(target)
+        metrics.CACHE_REQUESTS.inc(cache="source", result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+
+        with metrics.stage("source_reconstruct"):
+            # Bắt đầu từ version gần target nhất đã có trong cache, không thì từ keyframe
+            start, source = 0, None
+            for index in range(len(chain) - 2, -1, -1):
+                source = self._cached(chain[index])
+                if source is not None:
+                    start = index
+                    break
+
+            names = [version.source_path for version in chain[start + 1:]]
+            if source is None:
+                names.insert(0, chain[0].source_path)
+            payloads = list(self._fetch_pool.map(self._fetch, names))
+            if source is None:
+                source = payloads.pop(0)
+                if self.cache is not None and chain[0].source_hash:
+                    self.cache.set(chain[0].source_hash, source)
+
+            for delta in payloads:
+                source = apply_delta(source, delta)
+
+        if source_digest(source) != target.source_hash:
+            raise ValueError(f"Source dựng lại của version {target.version_number} không khớp hash.")
+        if self.cache is not None:
+            self.cache.set(target.source_hash, source)
+        return source
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "keyframe_interval": self.keyframe_interval,
+            "cache": self.cache.stats() if self.cache is not None else None,
+        }
+
+
+source_history = SourceHistory()
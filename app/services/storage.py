@@ -1,9 +1,18 @@
 from minio import Minio
+from minio.error import S3Error
+from app.core import metrics
 from app.core.config import settings
+from app.services.compression import COMPRESSED_CONTENT_TYPE, COMPRESSED_SUFFIX, content_compressor, is_compressed_object
 import io
+import threading
+import time
 from datetime import timedelta
 
 class StorageService:
+    """
+    Tạo client không gọi mạng: bucket được kiểm tra/tạo ở bước khởi động (ensure_bucket)
+    hoặc ngay trước lần ghi đầu tiên, nên import module không hỏng khi MinIO tạm thời chưa sẵn sàng.
+    """
     def __init__(self):
         self.client = Minio(
             settings.MINIO_ENDPOINT,
@@ -11,37 +20,147 @@ class StorageService:
             secret_key=settings.MINIO_SECRET_KEY,
             secure=settings.MINIO_SECURE
         )
-        self._ensure_bucket()
+        # Client chỉ dùng để ký presigned URL cho client bên ngoài; có region nên ký không cần gọi mạng
+        self.public_client = Minio(
+            settings.MINIO_PUBLIC_ENDPOINT,
+            access_key=settings.MINIO_ACCESS_KEY,
+            secret_key=settings.MINIO_SECRET_KEY,
+            secure=settings.MINIO_SECURE,
+            region=settings.MINIO_REGION
+        )
+        self._presigned = {}
+        self._presigned_window = None
+        self._presigned_lock = threading.Lock()
+        self._bucket_ready = False
+        self._bucket_lock = threading.Lock()
 
-    def _ensure_bucket(self):
-        if not self.client.bucket_exists(settings.MINIO_BUCKET_NAME):
-            self.client.make_bucket(settings.MINIO_BUCKET_NAME)
+    def ensure_bucket(self):
+        """Tạo bucket nếu chưa có. Chỉ gọi MinIO lần đầu thành công; lỗi thì lần sau thử lại."""
+        if self._bucket_ready:
+            return
+        with self._bucket_lock:
+            if not self._bucket_ready:
+                if not self.client.bucket_exists(settings.MINIO_BUCKET_NAME):
+                    self.client.make_bucket(settings.MINIO_BUCKET_NAME)
+                self._bucket_ready = True
 
     def upload_pdf(self, file_data: bytes, object_name: str):
         """Upload file bytes lên MinIO"""
+        self.ensure_bucket()
         file_stream = io.BytesIO(file_data)
+        with metrics.stage("storage_upload"):
+            self.client.put_object(
+                settings.MINIO_BUCKET_NAME,
+                object_name,
+                file_stream,
+                length=len(file_data),
+                content_type="application/pdf"
+            )
+        return object_name
+
+    @staticmethod
+    def blob_object_name(digest: str, content_type: str = None, size: int = 0) -> str:
+        """blobs/ab/abcd...; nội dung text đủ lớn được nén và có thêm đuôi .mdz (app/services/compression.py)."""
+        object_name = f"blobs/{digest[:2]}/{digest}"
+        if content_compressor.should_compress(content_type, size):
+            object_name += COMPRESSED_SUFFIX
+        return object_name
+
+    def upload_blob(self, file_data: bytes, object_name: str, content_type: str = "application/octet-stream"):
+        """
+        Upload nội dung vào object theo hash (tên từ blob_object_name). Ghi đè cùng nội dung nên an toàn khi gọi lại.
+        Object có đuôi .mdz được nén trước khi upload.
+        """
+        if is_compressed_object(object_name):
+            with metrics.stage("storage_compress"):
+                file_data = content_compressor.encode_blob(file_data)
+            content_type = COMPRESSED_CONTENT_TYPE
+        self.ensure_bucket()
+        with metrics.stage("storage_upload"):
+            self.client.put_object(
+                settings.MINIO_BUCKET_NAME,
+                object_name,
+                io.BytesIO(file_data),
+                length=len(file_data),
+                content_type=content_type
+            )
+        return object_name
+
+    def put_object(self, object_name: str, data: bytes, content_type: str = "application/octet-stream"):
+        self.ensure_bucket()
         self.client.put_object(
             settings.MINIO_BUCKET_NAME,
             object_name,
-            file_stream,
-            length=len(file_data),
-            content_type="application/pdf"
+            io.BytesIO(data),
+            length=len(data),
+            content_type=content_type
         )
         return object_name
 
-    def get_presigned_url(self, object_name: str):
-        """Lấy link tạm thời để xem file"""
-        return self.client.get_presigned_url(
+    def list_objects(self, prefix: str):
+        return self.client.list_objects(settings.MINIO_BUCKET_NAME, prefix=prefix, recursive=True)
+
+    def remove_object(self, object_name: str):
+        self.client.remove_object(settings.MINIO_BUCKET_NAME, object_name)
+
+    def get_presigned_url(self, object_name: str, filename: str = None, expires: int = settings.PRESIGNED_URL_EXPIRY):
+        """
+        Lấy link tạm thời để tải file, filename (nếu có) là tên file khi trình duyệt lưu về.
+        URL được cache theo (object, cửa sổ thời gian dài expires/2): URL trả ra luôn còn hạn
+        ít nhất expires/2 giây, và các request lặp lại trong cùng cửa sổ không phải ký lại.
+        """
+        window_seconds = max(1, expires // 2)
+        window = int(time.time() // window_seconds)
+        key = (object_name, filename, expires)
+        with self._presigned_lock:
+            if self._presigned_window != window:
+                self._presigned = {}
+                self._presigned_window = window
+            url = self._presigned.get(key)
+        if url is not None:
+            return url
+
+        response_headers = {"response-content-disposition": f"attachment; filename={filename}"} if filename else None
+        url = self.public_client.get_presigned_url(
             "GET",
             settings.MINIO_BUCKET_NAME,
             object_name,
-            expires=timedelta(hours=1)
+            expires=timedelta(seconds=expires),
+            response_headers=response_headers
         )
+        with self._presigned_lock:
+            if self._presigned_window == window:
+                self._presigned[key] = url
+        return url
     
+    def stat(self, object_name: str):
+        """Metadata của object (size, etag, content_type...), None nếu không tồn tại."""
+        try:
+            return self.client.stat_object(settings.MINIO_BUCKET_NAME, object_name)
+        except Exception as e:
+            print(f"MinIO Error: {e}")
+            return None
+
+    def iter_object(self, object_name: str, offset: int = 0, length: int = 0, chunk_size: int = 64 * 1024):
+        """
+        Đọc object (hoặc đoạn [offset, offset + length)) theo từng chunk,
+        bộ nhớ dùng cho mỗi lượt tải chỉ cỡ chunk_size bất kể file lớn tới đâu.
+        """
+        response = self.client.get_object(settings.MINIO_BUCKET_NAME, object_name, offset=offset, length=length)
+        try:
+            yield from response.stream(chunk_size)
+        finally:
+            response.close()
+            response.release_conn()
+
     def get_file_content(self, object_name: str):
+        """Nội dung object (đã giải nén nếu object được lưu nén), None nếu không đọc được."""
         try:
             response = self.client.get_object(settings.MINIO_BUCKET_NAME, object_name)
-            return response.read()
+            data = response.read()
+            if is_compressed_object(object_name):
+                data = content_compressor.decompress(data)
+            return data
         except Exception as e:
             print(f"MinIO Error: {e}")
             return None
@@ -50,4 +169,69 @@ class StorageService:
                 response.close()
                 response.release_conn()
 
-storage_service = StorageService()
\ No newline at end of file
+storage_service = StorageService()
+
+
+class ObjectStorageCache:
+    """
+    Tầng cache trên MinIO (dùng làm tầng phụ của TieredCache): mỗi khóa là một object
+    {prefix}/{key[:2]}/{key}, dùng chung giữa mọi process và mọi máy chạy API.
+    """
+    def __init__(self, prefix: str, storage: StorageService = storage_service):
+        self.prefix = prefix
+        self.storage = storage
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _object_name(self, key: str) -> str:
+        return f"{self.prefix}/{key[:2]}/{key}"
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def get(self, key: str):
+        response = None
+        try:
+            response = self.storage.client.get_object(settings.MINIO_BUCKET_NAME, self._object_name(key))
+            value = response.read()
+        except S3Error:
+            self._count("misses")
+            return None
+        except Exception as e:
+            # MinIO lỗi thì coi như trượt cache, không làm hỏng request
+            print(f"MinIO cache error: {e}")
+            self._count("errors")
+            return None
+        finally:
+            if response is not None:
+                response.close()
+                response.release_conn()
+        self._count("hits")
+        return value
+
+    def contains(self, key: str) -> bool:
+        try:
+            self.storage.client.stat_object(settings.MINIO_BUCKET_NAME, self._object_name(key))
+            return True
+        except Exception:
+            return False
+
+    def set(self, key: str, value: bytes):
+        try:
+            self.storage.ensure_bucket()
+            self.storage.client.put_object(
+                settings.MINIO_BUCKET_NAME,
+                self._object_name(key),
+                io.BytesIO(value),
+                length=len(value)
+            )
+        except Exception as e:
+            print(f"MinIO cache error: {e}")
+            self._count("errors")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "errors": self.errors}
\ No newline at end of file
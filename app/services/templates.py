@@ -0,0 +1,302 @@
+"""
+Mẫu trang (page template) cho PDF: khổ giấy, lề, đánh số trang, header/footer và bộ font.
+
+Mỗi mẫu chỉ được biên dịch một lần trong mỗi process (CSS của WeasyPrint đã phân tích sẵn cho từng
+biến thể), và mọi mẫu dùng chung một FontConfiguration: fontconfig chỉ khởi tạo một lần và kết quả tra
+font ('Times New Roman' -> 'Liberation Serif'...) được dùng lại cho mọi lần render trong process.
+
+Module không import WeasyPrint ở mức module, để API (chỉ cần tên mẫu để kiểm tra tham số) không phải nạp nó.
+"""
+import re
+import string
+import threading
+from app.core.config import settings
+from app.services.cache import make_cache_key
+
+SERIF_FONTS = ("'Times New Roman'", "'Liberation Serif'", "'Nimbus Roman No9 L'", "'DejaVu Serif'", "serif")
+SANS_FONTS = ("'Liberation Sans'", "'DejaVu Sans'", "Arial", "Helvetica", "sans-serif")
+MONO_FONTS = ("'Courier New'", "'Liberation Mono'", "monospace")
+
+# Biến thể stylesheet của một mẫu:
+# numbered = header/footer + số trang, plain = header/footer không số trang (các phần render riêng rồi ghép),
+# numbers = chỉ số trang (trang phủ để đánh số lại PDF đã ghép, xem PDFGenerator.page_number_overlay)
+VARIANTS = ("numbered", "plain", "numbers")
+
+COMMON_CSS = string.Template("""
+    /* NUCLEAR RESET - ÉP PHÔNG CHỮ CỦA MẪU CHO TOÀN BỘ VĂN BẢN */
+    /* Dùng dấu * để chọn tất cả mọi thành phần; danh sách font kết thúc bằng họ font chung
+       (serif/sans-serif) để không bao giờ nhảy sang họ font khác */
+    * {
+        font-family: $body_fonts !important;
+    }
+
+    /* Cấu hình body cụ thể */
+    body {
+        font-size: $font_size;
+        line-height: 1.4;
+        color: #000;
+        text-align: justify;
+    }
+
+    /* XỬ LÝ IN ĐẬM VÀ TIÊU ĐỀ */
+    strong, b {
+        font-weight: bold !important;
+        /* Font-family đã được xử lý bởi dấu * ở trên nên sẽ đồng bộ */
+    }
+
+    h1, h2, h3, h4, h5, h6 {
+        font-weight: bold !important;
+        font-style: normal !important; /* Không in nghiêng */
+        margin-top: 20px;
+        margin-bottom: 10px;
+        page-break-after: avoid;
+    }
+
+    h1 { font-size: 24pt; text-transform: uppercase; text-align: center; margin-bottom: 30px; string-set: doc-title content(); }
+    h2 { font-size: 16pt; margin-top: 30px; margin-bottom: 15px; }
+    h3 { font-size: 14pt; }
+
+    /* GIỮ NGUYÊN FIX LỖI CĂN LỀ DẤU * */
+    ul, ol {
+        margin: 10px 0 15px 0;
+        padding-left: 40px;
+    }
+    li {
+        margin-bottom: 8px;
+        list-style-position: outside !important;
+        text-align: justify;
+    }
+    /* Gỡ bỏ margin của thẻ p bên trong li nếu có, nhưng không làm nó inline */
+    li p { margin: 0; padding: 0; }
+    /* Đảm bảo hình ảnh trong list vẫn là block để có thể căn lề */
+    li img { display: block; }
+
+    /* BLOCKQUOTE */
+    blockquote {
+        margin: 15px 0 15px 20px;
+        padding: 10px 15px;
+        border-left: 4px solid #ddd;
+        background-color: #f9f9f9;
+        color: #555;
+    }
+
+    /* CODE BLOCK & TABLE */
+    pre {
+        font-family: $mono_fonts !important;
+        font-size: 11pt;
+        background-color: #f5f5f5;
+        padding: 12px;
+        border: 1px solid #ddd;
+        white-space: pre-wrap;
+        word-wrap: break-word;
+    }
+
+    /* Inline code */
+    code, span.code {
+        font-family: $mono_fonts !important;
+        font-size: 0.9em; /* Hơi nhỏ hơn văn bản thường */
+        background-color: #f0f0f0;
+        padding: 2px 4px;
+        border-radius: 3px;
+    }
+
+    table { width: 100%; border-collapse: collapse; margin: 20px 0; }
+    th, td { border: 1px solid #000; padding: 8px; vertical-align: top; }
+    img { max-width: 100%; height: auto; display: block; margin: 15px auto; }
+
+    .text-danger, .title-danger { color: #FF0000 !important; }
+    .text-center { text-align: center; }
+    .row, .header-container { display: flex; justify-content: space-between; width: 100%; margin-bottom: 25px; }
+""")
+
+
+_PLACEHOLDERS = {"{title}": "string(doc-title)", "{page}": "counter(page)", "{pages}": "counter(pages)"}
+_PLACEHOLDER_RE = re.compile(r"(\{title\}|\{page\}|\{pages\})")
+
+
+def _css_content(text: str) -> str:
+    """
+    Văn bản header/footer -> giá trị thuộc tính content của CSS.
+    {title} là tiêu đề cấp 1 gần nhất (string-set trên h1), {page}/{pages} là số trang/tổng số trang.
+    """
+    return " ".join(
+        _PLACEHOLDERS[part] if part in _PLACEHOLDERS else '"' + part.replace("\\", "\\\\").replace('"', '\\"') + '"'
+        for part in _PLACEHOLDER_RE.split(text) if part
+    )
+
+
+class PageTemplate:
+    def __init__(
+        self,
+        name: str,
+        description: str = "",
+        page_size: str = "A4",
+        margin: str = "2cm 2.5cm",
+        page_number: str = "{page} / {pages}",
+        page_number_position: str = "bottom-right",
+        header: str = None,
+        header_position: str = "top-center",
+        footer: str = None,
+        footer_position: str = "bottom-center",
+        body_fonts: tuple = SERIF_FONTS,
+        mono_fonts: tuple = MONO_FONTS,
+        font_size: str = "13pt"
+    ):
+        """
+        page_number/header/footer là văn bản có thể chứa {page}, {pages}, {title}; *_position là tên
+        ô lề trang của CSS (top-center, bottom-right...). Header/footer None = không có.
+        """
+        self.name = name
+        self.description = description
+        self.page_size = page_size
+        self.margin = margin
+        self.page_number = page_number
+        self.page_number_position = page_number_position
+        self.header = header
+        self.header_position = header_position
+        self.footer = footer
+        self.footer_position = footer_position
+        self.body_fonts = tuple(body_fonts)
+        self.mono_fonts = tuple(mono_fonts)
+        self.font_size = font_size
+
+    def _margin_box(self, position: str, text: str) -> str:
+        return f"""
+            @{position} {{
+                content: {_css_content(text)};
+                font-size: 10pt;
+                font-family: {", ".join(self.body_fonts)};
+                color: #555;
+            }}"""
+
+    def page_css(self, variant: str) -> str:
+        boxes = []
+        if variant != "numbers":
+            if self.header:
+                boxes.append(self._margin_box(self.header_position, self.header))
+            if self.footer:
+                boxes.append(self._margin_box(self.footer_position, self.footer))
+        if variant != "plain":
+            boxes.append(self._margin_box(self.page_number_position, self.page_number))
+        return f"""
+        @page {{
+            size: {self.page_size};
+            margin: {self.margin};{"".join(boxes)}
+        }}
+        """
+
+    def css(self, variant: str) -> str:
+        """Stylesheet đầy đủ của một biến thể (xem VARIANTS)."""
+        if variant == "numbers":
+            return self.page_css(variant)
+        return self.page_css(variant) + COMMON_CSS.substitute(
+            body_fonts=", ".join(self.body_fonts),
+            mono_fonts=", ".join(self.mono_fonts),
+            font_size=self.font_size
+        )
+
+    @property
+    def version(self) -> str:
+        # Đổi CSS thì khóa cache PDF đổi theo, PDF cũ trong cache không bị dùng lại
+        return make_cache_key(self.name, *(self.css(variant) for variant in VARIANTS))[:16]
+
+    def describe(self) -> dict:
+        return {
+            "name": self.name,
+            "description": self.description,
+            "page_size": self.page_size,
+            "margin": self.margin,
+            "page_number": self.page_number,
+            "header": self.header,
+            "footer": self.footer,
+            "body_fonts": list(self.body_fonts),
+            "font_size": self.font_size,
+        }
+
+
+class CompiledTemplate:
+    """Stylesheet WeasyPrint đã phân tích của một mẫu, theo biến thể; chỉ tạo qua TemplateRegistry.compile()."""
+    def __init__(self, template: PageTemplate, font_config):
+        from weasyprint import CSS
+        self.template = template
+        self.font_config = font_config
+        self.version = template.version
+        self.stylesheets = {
+            variant: CSS(string=template.css(variant), font_config=font_config)
+            for variant in VARIANTS
+        }
+
+    def stylesheet(self, show_page_number: bool = True):
+        return self.stylesheets["numbered" if show_page_number else "plain"]
+
+
+_font_config = None
+_font_config_lock = threading.Lock()
+
+
+def font_configuration():
+    """FontConfiguration dùng chung của process (fontconfig quét font hệ thống một lần)."""
+    global _font_config
+    if _font_config is None:
+        with _font_config_lock:
+            if _font_config is None:
+                from weasyprint.text.fonts import FontConfiguration
+                _font_config = FontConfiguration()
+    return _font_config
+
+
+class TemplateRegistry:
+    def __init__(self, default: str = settings.PDF_DEFAULT_TEMPLATE):
+        self.default = default
+        self._templates = {}
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def register(self, template: PageTemplate):
+        with self._lock:
+            self._templates[template.name] = template
+            self._compiled.pop(template.name, None)
+
+    def names(self) -> list:
+        return list(self._templates)
+
+    def get(self, name: str = None) -> PageTemplate:
+        """Mẫu theo tên, None = mẫu mặc định. Tên không tồn tại thì ném ValueError."""
+        template = self._templates.get(name or self.default)
+        if template is None:
+            raise ValueError(f"Mẫu trang không hợp lệ: {name}")
+        return template
+
+    def compile(self, name: str = None) -> CompiledTemplate:
+        """Mẫu đã biên dịch, tạo ở lần dùng đầu tiên trong process rồi dùng lại."""
+        name = name or self.default
+        compiled = self._compiled.get(name)
+        if compiled is None:
+            template = self.get(name)
+            with self._lock:
+                compiled = self._compiled.get(name)
+                if compiled is None:
+                    compiled = self._compiled[name] = CompiledTemplate(template, font_configuration())
+        return compiled
+
+    def list(self) -> list:
+        return [{**template.describe(), "default": name == self.default} for name, template in self._templates.items()]
+
+
+page_templates = TemplateRegistry()
+
+for _template in (
+    PageTemplate("default", "A4, chữ có chân, số trang góc dưới bên phải"),
+    PageTemplate("compact", "A4 lề hẹp, chữ 11pt: nhiều nội dung hơn mỗi trang", margin="1.5cm 1.8cm", font_size="11pt"),
+    PageTemplate("letter", "Khổ US Letter, lề 1 inch", page_size="letter", margin="1in"),
+    PageTemplate("sans", "A4, chữ không chân", body_fonts=SANS_FONTS),
+    PageTemplate(
+        "report",
+        "A4, header là tiêu đề cấp 1 gần nhất, footer 'Trang n / N' ở giữa",
+        margin="2.5cm 2.5cm 2cm",
+        header="{title}",
+        page_number="Trang {page} / {pages}",
+        page_number_position="bottom-center"
+    ),
+):
+    page_templates.register(_template)
@@ -0,0 +1,45 @@
+"""
+Huấn luyện dictionary zstd cho COMPRESSION_DICTIONARY từ nội dung tài liệu đang có trong database.
+
+Dictionary mới chỉ dùng cho bản ghi sau khi đổi COMPRESSION_DICTIONARY; bản đã nén bằng dictionary cũ
+vẫn đọc được miễn là file *.zdict cũ còn nằm cùng thư mục. Không xóa dictionary cũ.
+
+Chạy: python -m app.train_dictionary --output /data/dictionaries/markdown-2.zdict --samples 5000
+"""
+import argparse
+import logging
+import os
+from app.core.database import SessionLocal
+from app.models import Document
+from app.services.compression import train_dictionary
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", required=True, help="File .zdict sẽ ghi ra")
+    parser.add_argument("--samples", type=int, default=5000, help="Số tài liệu mới nhất dùng làm mẫu")
+    parser.add_argument("--size", type=int, default=112 * 1024, help="Kích thước dictionary (byte)")
+    args = parser.parse_args()
+
+    if os.path.exists(args.output):
+        parser.error(f"{args.output} đã tồn tại; dictionary đã dùng để nén không được ghi đè")
+
+    db = SessionLocal()
+    try:
+        rows = db.query(Document.current_content).order_by(Document.updated_at.desc()).limit(args.samples)
+        samples = [row.current_content.encode("utf-8") for row in rows if row.current_content]
+    finally:
+        db.close()
+    logger.info(f"Training dictionary from {len(samples)} documents")
+
+    data = train_dictionary(samples, args.size)
+    with open(args.output, "wb") as f:
+        f.write(data)
+    logger.info(f"Wrote {len(data)} bytes to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
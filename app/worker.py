@@ -0,0 +1,40 @@
+"""
+Worker xử lý job chuyển đổi chạy riêng khỏi API (JOB_WORKER_MODE=external).
+
+Chạy: python -m app.worker
+"""
+import logging
+import signal
+import threading
+from app.core.config import settings
+from app.core.startup import startup
+from app.services.jobs import job_runner
+from app.services.render_executor import render_executor
+
+# Import các router để đăng ký handler cho từng loại job
+import app.api.documents  # noqa: F401
+import app.api.jobs  # noqa: F401
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    if settings.STARTUP_WARM_UP:
+        startup.add("render_workers", render_executor.warm_up, required=False)
+        startup.start()
+    job_runner.start(settings.JOB_WORKERS)
+    logger.info(f"Job worker started with {settings.JOB_WORKERS} threads")
+    stop.wait()
+
+    startup.stop(timeout=5)
+    job_runner.stop()
+    render_executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
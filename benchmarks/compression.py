@@ -0,0 +1,121 @@
+"""
+Đo nén source/nội dung tài liệu (app/services/compression.py) trên tài liệu Markdown của benchmarks.corpus:
+
+- zlib:      codec dự phòng, mức COMPRESSION_LEVEL (tối đa 9)
+- zstd:      không dictionary
+- zstd+dict: dictionary huấn luyện trên một tập tài liệu khác (seed khác) với tập được đo
+
+Với mỗi cấu hình in tỉ lệ nén khi lưu object (frame nhị phân) và khi lưu vào cột text (base64),
+cùng tốc độ nén/giải nén (MB/s theo kích thước gốc). Dictionary có lợi nhất với tài liệu nhỏ,
+nên tài liệu được cắt ngẫu nhiên trong khoảng --min-bytes..--max-bytes.
+Corpus tổng hợp có từ vựng hẹp nên tỉ lệ nén cao hơn tài liệu thật; hãy so sánh các cấu hình với nhau.
+
+Chạy:
+    python -m benchmarks.compression --documents 200 --max-bytes 8192
+    python -m benchmarks.compression --level 3 --max-bytes 65536 --output compression.json
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.corpus import generate
+from app.services.compression import ContentCompressor, train_dictionary
+
+KINDS = ("prose", "formulas", "tables", "nested_lists", "code")
+
+
+def build_documents(count: int, seed: int, min_bytes: int, max_bytes: int) -> list:
+    rng = random.Random(seed)
+    documents = []
+    for index in range(count):
+        text = generate(KINDS[index % len(KINDS)], 1, seed * 100000 + index)
+        length = rng.randint(min_bytes, max_bytes)
+        start = rng.randrange(max(1, len(text) - length))
+        documents.append(text[start:start + length])
+    return documents
+
+
+def bench_codec(compressor: ContentCompressor, documents: list, rounds: int) -> dict:
+    raw = [document.encode("utf-8") for document in documents]
+    raw_bytes = sum(len(data) for data in raw)
+
+    frames = [compressor.compress(data) for data in raw]
+    texts = [compressor.encode_text(document) for document in documents]
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for data in raw:
+            compressor.compress(data)
+    compress_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for frame in frames:
+            compressor.decompress(frame)
+    decompress_seconds = time.perf_counter() - start
+
+    assert all(compressor.decompress(frame) == data for frame, data in zip(frames, raw))
+    assert all(compressor.decode_text(text) == document for text, document in zip(texts, documents))
+
+    object_bytes = sum(len(frame) for frame in frames)
+    column_bytes = sum(len(text.encode("utf-8")) for text in texts)
+    return {
+        "raw_bytes": raw_bytes,
+        "object_bytes": object_bytes,
+        "column_bytes": column_bytes,
+        "object_ratio": raw_bytes / object_bytes,
+        "column_ratio": raw_bytes / column_bytes,
+        "compress_mb_s": raw_bytes * rounds / compress_seconds / 1e6,
+        "decompress_mb_s": raw_bytes * rounds / decompress_seconds / 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=200, help="Số tài liệu được đo")
+    parser.add_argument("--train-documents", type=int, default=500, help="Số tài liệu dùng huấn luyện dictionary")
+    parser.add_argument("--min-bytes", type=int, default=512)
+    parser.add_argument("--max-bytes", type=int, default=8192)
+    parser.add_argument("--level", type=int, default=3)
+    parser.add_argument("--dict-size", type=int, default=112 * 1024)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    documents = build_documents(args.documents, 1, args.min_bytes, args.max_bytes)
+    samples = [document.encode("utf-8") for document in build_documents(args.train_documents, 2, args.min_bytes, args.max_bytes)]
+
+    start = time.perf_counter()
+    dictionary = train_dictionary(samples, args.dict_size)
+    print(f"dictionary {len(dictionary)} bytes trained on {len(samples)} documents in {time.perf_counter() - start:.2f}s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        dictionary_path = os.path.join(directory, "bench.zdict")
+        with open(dictionary_path, "wb") as f:
+            f.write(dictionary)
+        compressors = {
+            "zlib": ContentCompressor("zlib", args.level, 0, ""),
+            "zstd": ContentCompressor("zstd", args.level, 0, ""),
+            "zstd+dict": ContentCompressor("zstd", args.level, 0, dictionary_path),
+        }
+
+        results = {}
+        for name, compressor in compressors.items():
+            result = results[name] = bench_codec(compressor, documents, args.rounds)
+            print(
+                f"{name:<10} object {result['object_ratio']:5.2f}x column {result['column_ratio']:5.2f}x "
+                f"({result['raw_bytes'] / 1024:.0f}KB -> {result['object_bytes'] / 1024:.0f}KB / {result['column_bytes'] / 1024:.0f}KB) "
+                f"compress {result['compress_mb_s']:7.1f}MB/s decompress {result['decompress_mb_s']:7.1f}MB/s"
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
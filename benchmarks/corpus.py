@@ -0,0 +1,164 @@
+"""
+Bộ tài liệu Markdown tổng hợp cho benchmark. Cùng (kind, scale, seed) luôn sinh ra cùng nội dung.
+
+Xem thử: python -m benchmarks.corpus formulas --scale 1 > sample.md
+"""
+import argparse
+import os
+import random
+import struct
+import zlib
+
+WORDS = (
+    "tài liệu hệ thống chuyển đổi markdown pdf phiên bản dữ liệu kết quả báo cáo phân tích "
+    "document system render layout page table formula value section report analysis the of and "
+    "performance latency throughput cache storage version export import process worker"
+).split()
+
+
+def _sentence(rng: random.Random, min_words: int = 8, max_words: int = 20) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words))]
+    words[0] = words[0].capitalize()
+    if rng.random() < 0.2:
+        i = rng.randrange(len(words))
+        words[i] = f"**{words[i]}**"
+    if rng.random() < 0.1:
+        i = rng.randrange(len(words))
+        words[i] = f"`{words[i]}`"
+    return " ".join(words) + "."
+
+
+def _paragraph(rng: random.Random, sentences: int = 5) -> str:
+    return " ".join(_sentence(rng) for _ in range(sentences))
+
+
+def prose(rng: random.Random, scale: int) -> str:
+    parts = []
+    for chapter in range(1, 6 * scale + 1):
+        parts.append(f"# Chapter {chapter}\n")
+        for section in range(1, 4):
+            parts.append(f"## Section {chapter}.{section}\n")
+            parts.extend(_paragraph(rng, rng.randint(4, 8)) + "\n" for _ in range(4))
+            if rng.random() < 0.3:
+                parts.append("> " + _sentence(rng) + "\n")
+    return "\n".join(parts)
+
+
+def formulas(rng: random.Random, scale: int) -> str:
+    parts = ["# Formula-dense document\n"]
+    for i in range(60 * scale):
+        a, b, c = rng.randint(1, 99), rng.randint(1, 99), rng.randint(2, 9)
+        if i % 4 == 0:
+            parts.append(f"$$\\int_0^{{{a}}} x^{{{c}}}\\,dx = \\frac{{{a}^{{{c + 1}}}}}{{{c + 1}}} + \\sum_{{k=1}}^{{{b}}} \\frac{{1}}{{k^{{{c}}}}}$$\n")
+        else:
+            parts.append(f"{_sentence(rng, 4, 10)} Khi $\\alpha_{{{i}}} = \\sqrt{{{a}}} + \\beta^{{{c}}}$ thì $x_{{{b}}} \\leq {a * b}$.\n")
+    return "\n".join(parts)
+
+
+def tables(rng: random.Random, scale: int) -> str:
+    parts = ["# Table-heavy document\n"]
+    for t in range(8 * scale):
+        columns = rng.randint(4, 8)
+        parts.append(f"## Table {t + 1}\n")
+        parts.append("| " + " | ".join(f"Column {c + 1}" for c in range(columns)) + " |")
+        parts.append("|" + "---|" * columns)
+        for _ in range(rng.randint(15, 30)):
+            cells = [str(rng.randint(0, 10 ** 6)) if rng.random() < 0.6 else rng.choice(WORDS) for _ in range(columns)]
+            parts.append("| " + " | ".join(cells) + " |")
+        parts.append("")
+    return "\n".join(parts)
+
+
+def nested_lists(rng: random.Random, scale: int) -> str:
+    parts = ["# Nested lists\n"]
+
+    def emit(depth: int, max_depth: int):
+        for i in range(rng.randint(2, 4)):
+            marker = "-" if depth % 2 == 0 else f"{i + 1}."
+            parts.append("    " * depth + f"{marker} {_sentence(rng, 4, 12)}")
+            if depth < max_depth and rng.random() < 0.6:
+                emit(depth + 1, max_depth)
+
+    for block in range(12 * scale):
+        parts.append(f"## List {block + 1}\n")
+        emit(0, 5)
+        parts.append("")
+    return "\n".join(parts)
+
+
+def code(rng: random.Random, scale: int) -> str:
+    parts = ["# Code-heavy document\n"]
+    for block in range(20 * scale):
+        parts.append(_paragraph(rng, 2) + "\n")
+        parts.append("```python")
+        for line in range(rng.randint(15, 40)):
+            indent = "    " * rng.randint(0, 3)
+            parts.append(f"{indent}value_{line} = compute({rng.choice(WORDS)!r}, {rng.randint(0, 999)})  # {rng.choice(WORDS)}")
+        parts.append("```\n")
+    return "\n".join(parts)
+
+
+def write_png(path: str, width: int, height: int, seed: int):
+    """Ghi một ảnh PNG RGB đơn giản (dải màu theo seed), không cần Pillow."""
+    rng = random.Random(seed)
+    r, g, b = rng.randrange(256), rng.randrange(256), rng.randrange(256)
+    # Mỗi dòng: byte filter 0 + width pixel RGB
+    rows = b"".join(
+        b"\x00" + b"".join(bytes(((r + x) % 256, (g + y) % 256, b)) for x in range(width))
+        for y in range(height)
+    )
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(rows, 6)))
+        f.write(chunk(b"IEND", b""))
+
+
+def images(rng: random.Random, scale: int, asset_dir: str = None) -> str:
+    """Nhiều ảnh cục bộ; ảnh được ghi vào asset_dir và tham chiếu bằng đường dẫn file:// tuyệt đối."""
+    if asset_dir is None:
+        raise ValueError("images corpus cần asset_dir để ghi file ảnh")
+    os.makedirs(asset_dir, exist_ok=True)
+    parts = ["# Many local images\n"]
+    for i in range(40 * scale):
+        path = os.path.join(asset_dir, f"image_{i}.png")
+        width, height = rng.randint(80, 320), rng.randint(60, 240)
+        if not os.path.exists(path):
+            write_png(path, width, height, seed=i)
+        parts.append(f"{_sentence(rng)}\n\n![Figure {i + 1}](file://{os.path.abspath(path)})\n")
+    return "\n".join(parts)
+
+
+KINDS = {
+    "prose": prose,
+    "formulas": formulas,
+    "tables": tables,
+    "nested_lists": nested_lists,
+    "code": code,
+    "images": images,
+}
+
+
+def generate(kind: str, scale: int = 1, seed: int = 0, asset_dir: str = None) -> str:
+    rng = random.Random(f"{kind}:{scale}:{seed}")
+    if kind == "images":
+        return images(rng, scale, asset_dir=asset_dir)
+    return KINDS[kind](rng, scale)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=sorted(KINDS))
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--asset-dir", default="benchmark_assets")
+    args = parser.parse_args()
+    print(generate(args.kind, args.scale, args.seed, asset_dir=args.asset_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+So sánh thời gian convert_to_html giữa render công thức tuần tự và render song song
+(pre-pass trên process pool) với tài liệu dày đặc công thức.
+
+Chạy: python -m benchmarks.math_prerender --formulas 400 --workers 4
+"""
+import argparse
+import os
+import time
+
+from app.services.converter import MarkdownConverter, formula_cache
+
+
+def build_document(formulas: int) -> str:
+    # Mỗi công thức khác nhau để không có cache hit bên trong cùng một tài liệu
+    lines = ["# Formula-dense document", ""]
+    for i in range(formulas):
+        if i % 5 == 0:
+            lines.append(f"$$\\sum_{{k=0}}^{{{i}}} \\frac{{k^{{2}}}}{{{i + 1}}} = \\int_0^{{{i}}} x\\,dx$$")
+        else:
+            lines.append(f"Step {i}: $a_{{{i}}} = \\sqrt{{{i}}} + \\alpha^{{{i % 7}}}$ holds.")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def run(converter: MarkdownConverter, content: str, backend: str, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        # Xóa cache bộ nhớ để mỗi lượt đều phải render lại từ đầu
+        formula_cache.memory.clear()
+        start = time.perf_counter()
+        converter.convert_to_html(content, math_backend=backend)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--formulas", type=int, default=400)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--backend", default="png", choices=["png", "svg"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if formula_cache.secondary is not None:
+        parser.error("Hãy bỏ MATH_CACHE_DIR khi chạy benchmark để tránh trúng cache trên đĩa.")
+
+    content = build_document(args.formulas)
+
+    serial = MarkdownConverter(math_render_workers=0)
+    parallel = MarkdownConverter(math_render_workers=args.workers)
+    try:
+        # Làm nóng: import matplotlib ở process cha và khởi động các process con
+        run(serial, "$x$", args.backend, 1)
+        run(parallel, build_document(args.workers * 8), args.backend, 1)
+
+        serial_time = run(serial, content, args.backend, args.repeat)
+        parallel_time = run(parallel, content, args.backend, args.repeat)
+    finally:
+        parallel.close()
+
+    print(f"backend={args.backend} formulas={args.formulas} workers={args.workers}")
+    print(f"serial:   {serial_time:.3f}s")
+    print(f"parallel: {parallel_time:.3f}s")
+    print(f"speedup:  {serial_time / parallel_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
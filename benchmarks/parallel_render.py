@@ -0,0 +1,69 @@
+"""
+So sánh thời gian render PDF một tài liệu lớn: một process (một lượt layout) và chế độ tài liệu lớn
+(cắt HTML tại ngắt trang, layout song song trên N process, ghép và đánh số trang lại) với số process tăng dần.
+
+Chạy: PDF_CACHE_MAX_BYTES=0 python -m benchmarks.parallel_render --sections 200 --workers 1,2,4,8
+"""
+import argparse
+import os
+import time
+
+from app.core.config import settings
+from app.services.pdf_generator import PDFGenerator
+
+
+def build_document(sections: int) -> str:
+    # Văn bản, bảng và danh sách để layout có khối lượng giống tài liệu thật.
+    # Mỗi phần bắt đầu ở trang mới: chế độ tài liệu lớn chỉ cắt tại ngắt trang tường minh.
+    parts = []
+    for i in range(sections):
+        parts.append(f'<h2 style="break-before: page">Section {i + 1}</h2>')
+        for j in range(4):
+            parts.append(f"<p>Paragraph {j} of section {i + 1}. " + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 12 + "</p>")
+        rows = "".join(f"<tr><td>{i}.{r}</td><td>value {r * i}</td><td>note {r}</td></tr>" for r in range(10))
+        parts.append(f"<table><tr><th>Id</th><th>Value</th><th>Note</th></tr>{rows}</table>")
+        parts.append("<ul>" + "".join(f"<li>Item {k} of section {i + 1}</li>" for k in range(6)) + "</ul>")
+    return "\n".join(parts)
+
+
+def run(generator: PDFGenerator, html: str, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        generator.generate_pdf(html)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sections", type=int, default=200)
+    parser.add_argument("--workers", default=",".join(str(n) for n in (2, 4, 8) if n <= (os.cpu_count() or 1)) or "2")
+    parser.add_argument("--repeat", type=int, default=2)
+    args = parser.parse_args()
+
+    if settings.PDF_CACHE_MAX_BYTES:
+        parser.error("Hãy đặt PDF_CACHE_MAX_BYTES=0 khi chạy benchmark để mọi lượt đều render lại.")
+
+    html = build_document(args.sections)
+    print(f"sections={args.sections} html={len(html)} chars cpus={os.cpu_count()}")
+
+    single = PDFGenerator(parallel_workers=0)
+    run(single, "<p>warm-up</p>", 1)
+    single_time = run(single, html, args.repeat)
+    print(f"single process: {single_time:.3f}s")
+
+    for workers in (int(n) for n in args.workers.split(",")):
+        generator = PDFGenerator(parallel_workers=workers, parallel_min_chars=0)
+        try:
+            # Làm nóng: khởi động các process con trước khi đo
+            run(generator, build_document(workers * 2), 1)
+            elapsed = run(generator, html, args.repeat)
+        finally:
+            generator.close()
+        print(f"workers={workers:<3} {elapsed:.3f}s  speedup {single_time / elapsed:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
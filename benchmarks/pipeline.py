@@ -0,0 +1,206 @@
+"""
+Benchmark từng bước của pipeline: convert_to_html, clean_html, generate_pdf, merge_with_footer
+trên bộ tài liệu tổng hợp (benchmarks/corpus.py). Không cần Postgres, MinIO hay mạng.
+
+Mỗi loại tài liệu chạy trong một process riêng để peak RSS đo được là của riêng tài liệu đó.
+Cache công thức và cache PDF bị tắt để mọi lượt đều đo đúng chi phí render.
+
+Chạy:
+    python -m benchmarks.pipeline --iterations 5 --output bench.json
+    python -m benchmarks.pipeline --save-baseline                      # ghi benchmarks/baseline.json
+    python -m benchmarks.pipeline --compare benchmarks/baseline.json   # exit 1 nếu chậm hơn ngưỡng
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.corpus import KINDS, generate
+
+STAGES = ["convert_to_html", "clean_html", "generate_pdf", "merge_with_footer"]
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+ASSET_DIR = os.path.join(tempfile.gettempdir(), "mdpdf_bench_assets")
+
+
+def percentile(values: list, q: float) -> float:
+    """Percentile nội suy tuyến tính (giống numpy 'linear'), values không rỗng."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(samples: list) -> dict:
+    return {
+        "p50": percentile(samples, 0.50),
+        "p90": percentile(samples, 0.90),
+        "p99": percentile(samples, 0.99),
+        "max": max(samples),
+        "mean": sum(samples) / len(samples),
+    }
+
+
+def peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def bench_document(kind: str, scale: int, seed: int, iterations: int, stages: list) -> dict:
+    """Chạy trong process con: đo từng bước cho một loại tài liệu."""
+    # Tắt cache trước khi import service (settings đọc biến môi trường lúc import)
+    os.environ["PDF_CACHE_MAX_BYTES"] = "0"
+    os.environ["MATH_CACHE_DIR"] = ""
+    os.environ["HTTP_CACHE_DIR"] = ""
+    from app.services.converter import MarkdownConverter, formula_cache
+
+    converter = MarkdownConverter()
+    content = generate(kind, scale, seed, asset_dir=ASSET_DIR)
+    timings = {stage: [] for stage in stages}
+    sizes = {"markdown_bytes": len(content.encode("utf-8"))}
+
+    pdf_service = None
+    footer_pdf = None
+    if any(stage != "convert_to_html" for stage in stages):
+        from app.services.pdf_generator import PDFGenerator
+        pdf_service = PDFGenerator(parallel_workers=0)
+        if "merge_with_footer" in stages:
+            footer_pdf = pdf_service.generate_pdf("<p style='margin-top: 20cm'>Footer</p>", show_page_number=False)
+
+    try:
+        for _ in range(iterations):
+            formula_cache.memory.clear()
+            start = time.perf_counter()
+            html_content = converter.convert_to_html(content)
+            if "convert_to_html" in timings:
+                timings["convert_to_html"].append(time.perf_counter() - start)
+            sizes["html_bytes"] = len(html_content.encode("utf-8"))
+
+            if "clean_html" in timings:
+                start = time.perf_counter()
+                pdf_service.clean_html(html_content)
+                timings["clean_html"].append(time.perf_counter() - start)
+
+            if "generate_pdf" in timings or "merge_with_footer" in timings:
+                start = time.perf_counter()
+                pdf_bytes = pdf_service.generate_pdf(html_content)
+                if "generate_pdf" in timings:
+                    timings["generate_pdf"].append(time.perf_counter() - start)
+                sizes["pdf_bytes"] = len(pdf_bytes)
+
+                if "merge_with_footer" in timings:
+                    start = time.perf_counter()
+                    merged = pdf_service.merge_with_footer(pdf_bytes, footer_pdf)
+                    timings["merge_with_footer"].append(time.perf_counter() - start)
+                    sizes["merged_pdf_bytes"] = len(merged)
+    finally:
+        converter.close()
+
+    return {
+        "stages": {stage: summarize(samples) for stage, samples in timings.items()},
+        "peak_rss_bytes": peak_rss_bytes(),
+        "sizes": sizes,
+    }
+
+
+def run_suite(kinds: list, scale: int, seed: int, iterations: int, stages: list) -> dict:
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for kind in kinds:
+        # Mỗi tài liệu một process mới: peak RSS không bị cộng dồn từ tài liệu trước
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[kind] = pool.submit(bench_document, kind, scale, seed, iterations, stages).result()
+        print(format_result(kind, results[kind]), flush=True)
+    return {
+        "meta": {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "scale": scale,
+            "seed": seed,
+            "iterations": iterations,
+        },
+        "documents": results,
+    }
+
+
+def format_result(kind: str, result: dict) -> str:
+    lines = [f"{kind}: peak_rss={result['peak_rss_bytes'] / 2 ** 20:.1f}MB sizes={result['sizes']}"]
+    for stage, stats in result["stages"].items():
+        lines.append(
+            f"  {stage:<18} p50={stats['p50'] * 1000:9.2f}ms p90={stats['p90'] * 1000:9.2f}ms "
+            f"p99={stats['p99'] * 1000:9.2f}ms max={stats['max'] * 1000:9.2f}ms"
+        )
+    return "\n".join(lines)
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Các bước có p50 chậm hơn baseline quá threshold (tỷ lệ, ví dụ 0.1 = 10%)."""
+    regressions = []
+    for kind, result in current["documents"].items():
+        base = baseline.get("documents", {}).get(kind)
+        if base is None:
+            continue
+        for stage, stats in result["stages"].items():
+            base_stats = base["stages"].get(stage)
+            if not base_stats or not base_stats["p50"]:
+                continue
+            ratio = stats["p50"] / base_stats["p50"]
+            marker = "REGRESSION" if ratio > 1 + threshold else ""
+            print(f"{kind:<13} {stage:<18} {base_stats['p50'] * 1000:9.2f}ms -> {stats['p50'] * 1000:9.2f}ms ({ratio:5.2f}x) {marker}")
+            if marker:
+                regressions.append((kind, stage, ratio))
+        base_rss = base.get("peak_rss_bytes")
+        if base_rss and result["peak_rss_bytes"] > base_rss * (1 + threshold):
+            print(f"{kind:<13} peak_rss           {base_rss / 2 ** 20:.1f}MB -> {result['peak_rss_bytes'] / 2 ** 20:.1f}MB REGRESSION")
+            regressions.append((kind, "peak_rss", result["peak_rss_bytes"] / base_rss))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kinds", default=",".join(KINDS), help="Các loại tài liệu, phân tách bằng dấu phẩy")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Các bước cần đo, phân tách bằng dấu phẩy")
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Ghi kết quả làm baseline ({BASELINE_PATH})")
+    parser.add_argument("--compare", metavar="BASELINE", help="So sánh với file baseline JSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Ngưỡng chậm hơn baseline bị coi là regression")
+    args = parser.parse_args()
+
+    kinds = [kind for kind in args.kinds.split(",") if kind]
+    stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = [k for k in kinds if k not in KINDS] + [s for s in stages if s not in STAGES]
+    if unknown:
+        parser.error(f"Không hỗ trợ: {', '.join(unknown)}")
+
+    results = run_suite(kinds, args.scale, args.seed, args.iterations, stages)
+
+    for path in filter(None, [args.output, BASELINE_PATH if args.save_baseline else None]):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("scale") != args.scale or baseline["meta"].get("seed") != args.seed:
+            print("Warning: baseline was recorded with a different scale/seed")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) above {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
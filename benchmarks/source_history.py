@@ -0,0 +1,178 @@
+"""
+Đo chế độ lưu source dạng delta (app/services/source_history.py) trên lịch sử dài của một tài liệu:
+mỗi version là một sửa nhỏ (thay/chèn/xóa vài dòng) trên tài liệu văn bản sinh từ benchmarks.corpus.
+
+Với mỗi khoảng keyframe:
+- dung lượng lưu so với lưu đầy đủ mọi version (interval 1 = chế độ 'full')
+- thời gian tạo delta khi lưu version mới
+- thời gian dựng lại một version: cold (không cache, tải keyframe + toàn bộ delta của chuỗi),
+  neighbor (version ngay trước đã trong cache, chỉ áp một delta) và warm (version đã trong cache)
+
+Object được giữ trong bộ nhớ; --fetch-latency-ms mô phỏng độ trễ mỗi lần đọc MinIO
+(các delta của một chuỗi được tải song song như trong SourceHistory).
+
+Chạy:
+    python -m benchmarks.source_history --versions 500 --intervals 1,10,20,50,100
+    python -m benchmarks.source_history --scale 4 --fetch-latency-ms 5 --output history.json
+"""
+import argparse
+import json
+import random
+import time
+from types import SimpleNamespace
+
+from benchmarks.corpus import generate
+from benchmarks.pipeline import summarize
+from app.services.source_history import SourceHistory, make_delta, source_digest
+
+
+class MemoryStorage:
+    def __init__(self, latency: float = 0.0):
+        self.objects = {}
+        self.latency = latency
+
+    def get_file_content(self, object_name: str):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.objects.get(object_name)
+
+
+def build_history(base: str, versions: int, seed: int) -> list:
+    """versions bản source, mỗi bản khác bản trước ở một vài dòng."""
+    rng = random.Random(seed)
+    lines = base.splitlines(keepends=True)
+    history = [base.encode("utf-8")]
+    for number in range(2, versions + 1):
+        index = rng.randrange(len(lines))
+        action = rng.random()
+        if action < 0.6:
+            words = lines[index].split(" ")
+            words[rng.randrange(len(words))] = f"edit{number}"
+            lines[index] = " ".join(words)
+        elif action < 0.85 or len(lines) < 10:
+            lines.insert(index, f"Đoạn văn thêm ở version {number}.\n\n")
+        else:
+            del lines[index]
+        history.append("".join(lines).encode("utf-8"))
+    return history
+
+
+def store_history(history: list, interval: int, storage: MemoryStorage) -> tuple:
+    """Lưu lịch sử như SourceHistory.store: keyframe mỗi interval version, còn lại là delta so với version trước."""
+    rows = []
+    delta_seconds = []
+    chain_start = None
+    for number, source in enumerate(history, start=1):
+        keyframe = None
+        if chain_start is not None and number - chain_start < interval:
+            start = time.perf_counter()
+            delta = make_delta(history[number - 2], source)
+            delta_seconds.append(time.perf_counter() - start)
+            if len(delta) < len(source):
+                keyframe = chain_start
+        if keyframe is None:
+            chain_start = number
+            data = source
+        else:
+            data = delta
+        name = f"v{number}"
+        storage.objects[name] = data
+        rows.append(SimpleNamespace(
+            version_number=number, source_path=name, source_keyframe=keyframe, source_hash=source_digest(source)
+        ))
+    return rows, delta_seconds
+
+
+def chain_of(rows: list, row) -> list:
+    start = row.source_keyframe or row.version_number
+    return rows[start - 1:row.version_number]
+
+
+def bench_interval(history: list, interval: int, latency: float, samples: int, seed: int) -> dict:
+    storage = MemoryStorage(latency)
+    rows, delta_seconds = store_history(history, interval, storage)
+    full_bytes = sum(len(source) for source in history)
+    stored_bytes = sum(len(data) for data in storage.objects.values())
+    result = {
+        "stored_bytes": stored_bytes,
+        "full_bytes": full_bytes,
+        "ratio": stored_bytes / full_bytes,
+        "keyframes": sum(1 for row in rows if row.source_keyframe is None),
+    }
+    if delta_seconds:
+        result["make_delta"] = summarize(delta_seconds)
+
+    deltas = [row for row in rows if row.source_keyframe is not None]
+    if not deltas:
+        return result
+    # Luôn đo version sâu nhất (cuối chuỗi đầu tiên) cùng một mẫu ngẫu nhiên
+    rng = random.Random(seed)
+    deepest = max(deltas, key=lambda row: row.version_number - row.source_keyframe)
+    targets = [deepest] + rng.sample(deltas, min(samples, len(deltas)) - 1)
+
+    blobs = SimpleNamespace(storage=storage)
+    cold, neighbor, warm = [], [], []
+    for row in targets:
+        chain = chain_of(rows, row)
+        history_cold = SourceHistory(blobs=blobs, cache_max_bytes=0, mode="delta")
+        start = time.perf_counter()
+        assert history_cold.reconstruct(chain) == history[row.version_number - 1]
+        cold.append(time.perf_counter() - start)
+
+        cached = SourceHistory(blobs=blobs, cache_max_bytes=256 * 1024 * 1024, mode="delta")
+        cached.cache.set(chain[-2].source_hash, history[row.version_number - 2])
+        start = time.perf_counter()
+        cached.reconstruct(chain)
+        neighbor.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        cached.reconstruct(chain)
+        warm.append(time.perf_counter() - start)
+
+    result.update({
+        "max_depth": deepest.version_number - deepest.source_keyframe,
+        "reconstruct_cold": summarize(cold),
+        "reconstruct_neighbor": summarize(neighbor),
+        "reconstruct_warm": summarize(warm),
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--versions", type=int, default=500)
+    parser.add_argument("--intervals", default="1,10,20,50,100", help="Các SOURCE_KEYFRAME_INTERVAL cần đo")
+    parser.add_argument("--scale", type=int, default=2, help="Độ lớn tài liệu (benchmarks.corpus, loại prose)")
+    parser.add_argument("--samples", type=int, default=20, help="Số version được dựng lại cho mỗi khoảng keyframe")
+    parser.add_argument("--fetch-latency-ms", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    history = build_history(generate("prose", args.scale, args.seed), args.versions, args.seed)
+    print(f"{args.versions} versions, source ~{len(history[-1]) / 1024:.1f}KB, fetch latency {args.fetch_latency_ms}ms")
+
+    results = {}
+    for interval in (int(value) for value in args.intervals.split(",")):
+        result = results[interval] = bench_interval(
+            history, interval, args.fetch_latency_ms / 1000, args.samples, args.seed
+        )
+        line = f"interval={interval:<4} stored={result['stored_bytes'] / 1024:10.1f}KB ({result['ratio'] * 100:5.1f}% of full)"
+        if "make_delta" in result:
+            line += f" make_delta p50={result['make_delta']['p50'] * 1000:6.2f}ms"
+        if "reconstruct_cold" in result:
+            line += (
+                f" depth<={result['max_depth']:<3}"
+                f" cold p50={result['reconstruct_cold']['p50'] * 1000:7.2f}ms max={result['reconstruct_cold']['max'] * 1000:7.2f}ms"
+                f" neighbor p50={result['reconstruct_neighbor']['p50'] * 1000:6.2f}ms"
+                f" warm p50={result['reconstruct_warm']['p50'] * 1000:6.3f}ms"
+            )
+        print(line)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
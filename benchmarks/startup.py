@@ -0,0 +1,112 @@
+"""
+Đo chi phí khởi động: thời gian import app.main và thời gian tới PDF đầu tiên của một process mới,
+khi không warm-up (process render spawn và nạp WeasyPrint/font/CSS ngay trong request đầu)
+và sau warm-up (RenderExecutor.warm_up, việc bước khởi động 'render_workers' làm khi API chạy).
+
+Mỗi lượt đo chạy trong một process Python mới để không dùng lại module đã import.
+Import app.main không cần Postgres hay MinIO; phần PDF cần WeasyPrint.
+
+Chạy:
+    python -m benchmarks.startup --iterations 5
+    python -m benchmarks.startup --skip-pdf --importtime     # chỉ đo import, in các module import chậm nhất
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks.pipeline import summarize
+
+SAMPLE_MARKDOWN = "# Startup\n\nMột đoạn văn **ngắn** với danh sách:\n\n- một\n- hai\n\n| a | b |\n|---|---|\n| 1 | 2 |\n"
+
+IMPORT_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import app.main
+print(json.dumps({"import_seconds": time.perf_counter() - start}))
+"""
+
+FIRST_PDF_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from app.services.render_executor import render_document_job, render_executor
+result = {"import_seconds": time.perf_counter() - start}
+if sys.argv[1] == "warm":
+    start = time.perf_counter()
+    render_executor.warm_up()
+    result["warm_up_seconds"] = time.perf_counter() - start
+start = time.perf_counter()
+render_executor.run_sync(render_document_job, sys.argv[2])
+result["first_pdf_seconds"] = time.perf_counter() - start
+render_executor.shutdown()
+print(json.dumps(result))
+"""
+
+
+def run_script(script: str, *args, extra_env: dict = None) -> dict:
+    env = dict(os.environ, **(extra_env or {}))
+    # Không dùng cache PDF để PDF đầu tiên thật sự được render
+    env.update({"PDF_CACHE_MAX_BYTES": "0", "PDF_CACHE_BACKEND": "none"})
+    output = subprocess.run(
+        [sys.executable, "-c", script, *args],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(module: str, limit: int) -> list:
+    """Các module có thời gian import cộng dồn lớn nhất, theo `python -X importtime`."""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        check=True,
+        capture_output=True,
+        text=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        rows.append((int(parts[1]), parts[2].rstrip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--skip-pdf", action="store_true", help="Chỉ đo import, không render PDF")
+    parser.add_argument("--importtime", action="store_true", help="In các module import chậm nhất của app.main")
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    results = {}
+    samples = [run_script(IMPORT_SCRIPT)["import_seconds"] for _ in range(args.iterations)]
+    results["import_app_main"] = summarize(samples)
+    print(f"import app.main      p50={results['import_app_main']['p50'] * 1000:9.2f}ms max={results['import_app_main']['max'] * 1000:9.2f}ms")
+
+    if args.importtime:
+        for cumulative, module in slowest_imports("app.main", 15):
+            print(f"  {cumulative / 1000:9.2f}ms {module}")
+
+    if not args.skip_pdf:
+        for mode in ("cold", "warm"):
+            runs = [run_script(FIRST_PDF_SCRIPT, mode, SAMPLE_MARKDOWN) for _ in range(args.iterations)]
+            results[f"first_pdf_{mode}"] = {
+                key: summarize([run[key] for run in runs]) for key in runs[0]
+            }
+            line = " ".join(f"{key}={stats['p50'] * 1000:.2f}ms" for key, stats in results[f"first_pdf_{mode}"].items())
+            print(f"first PDF ({mode:<4})    p50: {line}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
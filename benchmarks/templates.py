@@ -0,0 +1,87 @@
+"""
+Đo chi phí mẫu trang trên mỗi lần render với tài liệu nhỏ, nơi phần cố định chiếm phần lớn thời gian:
+
+- per_render: mỗi lần render tạo FontConfiguration mới và phân tích lại CSS của mẫu (cách làm trước khi có registry)
+- compiled:   dùng stylesheet/FontConfiguration đã biên dịch sẵn của page_templates (cách PDFGenerator làm)
+
+In riêng thời gian chuẩn bị stylesheet (setup) và tổng thời gian tới PDF, theo từng mẫu.
+Cần WeasyPrint (không cần Postgres hay MinIO).
+
+Chạy:
+    python -m benchmarks.templates --iterations 20
+    python -m benchmarks.templates --templates default report --output templates.json
+"""
+import argparse
+import json
+import time
+
+from benchmarks.pipeline import summarize
+from app.services.templates import page_templates
+
+SAMPLE_MARKDOWN = (
+    "# Báo cáo ngắn\n\nMột đoạn văn **ngắn** có `code` và danh sách:\n\n- một\n- hai\n\n"
+    "| a | b |\n|---|---|\n| 1 | 2 |\n\n## Mục 2\n\nĐoạn văn thứ hai.\n"
+)
+
+
+def render_per_render(html_content: str, name: str) -> tuple:
+    from weasyprint import CSS, HTML
+    from weasyprint.text.fonts import FontConfiguration
+    start = time.perf_counter()
+    font_config = FontConfiguration()
+    stylesheet = CSS(string=page_templates.get(name).css("numbered"), font_config=font_config)
+    setup = time.perf_counter() - start
+    HTML(string=html_content).write_pdf(stylesheets=[stylesheet], font_config=font_config)
+    return setup, time.perf_counter() - start
+
+
+def render_compiled(html_content: str, name: str) -> tuple:
+    from weasyprint import HTML
+    start = time.perf_counter()
+    compiled = page_templates.compile(name)
+    stylesheet = compiled.stylesheet(True)
+    setup = time.perf_counter() - start
+    HTML(string=html_content).write_pdf(stylesheets=[stylesheet], font_config=compiled.font_config)
+    return setup, time.perf_counter() - start
+
+
+def bench_template(html_content: str, name: str, iterations: int) -> dict:
+    result = {}
+    for label, fn in (("per_render", render_per_render), ("compiled", render_compiled)):
+        # Lượt đầu nạp font/biên dịch mẫu, không tính
+        fn(html_content, name)
+        runs = [fn(html_content, name) for _ in range(iterations)]
+        result[label] = {
+            "setup": summarize([setup for setup, _ in runs]),
+            "total": summarize([total for _, total in runs]),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--templates", nargs="+", default=page_templates.names(), choices=page_templates.names())
+    parser.add_argument("--output", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args()
+
+    from app.services.converter import converter_service
+    html_content = converter_service.convert_to_html(SAMPLE_MARKDOWN)
+
+    results = {}
+    for name in args.templates:
+        results[name] = bench_template(html_content, name, args.iterations)
+        for label, stats in results[name].items():
+            print(
+                f"{name:<8} {label:<10} setup p50={stats['setup']['p50'] * 1000:8.2f}ms "
+                f"total p50={stats['total']['p50'] * 1000:8.2f}ms p90={stats['total']['p90'] * 1000:8.2f}ms"
+            )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
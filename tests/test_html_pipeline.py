@@ -0,0 +1,51 @@
+"""
+HTMLPipeline (app/services/html_pipeline.py): gỡ <p> đơn trong <li> (UnwrapListParagraphs) và chuẩn hóa <img>.
+"""
+import pytest
+
+from app.services.html_pipeline import HTMLPipeline, NormalizeImages, UnwrapListParagraphs
+
+
+@pytest.fixture
+def pipeline():
+    return HTMLPipeline([UnwrapListParagraphs, NormalizeImages])
+
+
+@pytest.mark.parametrize("html, expected", [
+    ("<ul><li><p>a</p></li></ul>", "<ul><li>a</li></ul>"),
+    ("<ul><li>\n  <p>a</p>\n</li></ul>", "<ul><li>\n  a\n</li></ul>"),
+    ('<ol><li class="x"><p>a <em>b</em></p></li></ol>', '<ol><li class="x">a <em>b</em></li></ol>'),
+    # Danh sách lồng nhau sau đoạn văn không ngăn việc gỡ <p>
+    ("<ul><li><p>a</p><ul><li><p>b</p></li></ul></li></ul>", "<ul><li>a<ul><li>b</li></ul></li></ul>"),
+])
+def test_unwraps_single_paragraph(pipeline, html, expected):
+    assert pipeline.run(html) == expected
+
+
+@pytest.mark.parametrize("html", [
+    "<ul><li><p>a</p><p>b</p></li></ul>",
+    '<ul><li><p class="note">a</p></li></ul>',
+    "<ul><li><p>a</li></ul>",
+    # Văn bản hoặc phần tử nằm cạnh <p>: gỡ đi thì chữ dính vào nhau
+    "<ul><li><p>a</p>tail text</li></ul>",
+    "<ul><li>lead<p>a</p></li></ul>",
+    "<ul><li><strong>b</strong><p>a</p></li></ul>",
+    "<ul><li><p>a</p><img src=\"x.png\"></li></ul>",
+])
+def test_keeps_paragraph_with_other_content(pipeline, html):
+    assert pipeline.run(html) == html
+
+
+def test_mixed_item_does_not_affect_siblings(pipeline):
+    html = "<ul><li><p>a</p>tail</li><li><p>b</p></li></ul>"
+    assert pipeline.run(html) == "<ul><li><p>a</p>tail</li><li>b</li></ul>"
+
+
+def test_normalizes_images(pipeline):
+    html = '<p><img src=" a b.png " width="300px" loading="lazy"></p>'
+    assert pipeline.run(html) == '<p><img src="a%20b.png" width="300"></p>'
+
+
+def test_html_without_trigger_tags_is_returned_as_is(pipeline):
+    html = "<p>plain <b>text</b></p>"
+    assert pipeline.run(html) is html
@@ -0,0 +1,212 @@
+"""
+CachedHTTPFetcher chạy với một http.server cục bộ (cổng ngẫu nhiên): revalidate theo ETag/Last-Modified,
+Cache-Control, giới hạn dung lượng cache (LRU), giới hạn request đồng thời mỗi host và HTTP_FETCH_MAX_BYTES.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from app.services.cache import make_cache_key
+from app.services.http_fetcher import CachedHTTPFetcher, ResourceTooLarge
+
+ETAG = '"v1"'
+LAST_MODIFIED = "Mon, 01 Jan 2024 00:00:00 GMT"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b"", headers: dict = None, content_length: bool = True):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if content_length:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        with server.lock:
+            server.requests.append((parts.path, dict(self.headers)))
+
+        if parts.path == "/etag":
+            if self.headers.get("If-None-Match") == ETAG:
+                self._send(304, headers={"ETag": ETAG, "Cache-Control": "max-age=0"})
+            else:
+                self._send(200, b"etag body", {"ETag": ETAG, "Cache-Control": "max-age=0", "Content-Type": "image/png"})
+        elif parts.path == "/last-modified":
+            if self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+                self._send(304, headers={"Cache-Control": "no-cache"})
+            else:
+                self._send(200, b"lm body", {"Last-Modified": LAST_MODIFIED, "Cache-Control": "no-cache"})
+        elif parts.path == "/max-age":
+            self._send(200, b"fresh body", {"Cache-Control": "max-age=60"})
+        elif parts.path == "/no-store":
+            self._send(200, b"secret", {"Cache-Control": "no-store"})
+        elif parts.path == "/blob":
+            size = int(query["size"][0])
+            self._send(200, b"x" * size, {"Cache-Control": "max-age=60"})
+        elif parts.path == "/slow":
+            with server.lock:
+                server.active += 1
+                server.max_active = max(server.max_active, server.active)
+            try:
+                time.sleep(0.2)
+                self._send(200, b"slow")
+            finally:
+                with server.lock:
+                    server.active -= 1
+        elif parts.path == "/large":
+            size = int(query["size"][0])
+            # chunked=1: không gửi Content-Length, fetcher phải tự đếm khi đọc
+            chunked = query.get("chunked") == ["1"]
+            self._send(200, b"y" * size, content_length=not chunked)
+        else:
+            self._send(404, b"not found")
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.requests = []
+    httpd.active = 0
+    httpd.max_active = 0
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    try:
+        yield httpd
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@pytest.fixture
+def make_fetcher(tmp_path):
+    fetchers = []
+
+    def make(**options):
+        options = {"cache_dir": str(tmp_path / "http_cache"), "cache_max_bytes": 0, "max_bytes": 1024 * 1024,
+                   "per_host": 4, "timeout": 5, **options}
+        fetcher = CachedHTTPFetcher(**options)
+        fetchers.append(fetcher)
+        return fetcher
+
+    yield make
+    for fetcher in fetchers:
+        fetcher.session.close()
+
+
+def _requests_to(server, path: str) -> list:
+    with server.lock:
+        return [headers for request_path, headers in server.requests if request_path == path]
+
+
+def test_etag_revalidation_uses_cached_body(server, make_fetcher):
+    fetcher = make_fetcher()
+    first = fetcher.fetch(f"{server.url}/etag")
+    second = fetcher.fetch(f"{server.url}/etag")
+
+    assert first["string"] == second["string"] == b"etag body"
+    assert second["mime_type"] == "image/png"
+    requests = _requests_to(server, "/etag")
+    assert len(requests) == 2
+    assert "If-None-Match" not in requests[0]
+    assert requests[1]["If-None-Match"] == ETAG
+    assert fetcher.stats()["misses"] == 1
+    assert fetcher.stats()["revalidated"] == 1
+
+
+def test_last_modified_revalidation(server, make_fetcher):
+    fetcher = make_fetcher()
+    fetcher.fetch(f"{server.url}/last-modified")
+    result = fetcher.fetch(f"{server.url}/last-modified")
+
+    assert result["string"] == b"lm body"
+    requests = _requests_to(server, "/last-modified")
+    assert requests[1]["If-Modified-Since"] == LAST_MODIFIED
+    assert fetcher.stats()["revalidated"] == 1
+
+
+def test_max_age_served_from_cache_without_request(server, make_fetcher):
+    fetcher = make_fetcher()
+    fetcher.fetch(f"{server.url}/max-age")
+    result = fetcher.fetch(f"{server.url}/max-age")
+
+    assert result["string"] == b"fresh body"
+    assert len(_requests_to(server, "/max-age")) == 1
+    assert fetcher.stats()["hits"] == 1
+
+
+def test_cache_persists_across_fetcher_instances(server, make_fetcher):
+    make_fetcher().fetch(f"{server.url}/max-age")
+    result = make_fetcher().fetch(f"{server.url}/max-age")
+
+    assert result["string"] == b"fresh body"
+    assert len(_requests_to(server, "/max-age")) == 1
+
+
+def test_no_store_is_not_cached(server, make_fetcher):
+    fetcher = make_fetcher()
+    fetcher.fetch(f"{server.url}/no-store")
+    fetcher.fetch(f"{server.url}/no-store")
+
+    assert len(_requests_to(server, "/no-store")) == 2
+    assert fetcher.stats()["misses"] == 2
+
+
+def test_cache_size_bound_evicts_least_recently_used(server, make_fetcher):
+    # Mỗi mục khoảng 4KB (body + metadata): giới hạn 10KB giữ được hai mục
+    fetcher = make_fetcher(cache_max_bytes=10 * 1024)
+    urls = [f"{server.url}/blob?size=4000&n={n}" for n in range(3)]
+    paths = [fetcher.cache._path(make_cache_key("http", url)) for url in urls]
+
+    fetcher.fetch(urls[0])
+    fetcher.fetch(urls[1])
+    # Đặt mtime cũ rõ ràng để thứ tự LRU không phụ thuộc độ phân giải mtime của hệ thống file
+    old = time.time() - 100
+    os.utime(paths[0], (old, old))
+    os.utime(paths[1], (old + 1, old + 1))
+    # Đọc lại urls[0] (hit) làm nó thành mục dùng gần nhất, urls[1] là mục ít dùng nhất
+    fetcher.fetch(urls[0])
+    fetcher.fetch(urls[2])
+
+    assert os.path.exists(paths[0])
+    assert not os.path.exists(paths[1])
+    assert os.path.exists(paths[2])
+    stats = fetcher.stats()["disk"]
+    assert stats["bytes"] <= 10 * 1024
+    assert stats["evictions"] == 1
+
+
+def test_per_host_concurrency_limit(server, make_fetcher):
+    fetcher = make_fetcher(per_host=2)
+    urls = [f"{server.url}/slow?n={n}" for n in range(6)]
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        results = list(pool.map(fetcher.fetch, urls))
+
+    assert all(result["string"] == b"slow" for result in results)
+    assert server.max_active == 2
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_max_bytes_rejects_large_resource(server, make_fetcher, chunked):
+    fetcher = make_fetcher(max_bytes=1000)
+    flag = "1" if chunked else "0"
+
+    assert fetcher.fetch(f"{server.url}/large?size=1000&chunked={flag}")["string"] == b"y" * 1000
+    with pytest.raises(ResourceTooLarge):
+        fetcher.fetch(f"{server.url}/large?size=1001&chunked={flag}")
+    assert fetcher.stats()["errors"] == 1
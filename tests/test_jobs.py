@@ -0,0 +1,288 @@
+"""
+JobRunner (app/services/jobs.py) chạy trên bảng conversion_jobs thật: nhận job (SKIP LOCKED), job 'running'
+quá hạn lease được nhận lại, JOB_MAX_ATTEMPTS, worker trong process và dọn job hết hạn.
+
+Mặc định dùng SQLite (file tạm); đặt TEST_DATABASE_URL=postgresql://... (database dùng riêng cho test, bảng
+conversion_jobs bị xóa sạch) để chạy trên Postgres, gồm cả test SKIP LOCKED với hai kết nối song song.
+"""
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from app.core.config import settings
+from app.core.database import Base
+from app.models import ConversionJob
+from app.services import jobs as jobs_module
+from app.services import profiling
+from app.services.jobs import JobRunner
+from app.services.render_executor import RenderQueueFull
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def engine(tmp_path):
+    if TEST_DATABASE_URL:
+        engine = create_engine(TEST_DATABASE_URL)
+    else:
+        # timeout: các thread worker ghi cùng một file SQLite thì chờ nhau thay vì lỗi ngay
+        engine = create_engine(f"sqlite:///{tmp_path / 'jobs.sqlite'}", connect_args={"check_same_thread": False, "timeout": 30})
+
+        # SQLite bỏ qua FOR UPDATE: mỗi transaction lấy khóa ghi ngay từ đầu (BEGIN IMMEDIATE),
+        # để hai worker không cùng đọc được một job 'pending' như khi Postgres khóa dòng
+        @event.listens_for(engine, "connect")
+        def _connect(dbapi_connection, connection_record):
+            dbapi_connection.isolation_level = None
+
+        @event.listens_for(engine, "begin")
+        def _begin(conn):
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(ConversionJob.__table__.delete())
+    yield engine
+    with engine.begin() as conn:
+        conn.execute(ConversionJob.__table__.delete())
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture
+def removed_objects(monkeypatch):
+    """Ghi lại object bị xóa trên storage thay vì gọi MinIO; không dọn blob trong các test này."""
+    removed = []
+    monkeypatch.setattr(jobs_module.storage_service, "remove_object", removed.append)
+    monkeypatch.setattr(jobs_module.blob_store, "sweep_pending", lambda db: 0)
+    return removed
+
+
+@pytest.fixture
+def runner(session_factory, removed_objects):
+    runner = JobRunner(session_factory=session_factory, poll_interval=0.05)
+    yield runner
+    runner.stop(timeout=5)
+
+
+def _submit(runner, count: int = 1, kind: str = "test") -> list:
+    db = runner.session_factory()
+    try:
+        return [runner.submit(db, kind=kind, content=f"job {i}").id for i in range(count)]
+    finally:
+        db.close()
+
+
+def _job(runner, job_id: str) -> ConversionJob:
+    db = runner.session_factory()
+    try:
+        return db.get(ConversionJob, job_id)
+    finally:
+        db.close()
+
+
+def _update(runner, job_id: str, **fields):
+    db = runner.session_factory()
+    try:
+        job = db.get(ConversionJob, job_id)
+        for name, value in fields.items():
+            setattr(job, name, value)
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_run_once_processes_job(runner):
+    runner.register("test", lambda db, job: f"jobs/{job.id}.pdf")
+    (job_id,) = _submit(runner)
+
+    assert runner.run_once()
+    assert not runner.run_once()
+
+    job = _job(runner, job_id)
+    assert job.status == "succeeded"
+    assert job.result_path == f"jobs/{job_id}.pdf"
+    assert job.attempts == 1
+    assert job.finished_at is not None
+
+
+def test_job_runs_in_profile_context_of_submitting_request(runner):
+    contexts = []
+    runner.register("test", lambda db, job: contexts.append(profiling.current_request()))
+    with profiling.request_context("req-1", explicit=True):
+        _submit(runner)
+    (job_id,) = _submit(runner)
+
+    assert runner.run_once()
+    assert runner.run_once()
+
+    assert contexts == [
+        {"request_id": "req-1", "explicit": True},
+        {"request_id": f"job-{job_id}", "explicit": False},
+    ]
+
+
+def test_claim_takes_oldest_pending_job(runner):
+    first, second = _submit(runner, 2)
+    _update(runner, first, created_at=datetime.utcnow() - timedelta(minutes=1))
+
+    db = runner.session_factory()
+    try:
+        assert runner.claim(db).id == first
+        assert runner.claim(db).id == second
+        assert runner.claim(db) is None
+    finally:
+        db.close()
+
+
+@pytest.mark.skipif(not (TEST_DATABASE_URL or "").startswith("postgresql"), reason="SKIP LOCKED cần Postgres (TEST_DATABASE_URL)")
+def test_claim_skips_rows_locked_by_another_worker(runner):
+    locked, free = _submit(runner, 2)
+    _update(runner, locked, created_at=datetime.utcnow() - timedelta(minutes=1))
+
+    # Worker khác đang giữ khóa dòng job cũ nhất (đang trong lúc nhận job)
+    other = runner.session_factory()
+    try:
+        other.query(ConversionJob).filter(ConversionJob.id == locked).with_for_update().one()
+        db = runner.session_factory()
+        try:
+            assert runner.claim(db).id == free
+        finally:
+            db.close()
+    finally:
+        other.rollback()
+        other.close()
+
+
+def test_running_job_within_lease_is_not_claimed(runner):
+    (job_id,) = _submit(runner)
+    _update(runner, job_id, status="running", attempts=1, started_at=datetime.utcnow())
+
+    assert not runner.run_once()
+    assert _job(runner, job_id).status == "running"
+
+
+def test_expired_lease_is_requeued(runner, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_LEASE_SECONDS", 60)
+    runner.register("test", lambda db, job: "jobs/result.pdf")
+    (job_id,) = _submit(runner)
+    # Worker trước nhận job rồi chết: job kẹt ở 'running' quá hạn lease
+    _update(runner, job_id, status="running", attempts=1, started_at=datetime.utcnow() - timedelta(seconds=61))
+
+    assert runner.run_once()
+
+    job = _job(runner, job_id)
+    assert job.status == "succeeded"
+    assert job.attempts == 2
+
+
+def test_max_attempts_marks_job_failed(runner, monkeypatch):
+    monkeypatch.setattr(settings, "JOB_LEASE_SECONDS", 60)
+    monkeypatch.setattr(settings, "JOB_MAX_ATTEMPTS", 3)
+    handled = []
+    runner.register("test", lambda db, job: handled.append(job.id))
+    (job_id,) = _submit(runner)
+    _update(runner, job_id, status="running", attempts=3, started_at=datetime.utcnow() - timedelta(seconds=61))
+
+    assert not runner.run_once()
+
+    job = _job(runner, job_id)
+    assert job.status == "failed"
+    assert job.error == "Vượt quá số lần thử tối đa."
+    assert job.attempts == 4
+    assert not handled
+    # Job đã thất bại không được nhận lại
+    assert not runner.run_once()
+
+
+def test_handler_error_marks_job_failed(runner):
+    def fail(db, job):
+        raise RuntimeError("render failed")
+
+    runner.register("test", fail)
+    (job_id,) = _submit(runner)
+
+    assert runner.run_once()
+
+    job = _job(runner, job_id)
+    assert job.status == "failed"
+    assert job.error == "render failed"
+
+
+def test_queue_full_returns_job_without_counting_attempt(runner):
+    calls = []
+
+    def handler(db, job):
+        calls.append(job.id)
+        if len(calls) == 1:
+            raise RenderQueueFull(0)
+        return "jobs/result.pdf"
+
+    runner.register("test", handler)
+    (job_id,) = _submit(runner)
+
+    assert runner.run_once()
+    job = _job(runner, job_id)
+    assert job.status == "pending"
+    assert job.attempts == 0
+
+    assert runner.run_once()
+    job = _job(runner, job_id)
+    assert job.status == "succeeded"
+    assert job.attempts == 1
+
+
+def test_workers_process_each_job_once(runner):
+    handled = Counter()
+    lock = threading.Lock()
+
+    def handler(db, job):
+        with lock:
+            handled[job.id] += 1
+        time.sleep(0.01)
+        return f"jobs/{job.id}.pdf"
+
+    runner.register("test", handler)
+    job_ids = _submit(runner, 20)
+    runner.start(workers=4)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        statuses = [_job(runner, job_id).status for job_id in job_ids]
+        if all(status == "succeeded" for status in statuses):
+            break
+        time.sleep(0.05)
+    runner.stop(timeout=5)
+
+    assert [_job(runner, job_id).status for job_id in job_ids] == ["succeeded"] * len(job_ids)
+    assert handled == Counter({job_id: 1 for job_id in job_ids})
+
+
+def test_cleanup_removes_expired_jobs_and_their_results(runner, removed_objects):
+    old_export, new_export, old_document, pending = _submit(runner, 4)
+    expired = datetime.utcnow() - timedelta(hours=2)
+    _update(runner, old_export, status="succeeded", finished_at=expired, result_path=f"jobs/{old_export}.pdf")
+    _update(runner, new_export, status="succeeded", finished_at=datetime.utcnow(), result_path=f"jobs/{new_export}.pdf")
+    # Job tài liệu trỏ tới PDF của version, do version quản lý
+    _update(runner, old_document, status="succeeded", finished_at=expired, result_path="blobs/ab/abcd")
+
+    db = runner.session_factory()
+    try:
+        assert runner.cleanup(db, ttl_seconds=3600) == 2
+    finally:
+        db.close()
+
+    assert _job(runner, old_export) is None
+    assert _job(runner, old_document) is None
+    assert _job(runner, new_export) is not None
+    assert _job(runner, pending) is not None
+    assert removed_objects == [f"jobs/{old_export}.pdf"]